@@ -0,0 +1,537 @@
+import math
+from collections import deque
+
+import numpy as np
+
+AVERAGE_MODE_WINDOW = 'window'
+AVERAGE_MODE_EXPONENTIAL = 'exp'
+
+
+class RunningAverage:
+    '''
+    The mean of a sliding window of equal length arrays, maintained as a running sum which is added to as arrays enter
+    the window and subtracted from as they leave.
+    '''
+
+    def __init__(self):
+        self.__window = deque()
+        self.__sum = None
+
+    def __len__(self):
+        return len(self.__window)
+
+    def add(self, y):
+        '''
+        Adds an array to the end of the window.
+        :param y: the array.
+        '''
+        if self.__sum is None:
+            self.__sum = np.array(y, dtype=np.result_type(y, np.float64))
+        else:
+            self.__sum += y
+        self.__window.append(y)
+
+    def evict(self):
+        ''' Removes the oldest array from the window. '''
+        y = self.__window.popleft()
+        if self.__window:
+            self.__sum -= y
+        else:
+            self.__sum = None
+
+    @property
+    def value(self):
+        return None if self.__sum is None else self.__sum / len(self.__window)
+
+
+class ExponentialAverage:
+    '''
+    An exponentially weighted average, the window is infinite so evicting an array has no effect.
+    '''
+
+    def __init__(self, alpha):
+        '''
+        :param alpha: the weight given to each new array.
+        '''
+        self.__alpha = alpha
+        self.__value = None
+        self.__scratch = None
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    @property
+    def alpha(self):
+        return self.__alpha
+
+    @alpha.setter
+    def alpha(self, alpha):
+        self.__alpha = alpha
+
+    def add(self, y):
+        '''
+        Adds an array to the average.
+        :param y: the array.
+        '''
+        if self.__value is None:
+            self.__value = np.array(y, dtype=np.result_type(y, np.float64))
+            self.__scratch = np.empty_like(self.__value)
+        else:
+            np.subtract(y, self.__value, out=self.__scratch)
+            self.__scratch *= self.__alpha
+            self.__value += self.__scratch
+        self.__count += 1
+
+    def evict(self):
+        self.__count -= 1
+        if self.__count == 0:
+            self.__value = None
+
+    @property
+    def value(self):
+        return None if self.__value is None else self.__value.copy()
+
+    @staticmethod
+    def alpha_for(time_constant, interval):
+        '''
+        :param time_constant: the time constant of the average in seconds.
+        :param interval: the time between each array in seconds.
+        :return: the weight to give to each new array.
+        '''
+        return 1.0 - math.exp(-interval / time_constant) if time_constant > 0 else 1.0
+
+
+class MaxQueue:
+    '''
+    The element wise max of a sliding window of equal length arrays. Arrays are pushed onto an input stack which tracks
+    its own max, when the oldest array is evicted the input stack is moved onto an output stack in which each entry
+    holds the max of itself and every newer entry in that stack. Every array is therefore visited a bounded number of
+    times so add, evict and value are all O(bins) in the amortised case.
+    '''
+
+    def __init__(self):
+        self.__in = []
+        self.__in_max = None
+        self.__out = []
+
+    def __len__(self):
+        return len(self.__in) + len(self.__out)
+
+    def add(self, y):
+        '''
+        Adds an array to the end of the window.
+        :param y: the array.
+        '''
+        self.__in.append(y)
+        if self.__in_max is None:
+            self.__in_max = np.array(y)
+        else:
+            np.maximum(self.__in_max, y, out=self.__in_max)
+
+    def evict(self):
+        ''' Removes the oldest array from the window. '''
+        if not self.__out:
+            running = None
+            for y in reversed(self.__in):
+                running = np.array(y) if running is None else np.maximum(running, y)
+                self.__out.append(running)
+            self.__in = []
+            self.__in_max = None
+        self.__out.pop()
+
+    @property
+    def value(self):
+        if self.__out:
+            return self.__out[-1].copy() if self.__in_max is None else np.maximum(self.__out[-1], self.__in_max)
+        return None if self.__in_max is None else self.__in_max.copy()
+
+
+class SpectraRing:
+    '''
+    A ring of equal length spectra stored as the rows of a preallocated 2D array, the array doubles in size if it is
+    full when a spectrum is appended.
+    '''
+
+    def __init__(self, bins, capacity=64, dtype=np.float32):
+        '''
+        :param bins: the length of each spectrum.
+        :param capacity: the initial number of spectra which can be held.
+        :param dtype: the storage type.
+        '''
+        self.__buffer = np.empty((max(1, capacity), bins), dtype=dtype)
+        self.__head = 0
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def __iter__(self):
+        capacity = self.__buffer.shape[0]
+        for i in range(self.__count):
+            yield self.__buffer[(self.__head + i) % capacity]
+
+    @property
+    def bins(self):
+        return self.__buffer.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.__buffer.nbytes
+
+    def append(self, y):
+        '''
+        Copies a spectrum into the next free row.
+        :param y: the spectrum.
+        :return: the row.
+        '''
+        if self.__count == self.__buffer.shape[0]:
+            self.__grow()
+        row = self.__buffer[(self.__head + self.__count) % self.__buffer.shape[0]]
+        row[:] = y
+        self.__count += 1
+        return row
+
+    def evict(self):
+        ''' Releases the oldest row. '''
+        self.__head = (self.__head + 1) % self.__buffer.shape[0]
+        self.__count -= 1
+
+    def __grow(self):
+        capacity = self.__buffer.shape[0]
+        grown = np.empty((capacity * 2, self.bins), dtype=self.__buffer.dtype)
+        grown[:self.__count] = self.__buffer[(self.__head + np.arange(self.__count)) % capacity]
+        self.__buffer = grown
+        self.__head = 0
+
+
+class HoldAccumulator:
+    '''
+    Holds the spectra of each axis of a sequence of TriAxisSignals for a particular view along with the running average
+    and peak of those spectra. Only the spectra and the time of each signal are retained, a signal which has not been
+    analysed for the view yet is kept as is until accumulate is called. A signal which has no analysis for the view, or
+    which does not match the required segment length, is tracked but excluded from both results and no result is
+    available for that axis until it is evicted.
+    '''
+
+    def __init__(self, view, min_nperseg, average_mode=AVERAGE_MODE_WINDOW, alpha=1.0, capacity=64):
+        '''
+        :param view: the view to accumulate.
+        :param min_nperseg: the minimum length of a signal for it to be included.
+        :param average_mode: window or exp.
+        :param alpha: the weight of each new signal if average_mode is exp.
+        :param capacity: the number of signals expected to be held.
+        '''
+        self.__view = view
+        self.__min_nperseg = min_nperseg
+        self.__capacity = capacity
+        self.__times = deque()
+        self.__pending = deque()
+        self.__average_mode = None
+        self.__alpha = alpha
+        self.__axes = ['x', 'y', 'z', 'sum']
+        self.__average = {}
+        self.__peak = {axis: MaxQueue() for axis in self.__axes}
+        self.__spectra = {axis: None for axis in self.__axes}
+        self.__included = {axis: deque() for axis in self.__axes}
+        self.__excluded = {axis: 0 for axis in self.__axes}
+        self.__results = {}
+        self.set_average_mode(average_mode, alpha)
+
+    @property
+    def view(self):
+        return self.__view
+
+    @property
+    def min_nperseg(self):
+        return self.__min_nperseg
+
+    @property
+    def pending(self):
+        return list(self.__pending)
+
+    @property
+    def nbytes(self):
+        return sum(s.nbytes for s in self.__spectra.values() if s is not None)
+
+    def __len__(self):
+        return len(self.__times)
+
+    def set_average_mode(self, average_mode, alpha):
+        '''
+        Changes how the spectra are averaged, the average is recalculated from the held spectra.
+        :param average_mode: window or exp.
+        :param alpha: the weight of each new signal if average_mode is exp.
+        '''
+        self.__alpha = alpha
+        self.__results = {}
+        if average_mode != self.__average_mode:
+            self.__average_mode = average_mode
+            for axis in self.__axes:
+                average = ExponentialAverage(alpha) if average_mode == AVERAGE_MODE_EXPONENTIAL else RunningAverage()
+                if self.__spectra[axis] is not None:
+                    for y in self.__spectra[axis]:
+                        average.add(y)
+                self.__average[axis] = average
+        elif average_mode == AVERAGE_MODE_EXPONENTIAL:
+            for average in self.__average.values():
+                average.alpha = alpha
+
+    def add(self, signal):
+        '''
+        Adds the next signal, it is accumulated immediately if it has already been analysed for the view.
+        :param signal: the TriAxisSignal.
+        '''
+        if not self.__pending and signal.view == self.__view and signal.has_data(self.__view):
+            self.__append(signal)
+        else:
+            self.__pending.append(signal)
+
+    def accumulate(self, analyse):
+        '''
+        Accumulates all pending signals.
+        :param analyse: a function which ensures a signal has been analysed for the view.
+        '''
+        while self.__pending:
+            signal = self.__pending.popleft()
+            analyse(signal)
+            self.__append(signal)
+
+    def __append(self, signal):
+        self.__results = {}
+        for axis, included in self.__included.items():
+            analysis = getattr(signal, axis).get_analysis(self.__view)
+            spectra = self.__spectra[axis]
+            ok = analysis is not None and signal.shape[0] >= self.__min_nperseg and \
+                (spectra is None or spectra.bins == analysis.y.shape[-1])
+            if ok:
+                if spectra is None:
+                    spectra = self.__spectra[axis] = SpectraRing(analysis.y.shape[-1], capacity=self.__capacity)
+                y = spectra.append(analysis.y)
+                self.__average[axis].add(y)
+                self.__peak[axis].add(y)
+            else:
+                self.__excluded[axis] += 1
+            included.append(ok)
+        self.__times.append(signal.time[-1])
+
+    def purge(self, max_age_millis):
+        '''
+        Evicts all but the latest signal which are older than the max age relative to the latest signal.
+        :param max_age_millis: the max age.
+        '''
+        if self.__pending or self.__times:
+            latest = self.__pending[-1].time[-1] if self.__pending else self.__times[-1]
+            while len(self.__times) + len(self.__pending) > 1:
+                oldest = self.__times[0] if self.__times else self.__pending[0].time[-1]
+                if (latest - oldest) >= max_age_millis:
+                    self.evict()
+                else:
+                    break
+
+    def evict(self):
+        ''' Removes the oldest signal. '''
+        if not self.__times:
+            self.__pending.popleft()
+            return
+        self.__times.popleft()
+        self.__results = {}
+        for axis, included in self.__included.items():
+            if included.popleft():
+                self.__average[axis].evict()
+                self.__peak[axis].evict()
+                self.__spectra[axis].evict()
+            else:
+                self.__excluded[axis] -= 1
+
+    def average(self, axis):
+        '''
+        :param axis: the axis.
+        :return: the average of the accumulated signals or None if there is no valid average, the same array is
+        returned until the accumulated signals change.
+        '''
+        return self.__get_result(self.__average, axis)
+
+    def peak(self, axis):
+        '''
+        :param axis: the axis.
+        :return: the peak of the accumulated signals or None if there is no valid peak, the same array is returned
+        until the accumulated signals change.
+        '''
+        return self.__get_result(self.__peak, axis)
+
+    def __get_result(self, accumulators, axis):
+        key = (id(accumulators), axis)
+        if key not in self.__results:
+            self.__results[key] = accumulators[axis].value if self.__excluded[axis] == 0 else None
+        return self.__results[key]
+
+
+class CrossSpectrum:
+    '''
+    The averaged auto spectra (Sxx, Syy) and cross spectrum (Sxy) of each axis of a pair of measurements, i.e. an input
+    (e.g. a recorder on a source) and an output (e.g. a recorder on the structure it is mounted on). The latest signal
+    from each measurement is held until a signal arrives from the other, the pair is then reduced to the mean over the
+    segment FFTs which have already been computed for the avg view and added to running averages. The averages are
+    therefore updated once per tick without recomputing the cross spectrum over the whole hold time.
+    '''
+
+    def __init__(self, input_name, output_name, min_nperseg, average_mode=AVERAGE_MODE_WINDOW, alpha=1.0):
+        '''
+        :param input_name: the input measurement.
+        :param output_name: the output measurement.
+        :param min_nperseg: the minimum length of a signal for it to be included.
+        :param average_mode: window or exp.
+        :param alpha: the weight of each new pair if average_mode is exp.
+        '''
+        self.__input_name = input_name
+        self.__output_name = output_name
+        self.__min_nperseg = min_nperseg
+        self.__average_mode = average_mode
+        self.__alpha = alpha
+        self.__axes = ['x', 'y', 'z']
+        self.__latest = {input_name: None, output_name: None}
+        self.__times = deque()
+        self.__f = None
+        self.__averages = {}
+        self.__results = {}
+        self.__reset()
+
+    @property
+    def input_name(self):
+        return self.__input_name
+
+    @property
+    def output_name(self):
+        return self.__output_name
+
+    @property
+    def min_nperseg(self):
+        return self.__min_nperseg
+
+    @property
+    def f(self):
+        return self.__f
+
+    def __len__(self):
+        return len(self.__times)
+
+    def __reset(self):
+        self.__times.clear()
+        self.__results = {}
+        self.__averages = {
+            axis: [ExponentialAverage(self.__alpha) if self.__average_mode == AVERAGE_MODE_EXPONENTIAL
+                   else RunningAverage() for _ in range(3)]
+            for axis in self.__axes
+        }
+
+    def set_average_mode(self, average_mode, alpha):
+        '''
+        Changes how the spectra are averaged, the spectra of each pair are not retained so the averages start again if
+        the mode changes.
+        :param average_mode: window or exp.
+        :param alpha: the weight of each new pair if average_mode is exp.
+        '''
+        self.__alpha = alpha
+        if average_mode != self.__average_mode:
+            self.__average_mode = average_mode
+            self.__reset()
+        elif average_mode == AVERAGE_MODE_EXPONENTIAL:
+            for averages in self.__averages.values():
+                for average in averages:
+                    average.alpha = alpha
+
+    def add(self, signal):
+        '''
+        Adds the next signal from either measurement, signals from any other measurement are ignored. A signal is only
+        paired with a signal from the other measurement which covers an overlapping time range, a signal which ends
+        before the latest signal from the other measurement starts can never be paired so it is discarded.
+        :param signal: the TriAxisSignal.
+        :return: true if the signal completed a pair.
+        '''
+        if signal.measurement_name not in self.__latest or signal.shape[0] < self.__min_nperseg:
+            return False
+        self.__latest[signal.measurement_name] = signal
+        source = self.__latest[self.__input_name]
+        response = self.__latest[self.__output_name]
+        if source is None or response is None:
+            return False
+        if source.time[-1] < response.time[0]:
+            self.__latest[self.__input_name] = None
+            return False
+        if response.time[-1] < source.time[0]:
+            self.__latest[self.__output_name] = None
+            return False
+        self.__latest = {self.__input_name: None, self.__output_name: None}
+        spectra = {axis: cross_spectra(getattr(source, axis).avg_stft, getattr(response, axis).avg_stft)
+                   for axis in self.__axes}
+        if any(s is None for s in spectra.values()):
+            return False
+        f = getattr(source, self.__axes[0]).avg_stft.f
+        if self.__f is not None and self.__f.size != f.size:
+            self.__reset()
+        self.__f = f
+        self.__results = {}
+        for axis, values in spectra.items():
+            for average, value in zip(self.__averages[axis], values):
+                average.add(value)
+        self.__times.append(source.time[-1])
+        return True
+
+    def purge(self, max_age_millis):
+        '''
+        Evicts all but the latest pair which are older than the max age relative to the latest pair.
+        :param max_age_millis: the max age.
+        '''
+        while len(self.__times) > 1 and (self.__times[-1] - self.__times[0]) >= max_age_millis:
+            self.__times.popleft()
+            self.__results = {}
+            for averages in self.__averages.values():
+                for average in averages:
+                    average.evict()
+
+    def transfer_function(self, axis):
+        '''
+        :param axis: the axis.
+        :return: the H1 estimate of the transfer function, i.e. Sxy / Sxx, or None if no pair has been accumulated.
+        '''
+        return self.__get_result('h1', axis)
+
+    def coherence(self, axis):
+        '''
+        :param axis: the axis.
+        :return: the magnitude squared coherence, i.e. |Sxy|^2 / (Sxx.Syy), or None if no pair has been accumulated.
+        '''
+        return self.__get_result('coherence', axis)
+
+    def __get_result(self, kind, axis):
+        key = (kind, axis)
+        if key not in self.__results:
+            sxx, syy, sxy = (a.value for a in self.__averages[axis])
+            if sxx is None:
+                return None
+            if kind == 'h1':
+                result = np.divide(sxy, sxx, out=np.zeros_like(sxy), where=sxx > 0)
+            else:
+                denominator = sxx * syy
+                result = np.divide(np.square(np.abs(sxy)), denominator, out=np.zeros_like(sxx),
+                                   where=denominator > 0)
+            self.__results[key] = result
+        return self.__results[key]
+
+
+def cross_spectra(source, response):
+    '''
+    Reduces the segment FFTs of a pair of signals to the mean auto and cross spectra, the latest segments of each are
+    paired so any surplus segments at the start of the longer signal are ignored.
+    :param source: the STFT of the input.
+    :param response: the STFT of the output.
+    :return: Sxx, Syy, Sxy or None if the STFTs have a different frequency resolution.
+    '''
+    if source.f.size != response.f.size or source.fs != response.fs:
+        return None
+    count = min(source.segment_ffts.shape[0], response.segment_ffts.shape[0])
+    x = source.segment_ffts[-count:]
+    y = response.segment_ffts[-count:]
+    sxy = np.mean(np.conj(x) * y, axis=0)
+    return source.spectrum[-count:].mean(axis=0), response.spectrum[-count:].mean(axis=0), sxy
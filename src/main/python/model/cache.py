@@ -0,0 +1,144 @@
+import logging
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger('qvibe.cache')
+
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def nbytes(value):
+    '''
+    :param value: a cached value.
+    :return: the size of the value in bytes.
+    '''
+    return value.nbytes if hasattr(value, 'nbytes') else 0
+
+
+class AnalysisCache:
+    '''
+    A thread safe LRU cache of intermediate analysis results (e.g. filtered data and STFTs) which is shared by all the
+    charts. The cache is bounded by the total size of the values it holds, the least recently used values are evicted
+    when that is exceeded. If a value is requested while another thread is computing it then the request waits for
+    that computation to complete rather than repeating it.
+    '''
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        '''
+        :param max_bytes: the byte budget.
+        '''
+        self.__max_bytes = max_bytes
+        self.__entries = OrderedDict()
+        self.__in_flight = {}
+        self.__lock = threading.Lock()
+        self.__bytes = 0
+        self.__hits = 0
+        self.__misses = 0
+
+    @property
+    def max_bytes(self):
+        return self.__max_bytes
+
+    @property
+    def nbytes(self):
+        return self.__bytes
+
+    @property
+    def hits(self):
+        return self.__hits
+
+    @property
+    def misses(self):
+        return self.__misses
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def get(self, key, compute):
+        '''
+        Provides the cached value, computing it if necessary.
+        :param key: the key.
+        :param compute: a function which computes the value.
+        :return: the value.
+        '''
+        while True:
+            with self.__lock:
+                entry = self.__entries.get(key, None)
+                if entry is not None:
+                    self.__entries.move_to_end(key)
+                    self.__hits += 1
+                    return entry[0]
+                in_flight = self.__in_flight.get(key, None)
+                if in_flight is None:
+                    self.__in_flight[key] = threading.Event()
+                    self.__misses += 1
+                    break
+            # another thread is computing this value, if it fails then the loop tries again
+            in_flight.wait()
+        try:
+            value = compute()
+            self.__put(key, value)
+            return value
+        finally:
+            with self.__lock:
+                self.__in_flight.pop(key).set()
+
+    def __put(self, key, value):
+        size = nbytes(value)
+        if size > self.__max_bytes:
+            return
+        with self.__lock:
+            self.__entries[key] = (value, size)
+            self.__bytes += size
+            while self.__bytes > self.__max_bytes:
+                _, (_, evicted) = self.__entries.popitem(last=False)
+                self.__bytes -= evicted
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+
+def get_analysis_cache():
+    '''
+    :return: the shared analysis cache.
+    '''
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnalysisCache()
+    return _cache
+
+
+def configure_analysis_cache(max_bytes):
+    '''
+    Replaces the shared analysis cache if the byte budget has changed.
+    :param max_bytes: the byte budget.
+    :return: the cache.
+    '''
+    global _cache
+    with _cache_lock:
+        if _cache is None or _cache.max_bytes != max_bytes:
+            _cache = AnalysisCache(max_bytes)
+            logger.info(f"Analysis cache is limited to {max_bytes / 1024 / 1024:.1f}MB")
+    return _cache
+
+
+def fingerprint(data):
+    '''
+    :param data: an array.
+    :return: a checksum of the contents of the array so that a key can distinguish between different data which happens
+    to have the same sample range (e.g. when a recorder is restarted).
+    '''
+    return zlib.crc32(np.ascontiguousarray(data).view(np.uint8))
@@ -1,89 +1,293 @@
 import abc
 import logging
 import math
+import threading
 import time
-from queue import Queue, Empty
+from collections import deque, namedtuple, Counter
 
-from collections import deque
 from qtpy.QtCore import QObject, Signal, QThread, QTimer
 
 from common import colourmap
+from model.decimation import get_analysis_fs
 from model.log import to_millis
+from model.pool import get_analysis_pool
+from model.preferences import ANALYSIS_TARGET_FS, ANALYSIS_QUEUE_LIMIT
 from model.signal import TriAxisSignal, get_segment_length
 
 logger = logging.getLogger('qvibe.charts')
 
 
-class ChartProcessor(QThread):
+# the priority of the events for a chart, lowest first
+PRIORITY_VISIBLE = 0
+PRIORITY_HIDDEN_MEASUREMENT = 1
+PRIORITY_HIDDEN_CHART = 2
 
-    def __init__(self, coalesce=False):
-        super().__init__()
-        self.queue = Queue()
-        self.running = True
-        self.__coalesce = coalesce
+DEFAULT_SCHEDULER_THREADS = 2
+
+# what to do when more events are queued for a chart and measurement than the queue limit allows
+OVERLOAD_DROP_OLDEST = 'drop oldest'
+# only the latest event is ever queued
+OVERLOAD_COALESCE = 'coalesce'
+# the queued events are merged into a single event, if the events support it, otherwise the oldest are dropped
+OVERLOAD_MERGE = 'merge'
+OVERLOAD_POLICIES = [OVERLOAD_DROP_OLDEST, OVERLOAD_COALESCE, OVERLOAD_MERGE]
+
+_scheduler = None
+_scheduler_stopped = False
+_scheduler_lock = threading.Lock()
+
+SchedulerMetrics = namedtuple('SchedulerMetrics', ['depth', 'processed', 'mean_wait_millis', 'max_wait_millis'])
+
+
+class Lane:
+    ''' The queued events for a single chart and measurement. '''
+
+    def __init__(self, chart, measurement_name):
+        self.chart = chart
+        self.measurement_name = measurement_name
+        self.events = deque()
+        self.busy = False
 
-    def stop(self):
-        self.running = False
+
+class ChartWorker(QThread):
+
+    def __init__(self, scheduler):
+        super().__init__()
+        self.__scheduler = scheduler
 
     def run(self):
-        while self.running is True:
+        while True:
+            work = self.__scheduler.take()
+            if work is None:
+                break
+            lane, event = work
+            deferred = False
+            event.on_done = lambda l=lane: self.__scheduler.release(l)
             try:
-                event = self.queue.get(timeout=1)
-                if event is not None:
-                    self.queue.task_done()
-                    if self.__coalesce is True:
-                        events = self.coalesce(event)
-                    else:
-                        events = [event]
-                    for e in events:
-                        if isinstance(e, ChartEvent):
-                            e.execute()
-                        else:
-                            logger.warning(f"{self.__class__.__name__} received unknown event {event.__class__.__name__}")
-            except Empty:
-                # ignore, don't care
-                pass
+                deferred = event.execute() is True
             except:
                 logger.exception('Unexpected exception during event processing')
+            finally:
+                # an event handed to the analysis pool holds the lane until it completes so the lane stays in order
+                if deferred is False:
+                    self.__scheduler.release(lane)
+
+
+class ChartScheduler:
+    '''
+    Processes the events for every chart on a small, fixed, pool of worker threads which caps the CPU used by the
+    charts. Events are queued in a lane per chart and measurement and each lane is processed in order, by one worker at
+    a time, as charts depend on the order in which they receive their data. A free worker takes the oldest event from
+    the lane with the highest priority, i.e. the visible measurements on the visible chart come first then the hidden
+    measurements on the visible chart and finally the hidden charts. Each lane is bounded by the queue limit of the
+    chart, the overload policy of the chart determines how the excess events are discarded.
+    '''
+
+    def __init__(self, threads):
+        '''
+        :param threads: the number of worker threads.
+        '''
+        self.__lanes = {}
+        self.__condition = threading.Condition()
+        self.__running = True
+        self.__sequence = 0
+        self.__processed = 0
+        self.__total_wait = 0.0
+        self.__max_wait = 0.0
+        self.__counters = {}
+        self.__workers = [ChartWorker(self) for _ in range(threads)]
+        for w in self.__workers:
+            w.start()
+        logger.info(f"Started chart scheduler with {threads} threads")
+
+    @property
+    def threads(self):
+        return len(self.__workers)
 
-    def coalesce(self, event):
+    @property
+    def depth(self):
+        ''' the number of queued events. '''
+        with self.__condition:
+            return sum(len(lane.events) for lane in self.__lanes.values())
+
+    def submit(self, event):
         '''
-        Yields the last event from the queue for each source.
-        :param event: the 1st event.
-        :return: the last event.
+        Queues the event.
+        :param event: the ChartEvent.
         '''
-        events = {event.measurement_name: event}
-        count = 0
-        while not self.queue.empty():
-            try:
-                e = self.queue.get(block=False, timeout=None)
-                if e is not None:
-                    events[e.measurement_name] = e
-                    self.queue.task_done()
-                    count += 1
-            except Empty:
-                continue
-        if count > 0:
-            logger.warning(f"Coalesced {count} {event.__class__.__name__} events")
-        return list(events.values())
+        key = (event.chart, event.measurement_name)
+        with self.__condition:
+            lane = self.__lanes.get(key, None)
+            if lane is None:
+                lane = self.__lanes[key] = Lane(event.chart, event.measurement_name)
+            self.__sequence += 1
+            lane.events.append((self.__sequence, time.time(), event))
+            self.__apply_overload_policy(lane)
+            self.__condition.notify()
+
+    def __apply_overload_policy(self, lane):
+        '''
+        Discards the events in excess of the limit for the lane.
+        :param lane: the lane.
+        '''
+        chart = lane.chart
+        counters = self.__counters.setdefault(chart, Counter())
+        if chart.overload_policy == OVERLOAD_COALESCE:
+            if len(lane.events) > 1:
+                counters['coalesced'] += len(lane.events) - 1
+                latest = lane.events.pop()
+                lane.events.clear()
+                lane.events.append(latest)
+        elif len(lane.events) > chart.queue_limit:
+            if chart.overload_policy == OVERLOAD_MERGE:
+                sequence, queued_at, latest = lane.events.pop()
+                older = [e for _, _, e in lane.events]
+                discarded = latest.merge(older, chart.max_merged_chunks)
+                if discarded is not None:
+                    # the merged event takes the place of the oldest so it keeps its place in the queue
+                    sequence, queued_at, _ = lane.events[0]
+                    lane.events.clear()
+                    counters['merged'] += len(older)
+                    counters['discarded chunks'] += discarded
+                lane.events.append((sequence, queued_at, latest))
+            while len(lane.events) > chart.queue_limit:
+                lane.events.popleft()
+                counters['dropped'] += 1
+
+    def take(self):
+        '''
+        Waits for the next event to process.
+        :return: the lane and the event or None if the scheduler has been stopped.
+        '''
+        with self.__condition:
+            while self.__running is True:
+                lane = self.__next_lane()
+                if lane is not None:
+                    lane.busy = True
+                    _, queued_at, event = lane.events.popleft()
+                    wait = time.time() - queued_at
+                    self.__processed += 1
+                    self.__total_wait += wait
+                    self.__max_wait = max(self.__max_wait, wait)
+                    return lane, event
+                self.__condition.wait(timeout=1)
+            return None
+
+    def __next_lane(self):
+        best = None
+        best_key = None
+        for lane in self.__lanes.values():
+            if lane.busy is False and lane.events:
+                key = (lane.chart.priority(lane.measurement_name), lane.events[0][0])
+                if best_key is None or key < best_key:
+                    best = lane
+                    best_key = key
+        return best
+
+    def release(self, lane):
+        '''
+        Allows the next event in the lane to be processed.
+        :param lane: the lane.
+        '''
+        with self.__condition:
+            lane.busy = False
+            self.__condition.notify()
+
+    def take_metrics(self):
+        '''
+        :return: the SchedulerMetrics since the last time the metrics were taken.
+        '''
+        with self.__condition:
+            depth = sum(len(lane.events) for lane in self.__lanes.values())
+            mean_wait = self.__total_wait / self.__processed if self.__processed > 0 else 0.0
+            metrics = SchedulerMetrics(depth, self.__processed, round(mean_wait * 1000, 3),
+                                       round(self.__max_wait * 1000, 3))
+            self.__processed = 0
+            self.__total_wait = 0.0
+            self.__max_wait = 0.0
+            return metrics
+
+    def counters(self, chart):
+        '''
+        :param chart: the chart.
+        :return: the number of events currently queued or in flight (being processed, including in the analysis pool)
+        for the chart along with the number of events (or chunks) which have been discarded by the overload policy of
+        the chart.
+        '''
+        with self.__condition:
+            counters = Counter(self.__counters.get(chart, {}))
+            lanes = [lane for lane in self.__lanes.values() if lane.chart is chart]
+            counters['queued'] = sum(len(lane.events) for lane in lanes)
+            counters['in flight'] = sum(1 for lane in lanes if lane.busy is True)
+            return counters
+
+    def stop(self, wait_millis=2000):
+        '''
+        Stops the workers.
+        :param wait_millis: how long to wait for each worker to finish.
+        '''
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+        for w in self.__workers:
+            w.wait(wait_millis)
+
+
+def get_chart_scheduler():
+    '''
+    :return: the shared chart scheduler, None once the scheduler has been stopped.
+    '''
+    global _scheduler
+    if _scheduler is None and _scheduler_stopped is False:
+        with _scheduler_lock:
+            if _scheduler is None and _scheduler_stopped is False:
+                _scheduler = ChartScheduler(DEFAULT_SCHEDULER_THREADS)
+    return _scheduler
+
+
+def configure_chart_scheduler(threads):
+    '''
+    Replaces the shared chart scheduler if the number of threads has changed.
+    :param threads: the number of worker threads, 0 stops the scheduler.
+    :return: the scheduler.
+    '''
+    global _scheduler, _scheduler_stopped
+    with _scheduler_lock:
+        _scheduler_stopped = threads <= 0
+        current = 0 if _scheduler is None else _scheduler.threads
+        if threads != current:
+            if _scheduler is not None:
+                _scheduler.stop()
+            _scheduler = ChartScheduler(threads) if threads > 0 else None
+    return _scheduler
 
 
 class ChartEvent:
     ''' Allows preprocessing of fresh data for a chart to occur away from the main thread. '''
-    def __init__(self, chart, measurement_name, input, idx, preferences, budget_millis,
+    def __init__(self, chart, measurement_name, input, idx, config, budget_millis,
                  analysis_mode='vibration'):
         super().__init__()
         self.chart = chart
         self.measurement_name = measurement_name
         self.input = input
         self.idx = idx
-        self.preferences = preferences
+        self.config = config
         self.__analysis_mode = analysis_mode
         self.__budget_millis = budget_millis * 0.9
         self.should_emit = False
         self.output = None
+        self.on_done = lambda: None
 
     def execute(self):
+        '''
+        Processes the event in this thread or hands it to the analysis pool.
+        :return: true if the event was handed to the analysis pool, on_done is called once it completes.
+        '''
+        pool = get_analysis_pool()
+        job = self.make_job() if pool is not None else None
+        if job is not None:
+            pool.submit(job, self.complete)
+            return True
         start = time.time()
         self.process()
         mid = time.time()
@@ -100,7 +304,7 @@ class ChartEvent:
     def process(self):
         ''' default implementation passes through the input '''
         self.should_emit = True
-        self.output = TriAxisSignal(self.preferences,
+        self.output = TriAxisSignal(self.config,
                                     self.measurement_name,
                                     self.input,
                                     self.chart.fs,
@@ -108,22 +312,63 @@ class ChartEvent:
                                     idx=self.idx,
                                     mode=self.__analysis_mode,
                                     pre_calc=False)
+        self.output.analyse_data()
+
+    def make_job(self):
+        '''
+        :return: an AnalysisJob if the analysis for this event can be done in a worker process.
+        '''
+        return None
+
+    def merge(self, older, max_chunks):
+        '''
+        Folds the input of older events into this event.
+        :param older: the older events, oldest first.
+        :param max_chunks: the maximum number of chunks the merged event can hold.
+        :return: the number of chunks discarded or None if this event cannot be merged.
+        '''
+        return None
+
+    def complete(self, output):
+        '''
+        Receives the output of the AnalysisJob.
+        :param output: the analysed signals, None if the analysis failed.
+        '''
+        try:
+            if output is not None:
+                self.output = output
+                self.should_emit = True
+                self.handle_data()
+        finally:
+            self.on_done()
 
     def handle_data(self):
         if self.should_emit is True:
             self.chart.signals.new_data.emit(self.measurement_name, self.idx, self.output)
 
 
+class ChunkedChartEvent(ChartEvent):
+    ''' An event whose input is a list of chunks which are analysed independently so events can be merged. '''
+
+    def merge(self, older, max_chunks):
+        chunks = [c for e in older for c in e.input] + list(self.input)
+        self.input = chunks[-max_chunks:]
+        return len(chunks) - len(self.input)
+
+
 class ChartSignals(QObject):
     new_data = Signal(str, int, object)
 
 
 class VisibleChart:
 
-    def __init__(self, prefs, fs_widget, resolution_widget, fps_widget, actual_fps_widget,
-                 visible, coalesce=False, analysis_mode='vibration', cache_size=1, cache_purger=lambda c: None):
+    def __init__(self, prefs, fs_widget, resolution_widget, fps_widget, actual_fps_widget, queue_status_widget,
+                 visible, overload_policy_key=None, analysis_mode='vibration', cache_size=1,
+                 cache_purger=lambda c: None):
         self.signals = ChartSignals()
-        self.processor = ChartProcessor(coalesce=coalesce)
+        self.__overload_policy_key = overload_policy_key
+        self.__overload_policy = OVERLOAD_DROP_OLDEST
+        self.__queue_limit = 1
         self.signals.new_data.connect(self.do_update)
         self.__timer = QTimer()
         self.__timer.timeout.connect(self.set_actual_fps)
@@ -131,9 +376,11 @@ class VisibleChart:
         self.__visible = visible
         self.__analysis_mode = analysis_mode
         self.__resolution_shift = None
+        self.__input_fs = None
         self.__fs = None
         self.__fps = None
         self.__actual_fps_widget = actual_fps_widget
+        self.__queue_status_widget = queue_status_widget
         self.__budget_millis = None
         self.__min_nperseg = 0
         self.__ticks = 0
@@ -143,6 +390,7 @@ class VisibleChart:
         self.__received_data_while_invisible = set()
         self.__visible_axes = []
         self.__visible_measurements = []
+        self.reload_overload_policy()
         self.__on_resolution_change(resolution_widget.currentText())
         self.__on_fs_change(fs_widget.value())
         # link to widgets
@@ -178,6 +426,47 @@ class VisibleChart:
         val = int(self.__ticks / len(measurements)) if active > 0 else 0
         self.__actual_fps_widget.setValue(val)
         self.__ticks = 0
+        scheduler = get_chart_scheduler()
+        if scheduler is not None:
+            counters = scheduler.counters(self)
+            self.__queue_status_widget.setText(f"Queued: {counters['queued']} In Flight: {counters['in flight']} "
+                                               f"Dropped: {counters['dropped']}\n"
+                                               f"Coalesced: {counters['coalesced']} Merged: {counters['merged']}")
+            self.__queue_status_widget.setToolTip(f"{self.__overload_policy} when more than {self.__queue_limit} "
+                                                  f"events are queued, {counters['discarded chunks']} chunks discarded")
+
+    @property
+    def overload_policy(self):
+        return self.__overload_policy
+
+    @overload_policy.setter
+    def overload_policy(self, overload_policy):
+        self.__overload_policy = overload_policy
+
+    def reload_overload_policy(self):
+        ''' Reads the overload policy and queue limit from preferences. '''
+        self.__queue_limit = max(1, self.preferences.get(ANALYSIS_QUEUE_LIMIT))
+        if self.__overload_policy_key is not None:
+            self.__overload_policy = self.preferences.get(self.__overload_policy_key)
+
+    @property
+    def queue_limit(self):
+        ''' the maximum number of events which can be queued for each measurement. '''
+        return self.__queue_limit
+
+    @property
+    def max_merged_chunks(self):
+        ''' the maximum number of chunks in a merged event, i.e. one second of data. '''
+        return max(1, self.fps)
+
+    def priority(self, measurement_name):
+        '''
+        :param measurement_name: the measurement name.
+        :return: the priority of the events for the measurement, lowest first.
+        '''
+        if self.__visible is False:
+            return PRIORITY_HIDDEN_CHART
+        return PRIORITY_VISIBLE if self.is_visible(measurement=measurement_name) else PRIORITY_HIDDEN_MEASUREMENT
 
     def is_visible(self, measurement=None, axis=None):
         '''
@@ -224,6 +513,9 @@ class VisibleChart:
 
     @property
     def fs(self):
+        '''
+        :return: the sample rate of the data which is analysed, i.e. after decimation towards the analysis target fs.
+        '''
         return self.__fs
 
     @property
@@ -293,18 +585,23 @@ class VisibleChart:
     def accept_data(self, data):
         '''
         Accepts the fresh data into the cache for the chart.
-        :param data: the data.
+        :param data: the data, a list is cached item by item.
         '''
-        if isinstance(data, TriAxisSignal):
+        if not isinstance(data, list):
             if data.measurement_name not in self.__cached:
                 self.__cached[data.measurement_name] = deque(maxlen=self.__cache_size) if self.__cache_size > 0 else deque()
             cache = self.__cached[data.measurement_name]
             cache.append(data)
+            self.on_data_cached(data)
             self.__cache_purger(cache)
             return data
         else:
             return [self.accept_data(d) for d in data][-1]
 
+    def on_data_cached(self, data):
+        ''' allows subclasses to react to data being added to the cache '''
+        pass
+
     @abc.abstractmethod
     def update_chart(self, measurement_name):
         '''
@@ -332,10 +629,19 @@ class VisibleChart:
         pass
 
     def __on_fs_change(self, fs):
-        self.__fs = fs
+        self.__input_fs = fs
+        self.__fs = get_analysis_fs(fs, self.preferences.get(ANALYSIS_TARGET_FS))
         self.__cache_nperseg()
         self.on_fs_change()
 
+    def reload_analysis_fs(self):
+        ''' Reacts to a change in the analysis target fs. '''
+        if self.__input_fs is not None:
+            fs = get_analysis_fs(self.__input_fs, self.preferences.get(ANALYSIS_TARGET_FS))
+            if fs != self.__fs:
+                self.reset()
+                self.__on_fs_change(self.__input_fs)
+
     def on_fs_change(self):
         ''' allows subclasses to react to fs change '''
         pass
@@ -353,7 +659,9 @@ class VisibleChart:
         '''
         event = self.make_event(measurement_name, data, idx)
         if event is not None:
-            self.processor.queue.put(event, block=False)
+            scheduler = get_chart_scheduler()
+            if scheduler is not None:
+                scheduler.submit(event)
 
     def make_event(self, measurement_name, data, idx):
         '''
@@ -363,7 +671,7 @@ class VisibleChart:
         :param idx: the index.
         :return: the event.
         '''
-        return ChartEvent(self, measurement_name, data, idx, self.preferences, self.budget_millis,
+        return ChartEvent(self, measurement_name, data, idx, self.preferences.analysis_config, self.budget_millis,
                           analysis_mode=self.analysis_mode)
 
 
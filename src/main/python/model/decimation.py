@@ -0,0 +1,150 @@
+import logging
+from functools import lru_cache
+
+import numpy as np
+from scipy import signal
+
+logger = logging.getLogger('qvibe.decimation')
+
+# the anti alias filter for a factor q has TAPS_PER_FACTOR * q + 1 taps (as per scipy.signal.decimate)
+TAPS_PER_FACTOR = 20
+# the factors which can be applied in a single stage, largest first
+STAGE_FACTORS = (5, 3, 2)
+
+
+@lru_cache(maxsize=32)
+def get_decimation_factors(fs, target_fs):
+    '''
+    Finds the stages required to bring the sample rate down as close as possible to, without going below, the target.
+    :param fs: the input sample rate.
+    :param target_fs: the lowest acceptable output sample rate.
+    :return: the decimation factor of each stage (largest first), empty if no decimation is possible.
+    '''
+    factors = []
+    remaining = fs
+    while True:
+        q = next((q for q in STAGE_FACTORS if remaining % q == 0 and remaining // q >= target_fs), None)
+        if q is None:
+            break
+        factors.append(q)
+        remaining //= q
+    return tuple(sorted(factors, reverse=True))
+
+
+def get_analysis_fs(fs, target_fs):
+    '''
+    :param fs: the input sample rate.
+    :param target_fs: the lowest acceptable analysis sample rate.
+    :return: the sample rate after decimation.
+    '''
+    return fs // int(np.prod(get_decimation_factors(fs, target_fs), dtype=int))
+
+
+@lru_cache(maxsize=8)
+def get_anti_alias_filter(factor):
+    '''
+    Designs a linear phase lowpass FIR suitable for decimating by the given factor.
+    :param factor: the decimation factor.
+    :return: the filter taps.
+    '''
+    taps = signal.firwin(TAPS_PER_FACTOR * factor + 1, 1.0 / factor, window='hamming')
+    taps.setflags(write=False)
+    return taps
+
+
+class DecimationStage:
+    '''
+    Filters and downsamples a stream of rows by a fixed factor. The filter is evaluated only at the retained samples
+    (i.e. a polyphase implementation) and the tail of the previous chunk is held so that a stream processed in chunks
+    produces exactly the same output as if it were processed in one go. Each output row is centred on an input row,
+    i.e. the filter delay is removed, so the columns which are not filtered are copied from that input row.
+    '''
+
+    def __init__(self, factor, first_filtered_col=2):
+        '''
+        :param factor: the decimation factor.
+        :param first_filtered_col: the columns before this one are carried through unfiltered.
+        '''
+        self.__factor = factor
+        self.__first_col = first_filtered_col
+        self.__taps = get_anti_alias_filter(factor)
+        self.__history_len = self.__taps.size - 1
+        self.__delay = self.__history_len // 2
+        self.__history = None
+        self.__phase = self.__delay
+
+    @property
+    def factor(self):
+        return self.__factor
+
+    def process(self, data):
+        '''
+        :param data: the next chunk of rows.
+        :return: the decimated rows, may be empty.
+        '''
+        if self.__history is None:
+            self.__history = self.__prime(data[0])
+        buf = np.concatenate((self.__history, data))
+        start = self.__history_len + self.__phase
+        count = max(0, (buf.shape[0] - 1 - start) // self.__factor + 1)
+        out = buf[start - self.__delay:start - self.__delay + count * self.__factor:self.__factor].copy()
+        if count > 0:
+            # upfirdn starts from the beginning of the supplied slice so skip the outputs which precede the history
+            skip = self.__history_len // self.__factor
+            filtered = signal.upfirdn(self.__taps, buf[self.__phase:, self.__first_col:], down=self.__factor, axis=0)
+            out[:, self.__first_col:] = filtered[skip:skip + count]
+        self.__phase += count * self.__factor - data.shape[0]
+        self.__history = buf[-self.__history_len:]
+        return out
+
+    def __prime(self, row):
+        '''
+        Fills the history by extending the first row back in time so that a DC offset does not cause a transient.
+        '''
+        history = np.repeat(row[np.newaxis, :], self.__history_len, axis=0)
+        history[:, 0] = row[0] - np.arange(self.__history_len, 0, -1)
+        return history
+
+
+class Decimator:
+    '''
+    Reduces a stream of sample rows (idx, ..., values) from the input sample rate down to the analysis sample rate
+    via a cascade of stages. The sample idx is renumbered so that it counts samples at the output rate.
+    '''
+
+    def __init__(self, fs, target_fs):
+        '''
+        :param fs: the input sample rate.
+        :param target_fs: the lowest acceptable output sample rate.
+        '''
+        self.__input_fs = fs
+        self.__stages = [DecimationStage(q) for q in get_decimation_factors(fs, target_fs)]
+        self.__factor = int(np.prod([s.factor for s in self.__stages], dtype=int))
+        if self.__factor > 1:
+            logger.info(f"Decimating from {fs}Hz to {self.fs}Hz via {[s.factor for s in self.__stages]}")
+
+    @property
+    def factor(self):
+        return self.__factor
+
+    @property
+    def input_fs(self):
+        return self.__input_fs
+
+    @property
+    def fs(self):
+        return self.__input_fs // self.__factor
+
+    def process(self, data):
+        '''
+        :param data: the next chunk of rows.
+        :return: the decimated rows, the input itself if no decimation is required.
+        '''
+        if self.__factor == 1 or data.shape[0] == 0:
+            return data
+        for stage in self.__stages:
+            data = stage.process(data)
+            if data.shape[0] == 0:
+                return data
+        data[:, 0] //= self.__factor
+        return data
@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from model.log import to_millis
+
+FFT_BACKEND_SCIPY = 'scipy'
+FFT_BACKEND_PYFFTW = 'pyfftw'
+
+logger = logging.getLogger('qvibe.fft')
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+class ScipyFFT:
+    ''' Computes FFTs via scipy.fft which can split a batch of transforms across a number of workers. '''
+
+    def __init__(self, workers=1):
+        import scipy.fft
+        self.__fft = scipy.fft
+        self.__workers = workers
+
+    @property
+    def name(self):
+        return FFT_BACKEND_SCIPY
+
+    @property
+    def workers(self):
+        return self.__workers
+
+    def rfft(self, a, axis=-1):
+        '''
+        :param a: the real input.
+        :param axis: the axis over which to compute the FFT.
+        :return: the one sided fft.
+        '''
+        return self.__fft.rfft(a, axis=axis, workers=self.__workers)
+
+    def fft(self, a, axis=-1):
+        '''
+        :param a: the complex input.
+        :param axis: the axis over which to compute the FFT.
+        :return: the fft.
+        '''
+        return self.__fft.fft(a, axis=axis, workers=self.__workers)
+
+
+class FFTWFFT:
+    '''
+    Computes FFTs via pyFFTW, plans are created on first use for each distinct input and then reused. A plan owns its
+    input and output arrays so it cannot be executed by more than one thread at a time, each thread therefore has its
+    own plans so that transforms on different threads run concurrently. The output is copied as the plan reuses it.
+    '''
+
+    def __init__(self, workers=1):
+        import pyfftw
+        self.__builders = pyfftw.builders
+        self.__empty_aligned = pyfftw.empty_aligned
+        self.__workers = workers
+        self.__local = threading.local()
+
+    @property
+    def name(self):
+        return FFT_BACKEND_PYFFTW
+
+    @property
+    def workers(self):
+        return self.__workers
+
+    def rfft(self, a, axis=-1):
+        '''
+        :param a: the real input.
+        :param axis: the axis over which to compute the FFT.
+        :return: the one sided fft.
+        '''
+        return self.__execute(self.__builders.rfft, a, axis)
+
+    def fft(self, a, axis=-1):
+        '''
+        :param a: the complex input.
+        :param axis: the axis over which to compute the FFT.
+        :return: the fft.
+        '''
+        return self.__execute(self.__builders.fft, a, axis)
+
+    def __execute(self, builder, a, axis):
+        plans = getattr(self.__local, 'plans', None)
+        if plans is None:
+            plans = self.__local.plans = {}
+        key = (builder.__name__, a.shape, a.dtype.str, axis)
+        plan = plans.get(key, None)
+        if plan is None:
+            start = time.time()
+            # pyFFTW serialises the planner itself so plans can be created on any thread
+            plan = builder(self.__empty_aligned(a.shape, dtype=a.dtype), axis=axis, threads=self.__workers,
+                           planner_effort='FFTW_MEASURE')
+            plans[key] = plan
+            logger.debug(f"Created FFTW plan for {key} on {threading.current_thread().name} in "
+                         f"{to_millis(start, time.time())}ms")
+        return plan(a).copy()
+
+
+def available_fft_backends():
+    '''
+    :return: the names of the FFT backends which can be used on this machine.
+    '''
+    names = [FFT_BACKEND_SCIPY]
+    try:
+        import pyfftw
+        names.append(FFT_BACKEND_PYFFTW)
+    except ImportError:
+        pass
+    return names
+
+
+def get_fft(name, workers=1):
+    '''
+    Provides the named FFT backend, backends are shared so that any cached state (e.g. FFTW plans) is reused by all
+    analysers. Falls back to scipy if the named backend is not available.
+    :param name: the backend name.
+    :param workers: the number of threads to use.
+    :return: the backend.
+    '''
+    key = (name, workers)
+    backend = _backends.get(key, None)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(key, None)
+            if backend is None:
+                backend = _create_fft(name, workers)
+                _backends[key] = backend
+    return backend
+
+
+def _create_fft(name, workers):
+    if name == FFT_BACKEND_PYFFTW:
+        try:
+            return FFTWFFT(workers=workers)
+        except ImportError:
+            logger.warning(f"pyFFTW is not installed, falling back to {FFT_BACKEND_SCIPY}")
+    return ScipyFFT(workers=workers)
+
+
+def benchmark_fft(nperseg=1024, segments=16, repeats=20):
+    '''
+    Times each available backend at each candidate thread count on a representative batch of segments.
+    :param nperseg: the segment length.
+    :param segments: the number of segments in a batch.
+    :param repeats: how many times to repeat each transform.
+    :return: (backend name, workers) of the fastest option.
+    '''
+    data = np.random.default_rng().random(size=(segments, nperseg))
+    cpus = os.cpu_count() or 1
+    candidates = sorted({1, min(2, cpus), min(4, cpus)})
+    timings = {}
+    for name in available_fft_backends():
+        for workers in candidates:
+            fft = get_fft(name, workers)
+            # warm up so that plan creation is excluded from the timing
+            fft.rfft(data)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                fft.rfft(data)
+            timings[(name, workers)] = time.perf_counter() - start
+    fastest = min(timings, key=timings.get)
+    logger.info(f"FFT benchmark {', '.join(f'{k[0]}/{k[1]}: {v * 1000:.3f}ms' for k, v in timings.items())} "
+                f"- fastest is {fastest[0]}/{fastest[1]}")
+    return fastest
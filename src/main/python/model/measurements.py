@@ -9,7 +9,8 @@ from qtpy.QtWidgets import QFileDialog
 from qtpy.QtCore import QObject, Signal
 
 from common import np_to_str, RingBuffer
-from model.preferences import SNAPSHOT_GROUP
+from model.decimation import Decimator
+from model.preferences import SNAPSHOT_GROUP, ANALYSIS_TARGET_FS
 
 logger = logging.getLogger('qvibe.measurements')
 
@@ -48,6 +49,12 @@ class MeasurementStore:
         for m in self.__measurements:
             m.target_config = target_config
 
+    def reload_analysis_target_fs(self):
+        ''' Propagates the analysis target fs from preferences to each measurement. '''
+        target_fs = self.preferences.get(ANALYSIS_TARGET_FS)
+        for m in self.__measurements:
+            m.analysis_target_fs = target_fs
+
     def __on_buffer_size_change(self, size):
         self.__buffer_size_seconds = size
         for m in self.__measurements:
@@ -102,7 +109,8 @@ class MeasurementStore:
             if removed_emit is True:
                 self.signals.measurement_deleted.emit(m)
         else:
-            m = Measurement(name, ip, data, data_idx, self.signals, self.__buffer_size_seconds, self.target_config)
+            m = Measurement(name, ip, data, data_idx, self.signals, self.__buffer_size_seconds, self.target_config,
+                            self.preferences.get(ANALYSIS_TARGET_FS))
             self.__measurements.append(m)
             self.__parent_layout.removeItem(self.__spacer_item)
             if len(self.__uis) >= len(self.__measurements):
@@ -171,13 +179,16 @@ class MeasurementStore:
 
 class Measurement:
 
-    def __init__(self, name, ip, data, idx, signals, buffer_size, target_config, visible=True):
+    def __init__(self, name, ip, data, idx, signals, buffer_size, target_config, analysis_target_fs, visible=True):
         self.__name = name
         self.__target_config = target_config
+        self.__analysis_target_fs = analysis_target_fs
         self.__ip = ip
         self.__buffer_size = buffer_size
         self.__snap_idx = 0
         self.__data = self.__make_new_buffer()
+        self.__decimator = Decimator(self.__target_config.fs, self.__analysis_target_fs)
+        self.__analysis_data = self.__make_new_analysis_buffer()
         self.__len = 0
         self.__visible = visible
         self.__idx = idx
@@ -190,6 +201,18 @@ class Measurement:
         return RingBuffer(self.__target_config.fs * self.__buffer_size,
                           dtype=(np.float64, self.__target_config.value_len))
 
+    def __make_new_analysis_buffer(self):
+        if self.__decimator.factor == 1:
+            return self.__data
+        return RingBuffer(self.__decimator.fs * self.__buffer_size, dtype=(np.float64, self.__target_config.value_len))
+
+    def __reset_analysis_data(self):
+        '''
+        Recreates the decimator, the analysis buffer is rebuilt from the buffered data when it is next read.
+        '''
+        self.__decimator = Decimator(self.__target_config.fs, self.__analysis_target_fs)
+        self.__analysis_data = None
+
     def reset_buffer_size(self, buffer_size):
         '''
         Replaces the buffer with a new buffer that can hold the specified amount of time data.
@@ -200,6 +223,12 @@ class Measurement:
         new_buf = self.__make_new_buffer()
         new_buf.extend(dat)
         self.__data = new_buf
+        if self.__decimator.factor == 1:
+            self.__analysis_data = self.__data
+        elif self.__analysis_data is not None:
+            new_analysis_buf = self.__make_new_analysis_buffer()
+            new_analysis_buf.extend(self.__analysis_data.unwrap())
+            self.__analysis_data = new_analysis_buf
 
     @property
     def key(self):
@@ -217,12 +246,43 @@ class Measurement:
     def data(self):
         return self.__data
 
+    @property
+    def analysis_data(self):
+        '''
+        :return: the data decimated to the analysis sample rate, this is the data itself if no decimation is required.
+        '''
+        if self.__analysis_data is None:
+            self.__analysis_data = self.__make_new_analysis_buffer()
+            if self.__analysis_data is not self.__data and len(self.__data) > 0:
+                self.__analysis_data.extend(self.__decimator.process(self.__data.unwrap()))
+        return self.__analysis_data
+
+    @property
+    def analysis_fs(self):
+        return self.__decimator.fs
+
+    @property
+    def analysis_target_fs(self):
+        return self.__analysis_target_fs
+
+    @analysis_target_fs.setter
+    def analysis_target_fs(self, analysis_target_fs):
+        if analysis_target_fs != self.__analysis_target_fs:
+            self.__analysis_target_fs = analysis_target_fs
+            self.__reset_analysis_data()
+
     @property
     def latest_data(self):
         return self.__data[-1] if len(self.__data) > 0 else None
 
     def append(self, data, emit=True):
         self.__data.extend(data)
+        if self.__decimator.input_fs != self.__target_config.fs:
+            # the target config is updated in place when the recorder fs changes
+            self.__reset_analysis_data()
+        elif self.__analysis_data is not None and self.__analysis_data is not self.__data:
+            # a buffer which is waiting to be rebuilt already includes this data when it is read
+            self.__analysis_data.extend(self.__decimator.process(data))
         if emit is True:
             self.__signals.data_changed.emit(self)
 
@@ -0,0 +1,249 @@
+import logging
+import multiprocessing
+import threading
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from queue import Queue, Empty
+
+import numpy as np
+
+from model.log import to_millis
+from model.signal import TriAxisSignal, SpectroValues, Analysis
+
+logger = logging.getLogger('qvibe.pool')
+
+# the size of each shared memory slot, a job which does not fit is passed to (or from) the worker by pickling instead
+SLOT_BYTES = 4 * 1024 * 1024
+SLOTS_PER_SHARD = 4
+ALIGNMENT = 8
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# the shared memory owned by a worker process, set by the pool initialiser
+_worker_slots = None
+
+AnalysisJob = namedtuple('AnalysisJob', ['config', 'measurement_name', 'fs', 'resolution_shift', 'idx', 'mode',
+                                         'view', 'chunks'])
+
+ANALYSIS_KIND = 'analysis'
+SPECTRO_KIND = 'spectro'
+
+
+def pack(buffer, arrays):
+    '''
+    Copies the arrays into the buffer.
+    :param buffer: a uint8 array.
+    :param arrays: the arrays.
+    :return: a (offset, dtype, shape) descriptor for each array or None if they do not fit.
+    '''
+    descriptors = []
+    offset = 0
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        end = offset + a.nbytes
+        if end > buffer.size:
+            return None
+        buffer[offset:end] = a.reshape(-1).view(np.uint8)
+        descriptors.append((offset, a.dtype.str, a.shape))
+        offset = -(-end // ALIGNMENT) * ALIGNMENT
+    return descriptors
+
+
+def unpack(buffer, descriptors, copy=True):
+    '''
+    Reads arrays from the buffer.
+    :param buffer: a uint8 array.
+    :param descriptors: the descriptors returned by pack.
+    :param copy: if False, the arrays are views of the buffer.
+    :return: the arrays.
+    '''
+    arrays = []
+    for offset, dtype, shape in descriptors:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape, dtype=np.int64))
+        a = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).reshape(shape)
+        arrays.append(a.copy() if copy else a)
+    return arrays
+
+
+def _slot_view(raw, slot):
+    return np.frombuffer(raw, dtype=np.uint8, count=SLOT_BYTES, offset=slot * SLOT_BYTES)
+
+
+def _init_worker(inputs, outputs):
+    global _worker_slots
+    _worker_slots = (inputs, outputs)
+
+
+def _analyse(job, slot):
+    '''
+    Analyses each chunk in the job, runs in the worker process.
+    :param job: the AnalysisJob, chunks are descriptors if a slot is provided.
+    :param slot: the slot holding the chunks or None if the chunks were pickled.
+    :return: the flattened analysis of each axis of each chunk, as descriptors if the result fitted in the slot.
+    '''
+    if slot is None:
+        chunks = job.chunks
+    else:
+        chunks = unpack(_slot_view(_worker_slots[0], slot), job.chunks, copy=False)
+    kinds = []
+    arrays = []
+    for chunk in chunks:
+        tas = TriAxisSignal(job.config, job.measurement_name, chunk, job.fs, job.resolution_shift, idx=job.idx,
+                            mode=job.mode, view_mode=job.view, pre_calc=True, shared=True)
+        for s in (tas.x, tas.y, tas.z, tas.sum):
+            analysis = s.get_analysis()
+            if analysis is None:
+                kinds.append(None)
+            elif isinstance(analysis, SpectroValues):
+                kinds.append(SPECTRO_KIND)
+                arrays.extend((analysis.f, analysis.t, analysis.sxx))
+            else:
+                kinds.append(ANALYSIS_KIND)
+                arrays.extend((analysis.x, analysis.y_raw, analysis.y))
+    descriptors = None if slot is None else pack(_slot_view(_worker_slots[1], slot), arrays)
+    return kinds, arrays if descriptors is None else descriptors, descriptors is not None
+
+
+class Shard:
+    '''
+    A single worker process along with the shared memory slots used to pass data to and from it. As there is a single
+    worker, jobs complete in the order in which they are submitted.
+    '''
+
+    def __init__(self, context):
+        self.__inputs = context.RawArray('b', SLOT_BYTES * SLOTS_PER_SHARD)
+        self.__outputs = context.RawArray('b', SLOT_BYTES * SLOTS_PER_SHARD)
+        self.__free = Queue()
+        for i in range(SLOTS_PER_SHARD):
+            self.__free.put(i)
+        self.__executor = ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker,
+                                              initargs=(self.__inputs, self.__outputs))
+
+    def submit(self, job, callback):
+        '''
+        Passes the job to the worker.
+        :param job: the AnalysisJob.
+        :param callback: receives the list of analysed TriAxisSignals, or None if the analysis failed, called on a pool
+        thread.
+        '''
+        start = time.time()
+        slot = self.__acquire_slot()
+        if slot is not None:
+            descriptors = pack(_slot_view(self.__inputs, slot), job.chunks)
+            if descriptors is None:
+                self.__free.put(slot)
+                slot = None
+            else:
+                future = self.__executor.submit(_analyse, job._replace(chunks=descriptors), slot)
+        if slot is None:
+            future = self.__executor.submit(_analyse, job, None)
+        future.add_done_callback(lambda f: self.__complete(f, job, slot, callback, start))
+
+    def __acquire_slot(self):
+        try:
+            return self.__free.get(block=False)
+        except Empty:
+            return None
+
+    def __complete(self, future, job, slot, callback, start):
+        try:
+            kinds, results, in_slot = future.result()
+            if in_slot is True:
+                results = unpack(_slot_view(self.__outputs, slot), results)
+        except Exception:
+            logger.exception(f"Failed to analyse {job.measurement_name}:{job.idx}")
+            callback(None)
+            return
+        finally:
+            if slot is not None:
+                self.__free.put(slot)
+        logger.debug(f"Analysed {job.measurement_name}:{job.idx} in {to_millis(start, time.time())}ms")
+        callback(to_signals(job, kinds, results))
+
+    def shutdown(self):
+        self.__executor.shutdown(wait=False)
+
+
+def to_signals(job, kinds, arrays):
+    '''
+    Recreates the analysed signals from the worker output.
+    :param job: the AnalysisJob.
+    :param kinds: the kind of analysis for each axis of each chunk.
+    :param arrays: the analysis arrays.
+    :return: the TriAxisSignals.
+    '''
+    signals = []
+    values = iter(arrays)
+    kinds = iter(kinds)
+    for chunk in job.chunks:
+        tas = TriAxisSignal(job.config, job.measurement_name, chunk, job.fs, job.resolution_shift, idx=job.idx,
+                            mode=job.mode, view_mode=job.view, pre_calc=False, shared=True)
+        for s in (tas.x, tas.y, tas.z, tas.sum):
+            kind = next(kinds)
+            if kind == SPECTRO_KIND:
+                s.set_analysis(SpectroValues(next(values), next(values), next(values)))
+            elif kind == ANALYSIS_KIND:
+                s.set_analysis(Analysis((next(values), next(values), next(values))))
+        signals.append(tas)
+    return signals
+
+
+class AnalysisPool:
+    '''
+    Analyses signals in worker processes so that the analysis of many measurements is not limited by the GIL. Work is
+    sharded by measurement so the results for a measurement are delivered in order.
+    '''
+
+    def __init__(self, processes):
+        '''
+        :param processes: the number of worker processes.
+        '''
+        # spawn so that the workers do not inherit the state of a running Qt app
+        context = multiprocessing.get_context('spawn')
+        self.__shards = [Shard(context) for _ in range(processes)]
+        logger.info(f"Started analysis pool with {processes} processes")
+
+    @property
+    def processes(self):
+        return len(self.__shards)
+
+    def submit(self, job, callback):
+        '''
+        Analyses the job on the shard which owns the measurement.
+        :param job: the AnalysisJob.
+        :param callback: receives the list of analysed TriAxisSignals, or None if the analysis failed, called on a pool
+        thread.
+        '''
+        shard = zlib.crc32(job.measurement_name.encode('utf-8')) % len(self.__shards)
+        self.__shards[shard].submit(job, callback)
+
+    def shutdown(self):
+        for s in self.__shards:
+            s.shutdown()
+
+
+def get_analysis_pool():
+    '''
+    :return: the shared analysis pool or None if analysis is done in process.
+    '''
+    return _pool
+
+
+def configure_analysis_pool(processes):
+    '''
+    Replaces the shared analysis pool if the number of processes has changed.
+    :param processes: the number of worker processes, 0 to analyse in process.
+    :return: the pool.
+    '''
+    global _pool
+    with _pool_lock:
+        current = 0 if _pool is None else _pool.processes
+        if processes != current:
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = AnalysisPool(processes) if processes > 0 else None
+    return _pool
@@ -1,14 +1,17 @@
+import logging
 import os
 
 import numpy as np
 import qtawesome as qta
 
-from qtpy.QtCore import Qt
+from qtpy.QtCore import Qt, QObject, QRunnable, QThreadPool, Signal
 from qtpy.QtWidgets import QDialog, QMessageBox, QDialogButtonBox, QFileDialog
 
-from common import parse_file, np_to_str
+from common import parse_file, np_to_str, wait_cursor
 from ui.preferences import Ui_preferencesDialog
 
+logger = logging.getLogger('qvibe.preferences')
+
 DISPLAY_SMOOTH_GRAPHS = 'display/smooth_graphs'
 
 STYLE_MATPLOTLIB_THEME_DEFAULT = 'beq_dark'
@@ -40,6 +43,18 @@ ANALYSIS_AVG_WINDOW = 'analysis/avg_window'
 ANALYSIS_PEAK_WINDOW = 'analysis/peak_window'
 ANALYSIS_DETREND = 'analysis/detrend'
 ANALYSIS_HPF_RTA = 'analysis/hpfrta'
+ANALYSIS_FFT_BACKEND = 'analysis/fft_backend'
+ANALYSIS_FFT_WORKERS = 'analysis/fft_workers'
+ANALYSIS_FFT_BENCHMARKED = 'analysis/fft_benchmarked'
+ANALYSIS_PRECISION = 'analysis/precision'
+ANALYSIS_PROCESSES = 'analysis/processes'
+ANALYSIS_CACHE_MB = 'analysis/cache_mb'
+ANALYSIS_THREADS = 'analysis/threads'
+ANALYSIS_QUEUE_LIMIT = 'analysis/queue_limit'
+ANALYSIS_RTA_OVERLOAD = 'analysis/rta_overload'
+ANALYSIS_SPECTRO_OVERLOAD = 'analysis/spectro_overload'
+ANALYSIS_VIBRATION_OVERLOAD = 'analysis/vibration_overload'
+ANALYSIS_INTEGRATION_FLOOR = 'analysis/integration_floor'
 
 CHART_MAG_MIN = 'chart/mag_min'
 CHART_MAG_MAX = 'chart/mag_max'
@@ -61,7 +76,28 @@ RTA_TARGET = 'rta/target'
 RTA_HOLD_SECONDS = 'rta/hold_secs'
 RTA_SMOOTH_WINDOW = 'rta/smooth_window'
 RTA_SMOOTH_POLY = 'rta/smooth_poly'
-
+RTA_AVERAGE_MODE = 'rta/average_mode'
+RTA_BAND_FRACTION = 'rta/band_fraction'
+RTA_SMOOTH_MODE = 'rta/smooth_mode'
+RTA_ZOOM_FACTOR = 'rta/zoom_factor'
+
+ANALYSIS_CONFIG_KEYS = {
+    ANALYSIS_DETREND,
+    ANALYSIS_AVG_WINDOW,
+    ANALYSIS_PEAK_WINDOW,
+    ANALYSIS_HPF_RTA,
+    ANALYSIS_FFT_BACKEND,
+    ANALYSIS_FFT_WORKERS,
+    ANALYSIS_PRECISION,
+    SUM_X_SCALE,
+    SUM_Y_SCALE,
+    SUM_Z_SCALE,
+    CHART_FREQ_MIN,
+    CHART_FREQ_MAX,
+    ANALYSIS_INTEGRATION_FLOOR,
+    RTA_BAND_FRACTION,
+    RTA_ZOOM_FACTOR,
+}
 
 DEFAULT_PREFS = {
     ANALYSIS_RESOLUTION: 1.0,
@@ -70,6 +106,18 @@ DEFAULT_PREFS = {
     ANALYSIS_PEAK_WINDOW: ANALYSIS_WINDOW_DEFAULT,
     ANALYSIS_DETREND: 'constant',
     ANALYSIS_HPF_RTA: False,
+    ANALYSIS_FFT_BACKEND: 'scipy',
+    ANALYSIS_FFT_WORKERS: 1,
+    ANALYSIS_FFT_BENCHMARKED: False,
+    ANALYSIS_PRECISION: 'float64',
+    ANALYSIS_PROCESSES: 0,
+    ANALYSIS_CACHE_MB: 64,
+    ANALYSIS_THREADS: 2,
+    ANALYSIS_QUEUE_LIMIT: 4,
+    ANALYSIS_RTA_OVERLOAD: 'merge',
+    ANALYSIS_SPECTRO_OVERLOAD: 'merge',
+    ANALYSIS_VIBRATION_OVERLOAD: 'merge',
+    ANALYSIS_INTEGRATION_FLOOR: 2.0,
     BUFFER_SIZE: 30,
     CHART_MAG_MIN: 40,
     CHART_MAG_MAX: 120,
@@ -87,6 +135,10 @@ DEFAULT_PREFS = {
     RTA_HOLD_SECONDS: 10.0,
     RTA_SMOOTH_WINDOW: 31,
     RTA_SMOOTH_POLY: 7,
+    RTA_AVERAGE_MODE: 'window',
+    RTA_BAND_FRACTION: 3,
+    RTA_SMOOTH_MODE: 'S-G',
+    RTA_ZOOM_FACTOR: 8,
     SUM_X_SCALE: 2.2,
     SUM_Y_SCALE: 2.4,
     SUM_Z_SCALE: 1.0,
@@ -100,6 +152,13 @@ TYPES = {
     ANALYSIS_RESOLUTION: float,
     ANALYSIS_TARGET_FS: int,
     ANALYSIS_HPF_RTA: bool,
+    ANALYSIS_FFT_WORKERS: int,
+    ANALYSIS_FFT_BENCHMARKED: bool,
+    ANALYSIS_PROCESSES: int,
+    ANALYSIS_CACHE_MB: int,
+    ANALYSIS_THREADS: int,
+    ANALYSIS_QUEUE_LIMIT: int,
+    ANALYSIS_INTEGRATION_FLOOR: float,
     BUFFER_SIZE: int,
     CHART_MAG_MIN: int,
     CHART_MAG_MAX: int,
@@ -115,6 +174,8 @@ TYPES = {
     RTA_HOLD_SECONDS: float,
     RTA_SMOOTH_POLY: int,
     RTA_SMOOTH_WINDOW: int,
+    RTA_BAND_FRACTION: int,
+    RTA_ZOOM_FACTOR: int,
     SUM_X_SCALE: float,
     SUM_Y_SCALE: float,
     SUM_Z_SCALE: float,
@@ -129,6 +190,7 @@ singleton = None
 class Preferences:
     def __init__(self, settings):
         self.__settings = settings
+        self.__analysis_config = None
         global singleton
         singleton = self
 
@@ -188,6 +250,18 @@ class Preferences:
             self.__settings.remove(key)
         else:
             self.__settings.setValue(key, value)
+        if key in ANALYSIS_CONFIG_KEYS:
+            self.__analysis_config = None
+
+    @property
+    def analysis_config(self):
+        '''
+        :return: an immutable snapshot of the analysis preferences, rebuilt only after one of them has changed.
+        '''
+        if self.__analysis_config is None:
+            from model.signal import AnalysisConfig
+            self.__analysis_config = AnalysisConfig.from_preferences(self)
+        return self.__analysis_config
 
     def clear_all(self, prefix):
         ''' clears all under the given group '''
@@ -207,6 +281,7 @@ class Preferences:
         Resets all preferences.
         '''
         self.__settings.clear()
+        self.__analysis_config = None
 
 
 class PreferencesDialog(QDialog, Ui_preferencesDialog):
@@ -233,6 +308,18 @@ class PreferencesDialog(QDialog, Ui_preferencesDialog):
         self.magMax.setValue(self.__preferences.get(CHART_MAG_MAX))
         self.highpassRTA.setChecked(self.__preferences.get(ANALYSIS_HPF_RTA))
         self.init_combo(ANALYSIS_DETREND, self.detrend, lambda a: f"{a[0].upper()}{a[1:]}")
+        self.__init_fft_backends()
+        self.fftWorkers.setValue(self.__preferences.get(ANALYSIS_FFT_WORKERS))
+        self.init_combo(ANALYSIS_PRECISION, self.precision)
+        self.precision.currentTextChanged.connect(self.__report_precision)
+        self.__report_precision(self.precision.currentText())
+        self.analysisTargetFs.setValue(self.__preferences.get(ANALYSIS_TARGET_FS))
+        self.analysisProcesses.setValue(self.__preferences.get(ANALYSIS_PROCESSES))
+        self.queueLimit.setValue(self.__preferences.get(ANALYSIS_QUEUE_LIMIT))
+        self.analysisThreads.setValue(self.__preferences.get(ANALYSIS_THREADS))
+        self.analysisCache.setValue(self.__preferences.get(ANALYSIS_CACHE_MB))
+        self.integrationFloor.setValue(self.__preferences.get(ANALYSIS_INTEGRATION_FLOOR))
+        self.__init_overload_policies()
         self.magMin.valueChanged['int'].connect(self.__balance_mag)
         self.magMax.valueChanged['int'].connect(self.__balance_mag)
         self.freqMin.setValue(self.__preferences.get(CHART_FREQ_MIN))
@@ -262,6 +349,74 @@ class PreferencesDialog(QDialog, Ui_preferencesDialog):
         self.createTarget.setToolTip('Draw a target curve')
         self.createTarget.clicked.connect(self.__create_target)
 
+    def __init_fft_backends(self):
+        ''' Disables any backend which is not installed and selects the preferred backend. '''
+        from model.fft import available_fft_backends
+        available = available_fft_backends()
+        for i in range(self.fftBackend.count()):
+            if self.fftBackend.itemText(i) not in available:
+                self.fftBackend.model().item(i).setEnabled(False)
+        self.init_combo(ANALYSIS_FFT_BACKEND, self.fftBackend)
+
+    def __init_overload_policies(self):
+        ''' Populates each chart's overload policy combo from the supported policies. '''
+        from model.charts import OVERLOAD_POLICIES
+        for key, combo in self.__overload_policy_combos().items():
+            combo.addItems(OVERLOAD_POLICIES)
+            self.init_combo(key, combo)
+
+    def __overload_policy_combos(self):
+        return {
+            ANALYSIS_RTA_OVERLOAD: self.rtaOverload,
+            ANALYSIS_SPECTRO_OVERLOAD: self.spectroOverload,
+            ANALYSIS_VIBRATION_OVERLOAD: self.vibrationOverload
+        }
+
+    def benchmark_fft(self):
+        '''
+        Finds the fastest FFT backend on this machine and selects it.
+        '''
+        from model.fft import benchmark_fft
+        with wait_cursor():
+            backend, workers = benchmark_fft()
+        self.fftBackend.setCurrentText(backend)
+        self.fftWorkers.setValue(workers)
+
+    def __report_precision(self, precision):
+        '''
+        Measures the accuracy of the analysis in the background if reduced precision is selected.
+        :param precision: the precision.
+        '''
+        if precision == 'float64':
+            self.precisionReport.clear()
+        else:
+            self.precisionReport.setText(f"Measuring the accuracy of {precision} analysis...")
+            config = self.__preferences.analysis_config._replace(dtype=np.dtype(precision))
+            QThreadPool.globalInstance().start(PrecisionReporter(precision, config,
+                                                                 self.__preferences.get(RECORDER_TARGET_FS),
+                                                                 self.__show_precision_report))
+
+    def __show_precision_report(self, precision, report):
+        '''
+        Shows the accuracy of the analysis at the given precision if it is still selected.
+        :param precision: the precision.
+        :param report: the max error, in dB, per view.
+        '''
+        if precision == self.precision.currentText():
+            errors = ', '.join([f"{k}: {v:.4f} dB" for k, v in report.items()])
+            logger.info(f"Max error of {precision} analysis vs float64 is {errors}")
+            self.precisionReport.setText(f"Max error vs float64 is {errors}")
+
+    def __set_integration_floor(self, floor):
+        '''
+        Stores the integration floor, discarding the integration weights calculated for the previous floor.
+        :param floor: the floor in Hz.
+        '''
+        if floor != self.__preferences.get(ANALYSIS_INTEGRATION_FLOOR):
+            self.__preferences.set(ANALYSIS_INTEGRATION_FLOOR, floor)
+            from model.signal import get_integration_weights
+            get_integration_weights.cache_clear()
+
     def __reset_target_buttons(self):
         has_target = self.__preferences.has(RTA_TARGET)
         self.clearTarget.setEnabled(has_target)
@@ -373,6 +528,17 @@ class PreferencesDialog(QDialog, Ui_preferencesDialog):
         self.__preferences.set(CHART_SPECTRO_SCALE_FACTOR, self.spectroScaleFactor.currentText())
         self.__preferences.set(ANALYSIS_DETREND, self.detrend.currentText().lower())
         self.__preferences.set(ANALYSIS_HPF_RTA, self.highpassRTA.isChecked())
+        self.__preferences.set(ANALYSIS_FFT_BACKEND, self.fftBackend.currentText())
+        self.__preferences.set(ANALYSIS_FFT_WORKERS, self.fftWorkers.value())
+        self.__preferences.set(ANALYSIS_PRECISION, self.precision.currentText())
+        self.__preferences.set(ANALYSIS_TARGET_FS, self.analysisTargetFs.value())
+        self.__preferences.set(ANALYSIS_PROCESSES, self.analysisProcesses.value())
+        self.__preferences.set(ANALYSIS_QUEUE_LIMIT, self.queueLimit.value())
+        self.__preferences.set(ANALYSIS_THREADS, self.analysisThreads.value())
+        self.__preferences.set(ANALYSIS_CACHE_MB, self.analysisCache.value())
+        self.__set_integration_floor(self.integrationFloor.value())
+        for key, combo in self.__overload_policy_combos().items():
+            self.__preferences.set(key, combo.currentText())
         # TODO would be nicer to be able to listen to specific values
         self.__spectro.update_scale()
         if self.recorders.count() > 0:
@@ -422,6 +588,27 @@ class PreferencesDialog(QDialog, Ui_preferencesDialog):
         return None, None
 
 
+class PrecisionSignals(QObject):
+    on_report = Signal(str, dict, name='on_report')
+
+
+class PrecisionReporter(QRunnable):
+    def __init__(self, precision, config, fs, on_report_handler):
+        super().__init__()
+        self.__precision = precision
+        self.__config = config
+        self.__fs = fs
+        self.__signals = PrecisionSignals()
+        self.__signals.on_report.connect(on_report_handler)
+
+    def run(self):
+        '''
+        Compares the analysis at the configured precision against float64 and emits the max error per view.
+        '''
+        from model.signal import precision_report
+        self.__signals.on_report.emit(self.__precision, precision_report(self.__config, self.__fs))
+
+
 def keep_range(min_widget, max_widget, range):
     if min_widget.value() + range >= max_widget.value():
         min_widget.setValue(max_widget.value()-range)
@@ -1,5 +1,7 @@
 import logging
 import math
+from collections import OrderedDict
+from functools import lru_cache
 
 import numpy as np
 import pyqtgraph as pg
@@ -9,20 +11,29 @@ from qtpy.QtWidgets import QMessageBox
 from qtpy.QtCore import Qt
 
 from common import format_pg_plotitem, block_signals, FlowLayout
-from model.charts import VisibleChart, ChartEvent
+from model.charts import VisibleChart, ChunkedChartEvent
+from model.accumulators import HoldAccumulator, ExponentialAverage, CrossSpectrum
+from model.cache import fingerprint
 from model.frd import ExportDialog
-from model.preferences import RTA_TARGET, RTA_HOLD_SECONDS, RTA_SMOOTH_WINDOW, RTA_SMOOTH_POLY, ANALYSIS_HPF_RTA
-from model.signal import smooth_savgol, Analysis, TriAxisSignal, REF_ACCELERATION_IN_G
+from model.pool import AnalysisJob
+from model.preferences import RTA_TARGET, RTA_HOLD_SECONDS, RTA_SMOOTH_WINDOW, RTA_SMOOTH_POLY, RTA_AVERAGE_MODE, \
+    RTA_BAND_FRACTION, RTA_SMOOTH_MODE, RTA_ZOOM_FACTOR, ANALYSIS_RTA_OVERLOAD
+from model.signal import smooth_savgol, smooth_octave, Analysis, TriAxisSignal, get_db_reference, amplitude_to_db, \
+    BAND_FRACTIONS, ZOOM_FACTORS
 
 TARGET_PLOT_NAME = 'Target'
+ALL_CURVES = 'All'
+SMOOTH_MODE_SAVGOL = 'S-G'
+TRANSFER_MODES = ['H1', 'phase', 'coherence']
+MAX_NORMALISATIONS = 16
 
 logger = logging.getLogger('qvibe.rta')
 
 
-class RTAEvent(ChartEvent):
+class RTAEvent(ChunkedChartEvent):
 
-    def __init__(self, chart, measurement_name, input, idx, preferences, budget_millis, view, visible):
-        super().__init__(chart, measurement_name, input, idx, preferences, budget_millis)
+    def __init__(self, chart, measurement_name, input, idx, config, budget_millis, view, visible):
+        super().__init__(chart, measurement_name, input, idx, config, budget_millis)
         self.__view = view
         self.__visible = visible
 
@@ -30,16 +41,27 @@ class RTAEvent(ChartEvent):
         self.output = [self.__make_sig(i) for i in self.input]
         self.should_emit = True
 
+    def make_job(self):
+        # the transfer view needs the segment FFTs in this process
+        if self.__visible and self.__view != 'transfer':
+            return AnalysisJob(self.config, self.measurement_name, self.chart.fs, self.chart.resolution_shift,
+                               self.idx, self.__get_mode(), self.__view, self.input)
+        return None
+
+    def __get_mode(self):
+        return 'vibration' if self.config.hpf_rta is True else ''
+
     def __make_sig(self, chunk):
-        tas = TriAxisSignal(self.preferences,
+        tas = TriAxisSignal(self.config,
                             self.measurement_name,
                             chunk,
                             self.chart.fs,
                             self.chart.resolution_shift,
                             idx=self.idx,
-                            mode='vibration' if self.preferences.get(ANALYSIS_HPF_RTA) is True else '',
+                            mode=self.__get_mode(),
                             view_mode='spectrogram',
-                            pre_calc=self.__visible)
+                            pre_calc=self.__visible,
+                            shared=True)
         tas.set_view(self.__view, recalc=False)
         if self.__visible:
             tas.recalc()
@@ -48,7 +70,7 @@ class RTAEvent(ChartEvent):
 
 class RTA(VisibleChart):
     def __init__(self, parent_layout, parent_tab, chart, prefs, fs_widget, resolution_widget, fps_widget,
-                 actual_fps_widget, mag_min_widget, mag_max_widget, freq_min_widget, freq_max_widget,
+                 actual_fps_widget, queue_status_widget, mag_min_widget, mag_max_widget, freq_min_widget, freq_max_widget,
                  ref_curve_selector, show_value_selector, measurement_store_signals, colour_provider):
         measurement_store_signals.measurement_added.connect(self.__add_measurement)
         measurement_store_signals.measurement_deleted.connect(self.__remove_measurement)
@@ -60,16 +82,26 @@ class RTA(VisibleChart):
         self.__ref_curve = None
         self.__reset_selector(self.__ref_curve_selector)
         self.__reset_selector(self.__show_value_selector)
+        self.__show_value_selector.addItem(ALL_CURVES)
         self.__plots = {}
         self.__plot_data = {}
+        self.__display_data = {}
+        self.__normalisations = OrderedDict()
+        self.__accumulators = {}
         self.__smooth = False
+        self.__smoothed = {}
         self.__colour_provider = colour_provider
         self.__move_crosshairs = False
         self.__chunk_calc = None
+        self.__active_view = None
+        self.__zoom_factor = self.__ui.get_zoom_factor()
+        self.__cross = None
+        self.__transfer_mode = self.__ui.transfer_mode.currentText()
         self.__ui.toggle_crosshairs.toggled[bool].connect(self.__toggle_crosshairs)
-        super().__init__(prefs, fs_widget, resolution_widget, fps_widget, actual_fps_widget,
-                         False, coalesce=True, cache_size=-1, cache_purger=self.__purge_cache)
-        self.__peak_cache = {}
+        super().__init__(prefs, fs_widget, resolution_widget, fps_widget, actual_fps_widget, queue_status_widget,
+                         False, overload_policy_key=ANALYSIS_RTA_OVERLOAD)
+        self.__average_mode = self.__ui.average_mode.currentText()
+        self.__band_fraction = self.__ui.get_band_fraction()
         self.__hold_secs = self.__ui.hold_secs.value()
         self.__show_peak = self.__ui.show_peak.isChecked()
         self.__show_live = self.__ui.show_live.isChecked()
@@ -78,21 +110,34 @@ class RTA(VisibleChart):
         self.__show_target = self.__ui.show_target.isChecked()
         self.__show_target_toggle = self.__ui.show_target
         self.__ui.target_adjust_db.valueChanged.connect(self.__adjust_target_level)
+        self.__smooth_mode = None
+        self.__on_smooth_mode_change(self.__ui.smooth_mode.currentText())
         self.__sg_wl = self.__ui.sg_window_length.value()
         self.__sg_poly = None
         self.__on_sg_poly(self.__ui.sg_poly_order.value())
         self.__frame = 0
         self.__time = -1
         self.__update_rate = None
-        self.__active_view = None
         self.__chart = chart
         # wire the analysis to the view controls
         self.__mag_min = lambda: mag_min_widget.value()
         self.__mag_max = lambda: mag_max_widget.value()
         self.__freq_min = lambda: freq_min_widget.value()
         self.__freq_max = lambda: freq_max_widget.value()
+        self.__v_line_label = CurveAwareLabel(lambda: self.__display_data)
+        self.__h_line_label = AccelerationLabel()
+        # the readout is refreshed at most once per frame however many curves are updated
+        self.__readout_refresh = QtCore.QTimer()
+        self.__readout_refresh.setSingleShot(True)
+        self.__readout_refresh.setInterval(0)
+        self.__readout_refresh.timeout.connect(lambda: self.__v_line.label.valueChanged())
         self.__on_rta_view_change(self.__ui.rta_view.currentText())
         self.__ui.rta_view.currentTextChanged.connect(self.__on_rta_view_change)
+        self.__ui.band_fraction.currentTextChanged.connect(self.__on_band_fraction_change)
+        self.__ui.zoom_factor.currentTextChanged.connect(self.__on_zoom_factor_change)
+        self.__ui.transfer_input.currentTextChanged.connect(self.__on_transfer_pair_change)
+        self.__ui.transfer_output.currentTextChanged.connect(self.__on_transfer_pair_change)
+        self.__ui.transfer_mode.currentTextChanged.connect(self.__on_transfer_mode_change)
         self.__on_rta_smooth_change(self.__ui.smooth_rta.isChecked())
         self.__ui.smooth_rta.toggled[bool].connect(self.__on_rta_smooth_change)
         self.__legend = None
@@ -110,11 +155,13 @@ class RTA(VisibleChart):
         self.__ui.show_peak.toggled[bool].connect(self.__on_show_peak_change)
         self.__ui.show_live.toggled[bool].connect(self.__on_show_live_change)
         self.__ui.show_average.toggled[bool].connect(self.__on_show_average_change)
+        self.__ui.average_mode.currentTextChanged.connect(self.__on_average_mode_change)
         self.__ui.show_target.toggled[bool].connect(self.__on_show_target_change)
         self.__ui.hold_secs.valueChanged.connect(self.__set_max_cache_age)
         # S-G filter params
         self.__ui.sg_window_length.valueChanged['int'].connect(self.__on_sg_window_length)
         self.__ui.sg_poly_order.valueChanged['int'].connect(self.__on_sg_poly)
+        self.__ui.smooth_mode.currentTextChanged.connect(self.__on_smooth_mode_change)
         self.reload_target()
         # export
         self.__ui.export_frd.clicked.connect(self.__export_frd)
@@ -123,10 +170,9 @@ class RTA(VisibleChart):
         # marker curves
         self.__show_value_selector.currentTextChanged.connect(self.__set_show_value_curve)
         # crosshairs
-        self.__v_line_label = CurveAwareLabel()
         self.__v_line = pg.InfiniteLine(angle=90, movable=False, label=self.__v_line_label,
                                         labelOpts={'position': 0.95})
-        self.__h_line = pg.InfiniteLine(angle=0, movable=False, label=AccelerationLabel(), labelOpts={'position': 0.95})
+        self.__h_line = pg.InfiniteLine(angle=0, movable=False, label=self.__h_line_label, labelOpts={'position': 0.95})
         self.__chart.getPlotItem().addItem(self.__v_line, ignoreBounds=True)
         self.__chart.getPlotItem().addItem(self.__h_line, ignoreBounds=True)
 
@@ -138,6 +184,11 @@ class RTA(VisibleChart):
                 self.__h_line.setPos(mouse_point.y())
 
         self.__proxy = pg.SignalProxy(self.__chart.scene().sigMouseMoved, delay=0.125, rateLimit=20, slot=mouse_moved)
+        # curves are resampled to the visible plot area
+        view_box = self.__chart.getPlotItem().getViewBox()
+        view_box.sigXRangeChanged.connect(self.__fit_all_to_view)
+        view_box.sigResized.connect(self.__fit_all_to_view)
+        self.__chart.getPlotItem().ctrl.logXCheck.toggled.connect(self.__fit_all_to_view)
 
     def __toggle_crosshairs(self, move_crosshairs):
         self.__move_crosshairs = move_crosshairs
@@ -148,6 +199,8 @@ class RTA(VisibleChart):
         :param measurement: the measurement.
         '''
         self.__known_measurements.append(measurement.key)
+        self.__ui.transfer_input.addItem(measurement.key)
+        self.__ui.transfer_output.addItem(measurement.key)
 
     def __remove_measurement(self, measurement):
         '''
@@ -158,8 +211,11 @@ class RTA(VisibleChart):
             self.__known_measurements.remove(measurement.key)
         self.__chunk_calc.reset(measurement.key)
         self.remove_cached(measurement.key)
+        self.__accumulators.pop(measurement.key, None)
         self.__remove_from_selector(self.__ref_curve_selector, measurement.key)
         self.__remove_from_selector(self.__show_value_selector, measurement.key)
+        self.__remove_from_selector(self.__ui.transfer_input, measurement.key)
+        self.__remove_from_selector(self.__ui.transfer_output, measurement.key)
 
     def __set_reference_curve(self, curve):
         '''
@@ -171,6 +227,7 @@ class RTA(VisibleChart):
         if self.__ref_curve != new_curve:
             logger.info(f"Updating reference curve from {self.__ref_curve} to {new_curve}")
             self.__ref_curve = new_curve
+            self.__normalisations = OrderedDict()
             min_y, max_y = self.__chart.getPlotItem().getViewBox().state['viewRange'][1]
             adj = (max_y - min_y) / 2
             if old_curve is None:
@@ -188,19 +245,15 @@ class RTA(VisibleChart):
         Updates the curve associated with the vline.
         :param curve: the curve.
         '''
-        curve = curve if curve != '' else None
-        if curve in self.__plots:
-            curve = self.__plots[curve]
-        else:
-            curve = None
-        self.__v_line_label.curve = curve
+        self.__v_line_label.curve = curve if curve in self.__plots or curve == ALL_CURVES else None
         self.__v_line.label.valueChanged()
 
     def __export_frd(self):
         '''
         Shows the export dialog.
         '''
-        available_data = {n: d for n in self.cached_measurement_names() for d in self.cached_data(n) if d is not None}
+        available_data = {n: self.cached_data(n) for n in self.cached_measurement_names()
+                          if self.cached_data(n) is not None}
         if len(available_data.keys()) > 0:
             ExportDialog(self.__chart, available_data).exec()
         else:
@@ -210,6 +263,18 @@ class RTA(VisibleChart):
             msg_box.setWindowTitle('Nothing to export')
             msg_box.exec()
 
+    def __on_smooth_mode_change(self, mode):
+        '''
+        Switches between S-G and fractional octave smoothing.
+        :param mode: S-G or 1/n.
+        '''
+        self.__smooth_mode = mode
+        is_savgol = mode == SMOOTH_MODE_SAVGOL
+        self.__ui.sg_window_length.setEnabled(is_savgol)
+        self.__ui.sg_poly_order.setEnabled(is_savgol)
+        if self.__smooth is True:
+            self.update_all_plots()
+
     def __on_sg_window_length(self, wl):
         '''
         Updates the S-G window length.
@@ -241,7 +306,13 @@ class RTA(VisibleChart):
         :param seconds: the max age of a cache entry.
         '''
         self.__hold_secs = seconds
-        self.for_each_cache(self.__purge_cache)
+        for accumulator in self.__accumulators.values():
+            # the exponential average time constant is the hold time
+            accumulator.set_average_mode(self.__average_mode, self.__get_alpha())
+            self.__purge_cache(accumulator)
+        if self.__cross is not None:
+            self.__cross.set_average_mode(self.__average_mode, self.__get_alpha())
+            self.__cross.purge(self.__hold_secs * 1000.0)
 
     def __on_show_peak_change(self, checked):
         '''
@@ -272,6 +343,9 @@ class RTA(VisibleChart):
         :param val: ignored.
         '''
         self.__chart.getPlotItem().setXRange(self.__freq_min(), self.__freq_max(), padding=0)
+        if self.__active_view == 'zoom':
+            # the zoom band follows the visible range
+            self.__accumulators = {}
 
     def __on_rta_smooth_change(self, state):
         '''
@@ -289,6 +363,11 @@ class RTA(VisibleChart):
         old_view = self.__active_view
         logger.info(f"Updating active view from {old_view} to {view}")
         self.__active_view = view
+        self.__v_line_label.view = view
+        self.__h_line_label.view = view
+        self.__update_chunk_length()
+        self.__cross = None
+        self.__normalisations = OrderedDict()
 
         def propagate_view_change(cache):
             for c in cache:
@@ -298,6 +377,55 @@ class RTA(VisibleChart):
         self.update_all_plots()
         logger.info(f"Updated active view from {old_view} to {view}")
 
+    def __on_zoom_factor_change(self, text):
+        '''
+        Changes the resolution of the zoom view, this takes effect from the next chunk of data received.
+        :param text: the factor as xn.
+        '''
+        self.__zoom_factor = self.__ui.get_zoom_factor()
+        self.__update_chunk_length()
+        self.__accumulators = {}
+        self.__normalisations = OrderedDict()
+        self.update_all_plots()
+
+    def __on_transfer_pair_change(self, text):
+        '''
+        Changes the measurements compared in the transfer view, the averages start again from the next tick.
+        :param text: ignored.
+        '''
+        self.__cross = None
+        for name in [n for n in self.__plots.keys() if '>' in n]:
+            self.__remove_named_plot(name)
+        self.update_all_plots()
+
+    def __on_transfer_mode_change(self, mode):
+        '''
+        Changes what is shown in the transfer view.
+        :param mode: H1 (magnitude), phase or coherence.
+        '''
+        self.__transfer_mode = mode
+        self.update_all_plots()
+
+    def __get_chunk_length(self):
+        '''
+        :return: the length of each chunk, the zoom view analyses longer chunks in order to increase the resolution.
+        '''
+        return self.min_nperseg * self.__zoom_factor if self.__active_view == 'zoom' else self.min_nperseg
+
+    def __update_chunk_length(self):
+        if self.__chunk_calc is not None:
+            self.__chunk_calc.min_nperseg = self.__get_chunk_length()
+
+    def __on_band_fraction_change(self, text):
+        '''
+        Changes the width of the bands in the bands view, this takes effect from the next chunk of data received.
+        :param text: the fraction as 1/n.
+        '''
+        self.__band_fraction = self.__ui.get_band_fraction()
+        self.__accumulators = {}
+        self.__normalisations = OrderedDict()
+        self.update_all_plots()
+
     def __on_show_average_change(self, checked):
         '''
         whether to average the cached data.
@@ -306,6 +434,18 @@ class RTA(VisibleChart):
         self.__show_average = checked
         self.update_all_plots()
 
+    def __on_average_mode_change(self, mode):
+        '''
+        Changes how the cached data is averaged.
+        :param mode: window or exp.
+        '''
+        self.__average_mode = mode
+        for accumulator in self.__accumulators.values():
+            accumulator.set_average_mode(self.__average_mode, self.__get_alpha())
+        if self.__cross is not None:
+            self.__cross.set_average_mode(self.__average_mode, self.__get_alpha())
+        self.update_all_plots()
+
     def __on_show_target_change(self, checked):
         '''
         whether to show the target curve.
@@ -359,8 +499,11 @@ class RTA(VisibleChart):
         '''
         chunks = self.__chunk_calc.recalc(measurement_name, data)
         if chunks is not None:
-            return RTAEvent(self, measurement_name, chunks, idx, self.preferences, self.budget_millis,
-                            self.__active_view, self.visible)
+            config = self.preferences.analysis_config._replace(band_fraction=self.__band_fraction,
+                                                              zoom_band=self.__get_zoom_band(),
+                                                              zoom_factor=self.__zoom_factor)
+            return RTAEvent(self, measurement_name, chunks, idx, config, self.budget_millis, self.__active_view,
+                            self.visible)
         return None
 
     def reset_chart(self):
@@ -371,36 +514,47 @@ class RTA(VisibleChart):
             self.__chart.removeItem(c)
         self.__reset_selector(self.__ref_curve_selector)
         self.__reset_selector(self.__show_value_selector)
+        self.__show_value_selector.addItem(ALL_CURVES)
         self.__ref_curve = None
         self.__v_line_label.curve = None
         self.__plots = {}
         self.__plot_data = {}
-        self.__chunk_calc = ChunkCalculator(self.min_nperseg, self.__get_stride())
+        self.__display_data = {}
+        self.__smoothed = {}
+        self.__accumulators = {}
+        self.__cross = None
+        self.__chunk_calc = ChunkCalculator(self.__get_chunk_length(), self.__get_stride())
 
     def on_min_nperseg_change(self):
         '''
         Propagates min_nperseg to the chunk calculator.
         '''
+        self.__normalisations = OrderedDict()
         if self.__chunk_calc is None:
             if self.min_nperseg is not None and self.fs is not None and self.fps is not None:
-                self.__chunk_calc = ChunkCalculator(self.min_nperseg, self.__get_stride())
+                self.__chunk_calc = ChunkCalculator(self.__get_chunk_length(), self.__get_stride())
         else:
-            self.__chunk_calc.min_nperseg = self.min_nperseg
+            self.__update_chunk_length()
 
     def __get_stride(self):
         return int(self.fs / self.fps)
 
     def on_fs_change(self):
+        self.__normalisations = OrderedDict()
         if self.__chunk_calc is None:
             if self.min_nperseg is not None and self.fs is not None and self.fps is not None:
-                self.__chunk_calc = ChunkCalculator(self.min_nperseg, self.__get_stride())
+                self.__chunk_calc = ChunkCalculator(self.__get_chunk_length(), self.__get_stride())
         else:
             self.__chunk_calc.stride = self.__get_stride()
 
     def when_fps_changed(self):
+        for accumulator in self.__accumulators.values():
+            accumulator.set_average_mode(self.__average_mode, self.__get_alpha())
+        if self.__cross is not None:
+            self.__cross.set_average_mode(self.__average_mode, self.__get_alpha())
         if self.__chunk_calc is None:
             if self.min_nperseg is not None and self.fs is not None and self.fps is not None:
-                self.__chunk_calc = ChunkCalculator(self.min_nperseg, self.__get_stride())
+                self.__chunk_calc = ChunkCalculator(self.__get_chunk_length(), self.__get_stride())
         else:
             self.__chunk_calc.stride = self.__get_stride()
 
@@ -419,40 +573,150 @@ class RTA(VisibleChart):
         :param measurement_name: the recorder.
         '''
         data = self.cached_data(measurement_name)
-        if data is not None and len(data) > 0:
-            if data[-1].shape[0] >= self.min_nperseg:
-                self.__display_triaxis_signal(data)
+        if data is not None:
+            if data.shape[0] >= self.min_nperseg:
+                accumulator = self.__display_triaxis_signal(measurement_name, data)
                 for axis in ['x', 'y', 'z', 'sum']:
-                    self.render_peak(data, axis)
+                    self.render_peak(data, accumulator, axis)
+                self.__display_transfer_function(measurement_name, data)
 
-    def __display_triaxis_signal(self, signals, plot_name_prefix=''):
+    def __display_triaxis_signal(self, measurement_name, signal, plot_name_prefix=''):
         '''
         ensures the correct analysis curves for the signal are displayed on screen.
-        :param signal: the TriAxisSignals to average.
+        :param measurement_name: the measurement name.
+        :param signal: the latest TriAxisSignal.
         :param plot_name_prefix: extension to signal name for creating a plot name.
+        :return: the accumulator.
         '''
-        for signal in signals:
-            if signal.view != self.__active_view:
-                logger.info(f"Updating active view from {signal.view} to {self.__active_view} at {signal.idx}")
-                signal.set_view(self.__active_view)
-            if signal.has_data(self.__active_view) is False and signal.shape[0] >= self.min_nperseg:
-                signal.recalc()
-        self.render_signal(signals, 'x', plot_name_prefix=plot_name_prefix)
-        self.render_signal(signals, 'y', plot_name_prefix=plot_name_prefix)
-        self.render_signal(signals, 'z', plot_name_prefix=plot_name_prefix)
-        self.render_signal(signals, 'sum', plot_name_prefix=plot_name_prefix)
-
-    def __purge_cache(self, cache):
-        '''
-        Purges the cache of data older than peak_secs.
-        :param cache: the cache (a deque)
-        '''
-        while len(cache) > 1:
-            latest = cache[-1].time[-1]
-            if (latest - cache[0].time[-1]) >= (self.__hold_secs * 1000.0):
-                cache.popleft()
-            else:
-                break
+        accumulator = self.__sync_accumulator(measurement_name, signal)
+        self.render_signal(signal, accumulator, 'x', plot_name_prefix=plot_name_prefix)
+        self.render_signal(signal, accumulator, 'y', plot_name_prefix=plot_name_prefix)
+        self.render_signal(signal, accumulator, 'z', plot_name_prefix=plot_name_prefix)
+        self.render_signal(signal, accumulator, 'sum', plot_name_prefix=plot_name_prefix)
+        return accumulator
+
+    def __display_transfer_function(self, measurement_name, signal):
+        '''
+        Shows the transfer function (or coherence) between the selected measurements against the output measurement.
+        :param measurement_name: the measurement name.
+        :param signal: the latest TriAxisSignal.
+        '''
+        input_name = self.__ui.transfer_input.currentText()
+        if measurement_name != self.__ui.transfer_output.currentText() or not input_name:
+            return
+        cross = self.__cross if self.__active_view == 'transfer' else None
+        for axis in ['x', 'y', 'z']:
+            x_data = y_data = None
+            if cross is not None and cross.f is not None:
+                if self.__transfer_mode == 'coherence':
+                    coherence = cross.coherence(axis)
+                    if coherence is not None:
+                        y_data = coherence * 100.0
+                else:
+                    h1 = cross.transfer_function(axis)
+                    if h1 is not None:
+                        if self.__transfer_mode == 'phase':
+                            y_data = np.angle(h1, deg=True)
+                        else:
+                            y_data = amplitude_to_db(np.abs(h1))
+                x_data = cross.f
+            plot_name = f"{input_name}>{measurement_name}:{axis}"
+            self.__manage_plot_item(plot_name, signal.idx, measurement_name, axis, x_data, y_data,
+                                    {'style': Qt.SolidLine})
+
+    def __sync_accumulator(self, measurement_name, signal):
+        '''
+        Brings the accumulator for the measurement up to date by analysing any signals which have arrived since the
+        last update. If the accumulator is no longer valid, the held spectra cannot be reanalysed so it is replaced by
+        one which starts from the signals which have not been accumulated yet.
+        :param measurement_name: the measurement name.
+        :param signal: the latest TriAxisSignal.
+        :return: the accumulator.
+        '''
+        accumulator = self.__accumulators.get(measurement_name, None)
+        if accumulator is None or accumulator.view != self.__active_view or \
+                accumulator.min_nperseg != self.__get_chunk_length():
+            pending = accumulator.pending if accumulator is not None else []
+            if not pending or pending[-1] is not signal:
+                pending.append(signal)
+            accumulator = self.__create_accumulator(measurement_name)
+            for p in pending:
+                if self.__is_current(p):
+                    accumulator.add(p)
+        accumulator.accumulate(self.__analyse)
+        return accumulator
+
+    def __create_accumulator(self, measurement_name):
+        accumulator = HoldAccumulator(self.__active_view, self.__get_chunk_length(), average_mode=self.__average_mode,
+                                      alpha=self.__get_alpha(), capacity=int(self.__hold_secs * self.fps) + 1)
+        self.__accumulators[measurement_name] = accumulator
+        return accumulator
+
+    def __get_alpha(self):
+        return ExponentialAverage.alpha_for(self.__hold_secs, 1.0 / self.fps)
+
+    def __analyse(self, signal):
+        '''
+        Ensures the signal has been analysed for the active view.
+        :param signal: the TriAxisSignal.
+        '''
+        if signal.view != self.__active_view:
+            logger.info(f"Updating active view from {signal.view} to {self.__active_view} at {signal.idx}")
+            signal.set_view(self.__active_view)
+        if signal.has_data(self.__active_view) is False and signal.shape[0] >= self.min_nperseg:
+            signal.recalc()
+
+    def on_data_cached(self, data):
+        '''
+        Adds the fresh data to the hold cache, only the spectra are retained once it has been analysed.
+        :param data: the TriAxisSignal.
+        '''
+        if self.__active_view == 'transfer':
+            self.__accumulate_cross_spectra(data)
+        if self.__is_current(data):
+            accumulator = self.__accumulators.get(data.measurement_name, None)
+            if accumulator is None:
+                accumulator = self.__create_accumulator(data.measurement_name)
+            accumulator.add(data)
+            self.__purge_cache(accumulator)
+
+    def __accumulate_cross_spectra(self, data):
+        '''
+        Adds the fresh data to the cross spectra if it is from one of the selected measurements.
+        :param data: the TriAxisSignal.
+        '''
+        input_name = self.__ui.transfer_input.currentText()
+        output_name = self.__ui.transfer_output.currentText()
+        if not input_name or not output_name or input_name == output_name:
+            self.__cross = None
+            return
+        if self.__cross is None or self.__cross.min_nperseg != self.min_nperseg:
+            self.__cross = CrossSpectrum(input_name, output_name, self.min_nperseg, average_mode=self.__average_mode,
+                                         alpha=self.__get_alpha())
+        if self.__cross.add(data):
+            self.__cross.purge(self.__hold_secs * 1000.0)
+
+    def __is_current(self, signal):
+        '''
+        :param signal: the TriAxisSignal.
+        :return: false if the signal was analysed with different band or zoom settings to the active ones.
+        '''
+        if self.__active_view == 'bands':
+            return signal.config.band_fraction == self.__band_fraction
+        if self.__active_view == 'zoom':
+            return signal.config.zoom_band == self.__get_zoom_band() and \
+                   signal.config.zoom_factor == self.__zoom_factor and signal.shape[0] >= self.__get_chunk_length()
+        return True
+
+    def __get_zoom_band(self):
+        return self.__freq_min(), self.__freq_max()
+
+    def __purge_cache(self, accumulator):
+        '''
+        Purges the hold cache of data older than peak_secs.
+        :param accumulator: the hold cache.
+        '''
+        accumulator.purge(self.__hold_secs * 1000.0)
 
     def __render_target(self):
         '''
@@ -466,48 +730,47 @@ class RTA(VisibleChart):
             y_db = self.__target_data.y + self.__target_adjustment_db
             self.__render_or_update(pen_args, TARGET_PLOT_NAME, self.__target_data.x, y_db)
 
-    def render_peak(self, data, axis):
+    def render_peak(self, data, accumulator, axis):
         '''
         Converts a peak dataset into a renderable plot item.
-        :param data: the cached data.
+        :param data: the latest TriAxisSignal.
+        :param accumulator: the accumulated cached data.
         :param axis: the axis to display.
         '''
         y_data = x_data = pen_args = None
-        sig = getattr(data[-1], axis)
+        sig = getattr(data, axis)
         if self.__show_peak is True:
             has_data = sig.get_analysis(self.__active_view)
             if has_data is not None:
-                if all([d.shape[0] >= self.min_nperseg for d in data]):
-                    data_ = [getattr(d, axis).get_analysis(self.__active_view).y for d in data]
-                    y_data = np.maximum.reduce(data_)
+                y_data = accumulator.peak(axis)
                 x_data = has_data.x
             pen_args = {'style': Qt.DashLine}
-        self.__manage_plot_item(f"{sig.measurement_name}:{sig.axis}:peak", data[-1].idx, sig.measurement_name, sig.axis,
+        self.__manage_plot_item(f"{sig.measurement_name}:{sig.axis}:peak", data.idx, sig.measurement_name, sig.axis,
                                 x_data, y_data, pen_args)
 
-    def render_signal(self, data, axis, plot_name_prefix=''):
+    def render_signal(self, data, accumulator, axis, plot_name_prefix=''):
         '''
         Converts (one or more) signal into a renderable plot item.
-        :param data: the cached data.
+        :param data: the latest TriAxisSignal.
+        :param accumulator: the accumulated cached data.
         :param axis: the axis to display.
         :param plot_name_prefix: optional plot name prefix.
         '''
         y_data = y_avg = x_data = None
-        sig = getattr(data[-1], axis)
+        sig = getattr(data, axis)
         has_data = sig.get_analysis(self.__active_view)
         if has_data is not None:
             if self.__show_average is True:
-                if all([d.shape[0] >= self.min_nperseg for d in data]):
-                    y_avg = np.average([getattr(d, axis).get_analysis(self.__active_view).y for d in data], axis=0)
+                y_avg = accumulator.average(axis)
             if self.__show_live is True:
                 y_data = has_data.y
             x_data = has_data.x
         pen = {'style': Qt.SolidLine}
         plot_name = f"{plot_name_prefix}{sig.measurement_name}:{sig.axis}"
-        self.__manage_plot_item(plot_name, data[-1].idx, sig.measurement_name, sig.axis, x_data, y_data, pen)
+        self.__manage_plot_item(plot_name, data.idx, sig.measurement_name, sig.axis, x_data, y_data, pen)
         avg_pen = {'style': Qt.DashDotDotLine}
         avg_plot_name = f"{plot_name_prefix}{sig.measurement_name}:{sig.axis}:avg"
-        self.__manage_plot_item(avg_plot_name, data[-1].idx, sig.measurement_name, sig.axis, x_data, y_avg, avg_pen)
+        self.__manage_plot_item(avg_plot_name, data.idx, sig.measurement_name, sig.axis, x_data, y_avg, avg_pen)
 
     def __manage_plot_item(self, name, idx, measurement_name, axis, x_data, y_data, pen_args):
         '''
@@ -534,6 +797,8 @@ class RTA(VisibleChart):
         self.__chart.removeItem(self.__plots[name])
         del self.__plots[name]
         del self.__plot_data[name]
+        self.__display_data.pop(name, None)
+        self.__smoothed.pop(name, None)
         self.__legend.removeItem(name)
         self.__remove_from_selector(self.__ref_curve_selector, name)
         self.__remove_from_selector(self.__show_value_selector, name)
@@ -563,12 +828,35 @@ class RTA(VisibleChart):
         :param pen_args: the description of the pen.
         '''
         if self.is_visible(measurement=measurement_name, axis=axis) is True:
-            y = smooth_savgol(x_data, y_data, wl=self.__sg_wl, poly=self.__sg_poly)[
-                1] if self.__smooth is True else y_data
+            # bands are already aggregated and too few in number for the filter window
+            if self.__smooth is True and self.__active_view != 'bands':
+                y = self.__smooth_curve(plot_name, x_data, y_data)
+            else:
+                y = y_data
             self.__render_or_update(pen_args, plot_name, x_data, y, axis=axis)
         elif plot_name in self.__plots:
             self.__remove_named_plot(plot_name)
 
+    def __smooth_curve(self, plot_name, x_data, y_data):
+        '''
+        Smooths the curve, the result is cached so a curve is smoothed again only if its data or the smoothing settings
+        have changed since it was last drawn.
+        :param plot_name: plot name.
+        :param x_data: x data.
+        :param y_data: y data.
+        :return: the smoothed y data.
+        '''
+        settings = (self.__smooth_mode, self.__sg_wl, self.__sg_poly)
+        cached = self.__smoothed.get(plot_name, None)
+        if cached is not None and cached[0] is y_data and cached[1] == settings:
+            return cached[2]
+        if self.__smooth_mode == SMOOTH_MODE_SAVGOL:
+            y = smooth_savgol(x_data, y_data, wl=self.__sg_wl, poly=self.__sg_poly)[1]
+        else:
+            y = smooth_octave(x_data, y_data, int(self.__smooth_mode[2:]))[1]
+        self.__smoothed[plot_name] = (y_data, settings, y)
+        return y
+
     def __render_or_update(self, pen_args, plot_name, x_data, y, axis=None):
         '''
         actually updates (or creates) the plot.
@@ -589,9 +877,10 @@ class RTA(VisibleChart):
             if ref_plot_name in self.__plot_data:
                 ref_plot_data = self.__plot_data[ref_plot_name]
                 x_data, y = self.__normalise(ref_plot_data[0], ref_plot_data[1], x_data, y)
+        self.__display_data[plot_name] = x_data, y
+        x_data, y = self.__fit_to_view(x_data, y)
         if plot_name in self.__plots:
             self.__plots[plot_name].setData(x_data, y)
-            self.__v_line.label.valueChanged()
         else:
             if self.__legend is None:
                 self.__legend = self.__chart.addLegend(offset=(-15, -15))
@@ -599,6 +888,28 @@ class RTA(VisibleChart):
             self.__plots[plot_name] = self.__chart.plot(x_data, y, pen=pen, name=plot_name)
             self.__ensure_curve_in_selector(self.__ref_curve_selector, plot_name)
             self.__ensure_curve_in_selector(self.__show_value_selector, plot_name, include_measurement=False)
+        if self.__v_line_label.shows(plot_name):
+            self.__readout_refresh.start()
+
+    def __fit_to_view(self, x_data, y):
+        '''
+        Resamples the curve onto the pixels of the visible plot area.
+        :param x_data: x.
+        :param y: y.
+        :return: the x and y values to plot.
+        '''
+        plot_item = self.__chart.getPlotItem()
+        x_min, x_max = plot_item.viewRange()[0]
+        pixels = int(plot_item.getViewBox().width())
+        edges = get_display_grid(x_min, x_max, pixels if pixels > 0 else 1000, plot_item.ctrl.logXCheck.isChecked())
+        return downsample_peaks(x_data, y, edges)
+
+    def __fit_all_to_view(self, *args):
+        ''' Resamples each curve again when the visible plot area changes. '''
+        for name, plot in self.__plots.items():
+            data = self.__display_data.get(name, None)
+            if data is not None:
+                plot.setData(*self.__fit_to_view(*data))
 
     def __ensure_curve_in_selector(self, selector, plot_name, include_measurement=True):
         ''' Ensures the name is in the combo '''
@@ -610,8 +921,7 @@ class RTA(VisibleChart):
                         selector.addItem(m_name)
             selector.addItem(plot_name)
 
-    @staticmethod
-    def __normalise(ref_x, ref_y, data_x, data_y):
+    def __normalise(self, ref_x, ref_y, data_x, data_y):
         '''
         Creates a new dataset which shows the delta between the data and the reference.
         :param ref_x: the ref x values.
@@ -620,42 +930,58 @@ class RTA(VisibleChart):
         :param data_y: the data y values.
         :return: the resulting normalised x and y values.
         '''
-        ref_step = ref_x[1] - ref_x[0]
-        data_step = data_x[1] - data_x[0]
-        if ref_step == data_step:
-            count = min(ref_x.size, data_x.size) - 1
-            new_x = data_x[0:count]
-            new_y = data_y[0:count] - ref_y[0:count]
+        key = (Normalisation.grid_key(ref_x), Normalisation.grid_key(data_x))
+        normalisation = self.__normalisations.get(key, None)
+        if normalisation is None:
+            normalisation = self.__normalisations[key] = Normalisation(ref_x, data_x)
+            # the grids only change with the view, resolution or curve so only the most recent pairs are retained
+            while len(self.__normalisations) > MAX_NORMALISATIONS:
+                self.__normalisations.popitem(last=False)
         else:
-            if data_x[-1] == ref_x[-1]:
-                # same max so upsample to the more precise one
-                if data_step < ref_step:
-                    new_x = data_x
-                    new_y = data_y - np.interp(data_x, ref_x, ref_y)[1]
-                else:
-                    new_x = ref_x
-                    new_y = data_y - np.interp(ref_x, data_x, data_y)[1]
-            elif data_x[-1] > ref_x[-1]:
-                # restrict the self data range to the limits of the target
-                capped_x = data_x[data_x <= ref_x[-1]]
-                capped_y = data_y[0:capped_x.size]
-                if data_step < ref_step:
-                    new_x = capped_x
-                    new_y = capped_y - np.interp(capped_x, ref_x, ref_y)[1]
-                else:
-                    new_x = ref_x
-                    new_y = np.interp(ref_x, capped_x, capped_y)[1] - ref_y
-            else:
-                # restrict the target data range to the limits of the self
-                capped_x = ref_x[ref_x <= data_x[-1]]
-                capped_y = ref_y[0:capped_x.size]
-                if ref_step < data_step:
-                    new_x = data_x
-                    new_y = data_y - np.interp(data_x, capped_x, capped_y)[1]
-                else:
-                    new_x = capped_x
-                    new_y = np.interp(ref_x, data_x, data_y)[1] - ref_y
-        return new_x, new_y
+            self.__normalisations.move_to_end(key)
+        return normalisation.apply(ref_y, data_y)
+
+
+class Normalisation:
+    '''
+    Maps a curve and a reference curve onto a common grid, the finer of the two grids restricted to the range which
+    both cover, so the delta between them can be calculated. The interpolation indices and weights are calculated once
+    for each pair of grids as the grids rarely change from one frame to the next.
+    '''
+
+    def __init__(self, ref_x, data_x):
+        '''
+        :param ref_x: the ref x values.
+        :param data_x: the data x values.
+        '''
+        lo = max(ref_x[0], data_x[0])
+        hi = min(ref_x[-1], data_x[-1])
+        self.__data_is_finer = data_x.size / (data_x[-1] - data_x[0]) >= ref_x.size / (ref_x[-1] - ref_x[0])
+        grid, coarse = (data_x, ref_x) if self.__data_is_finer else (ref_x, data_x)
+        self.__keep = np.flatnonzero((grid >= lo) & (grid <= hi))
+        self.__x = grid[self.__keep]
+        self.__idx = np.clip(np.searchsorted(coarse, self.__x, side='right') - 1, 0, coarse.size - 2)
+        self.__weight = np.clip((self.__x - coarse[self.__idx]) / np.diff(coarse)[self.__idx], 0.0, 1.0)
+
+    @staticmethod
+    def grid_key(x):
+        '''
+        :param x: the x values.
+        :return: a key which identifies the grid by its contents.
+        '''
+        return x.size, x.dtype.str, fingerprint(x)
+
+    def apply(self, ref_y, data_y):
+        '''
+        :param ref_y: the ref y values.
+        :param data_y: the data y values.
+        :return: the x values and the delta between the data and the reference at each one.
+        '''
+        if self.__data_is_finer:
+            lower = ref_y[self.__idx]
+            return self.__x, data_y[self.__keep] - (lower + self.__weight * (ref_y[self.__idx + 1] - lower))
+        lower = data_y[self.__idx]
+        return self.__x, lower + self.__weight * (data_y[self.__idx + 1] - lower) - ref_y[self.__keep]
 
 
 class ChunkCalculator:
@@ -697,51 +1023,126 @@ class ChunkCalculator:
         return None
 
 
+@lru_cache(maxsize=16)
+def get_display_grid(x_min, x_max, pixels, log):
+    '''
+    :param x_min: the lowest visible x value, as a log10 value if the axis is logarithmic.
+    :param x_max: the highest visible x value, as a log10 value if the axis is logarithmic.
+    :param pixels: the width of the plot area in pixels.
+    :param log: true if the x axis is logarithmic.
+    :return: the edges of the span of x values covered by each pixel.
+    '''
+    edges = np.linspace(x_min, x_max, pixels + 1)
+    if log is True:
+        edges = 10.0 ** edges
+    edges.setflags(write=False)
+    return edges
+
+
+def downsample_peaks(x, y, edges):
+    '''
+    Reduces a curve to at most one point per pixel, the point with the highest value, so that peaks remain visible.
+    Points beyond the grid are dropped apart from the nearest point on either side so the curve runs to the edges of
+    the plot.
+    :param x: the x values in ascending order.
+    :param y: the y values.
+    :param edges: the display grid.
+    :return: the x and y values to plot, the curve is returned as is if it has no more points than pixels.
+    '''
+    first, last = np.searchsorted(x, (edges[0], edges[-1]))
+    lo = max(first - 1, 0)
+    hi = min(last + 1, x.size)
+    if hi - lo <= edges.size - 1:
+        return x, y
+    bounds = np.unique(np.concatenate(([lo], np.searchsorted(x, edges), [hi])))
+    values = y[lo:hi]
+    values = np.where(np.isnan(values), -np.inf, values)
+    peaks = np.maximum.reduceat(values, bounds[:-1] - lo)
+    pixel = np.repeat(np.arange(peaks.size), np.diff(bounds))
+    # the first point in each pixel which has the peak value
+    hits = np.flatnonzero(values == peaks[pixel])
+    hits = hits[np.concatenate(([True], np.diff(pixel[hits]) != 0))] + lo
+    return x[hits], y[hits]
+
+
 class CurveAwareLabel:
-    def __init__(self):
+    def __init__(self, curves):
+        '''
+        :param curves: provides the full resolution x and y values of each visible curve by name.
+        '''
         self.curve = None
+        self.view = None
+        self.__curves = curves
         self.__no_curve_format = '[{value:0.1f} Hz]'
         self.__curve_format = '[{value:0.1f} Hz / {mag:0.1f} dB{accel}]'
-        self.__accel_format = '{sep}{accel:0.3f}{suffix}{unit}'
+        self.__all_curves_format = '{name}: {mag:0.1f} dB{accel}'
+
+    def shows(self, name):
+        '''
+        :param name: a curve name.
+        :return: true if the value of the curve is shown.
+        '''
+        return self.curve == ALL_CURVES or self.curve == name
 
     def format(self, value):
         if self.curve is None:
             return self.__no_curve_format.format(value=value)
-        else:
-            mag = self.__get_y_pos(value)
-            if mag == -1:
-                accel = ''
-            else:
-                sep = ' / '
-                unit = 'G'
-                suffix = ''
-                accel = 10.0 ** (mag / 20) * REF_ACCELERATION_IN_G
-                if accel <= 0.1:
-                    accel *= 1000.0
-                    suffix = 'm'
-                accel = self.__accel_format.format(suffix=suffix, unit=unit, sep=sep, accel=accel)
-            return self.__curve_format.format(value=value, mag=mag, accel=accel)
-
-    def __get_y_pos(self, hz):
-        try:
-            x, y = self.curve.getData()
-            return y[np.argmax(x >= hz)]
-        except:
-            return -1.0
+        curves = self.__curves()
+        if self.curve == ALL_CURVES:
+            lines = [self.__no_curve_format.format(value=value)]
+            for name in sorted(curves.keys()):
+                mag = self.__get_y_pos(curves[name], value)
+                if mag is not None:
+                    lines.append(self.__all_curves_format.format(name=name, mag=mag, accel=self.__format_accel(mag)))
+            return '\n'.join(lines)
+        mag = self.__get_y_pos(curves.get(self.curve, None), value)
+        if mag is None:
+            return self.__curve_format.format(value=value, mag=-1.0, accel='')
+        return self.__curve_format.format(value=value, mag=mag, accel=self.__format_accel(mag))
+
+    def __format_accel(self, mag):
+        return f" / {format_magnitude(mag, self.view)}"
+
+    @staticmethod
+    def __get_y_pos(curve, hz):
+        '''
+        :param curve: the x and y values of the curve.
+        :param hz: the frequency.
+        :return: the value at the first x value at or above the frequency, None if there is no such value.
+        '''
+        if curve is None:
+            return None
+        x, y = curve
+        idx = np.searchsorted(x, hz)
+        return y[idx] if idx < x.size else None
 
 
 class AccelerationLabel:
     def __init__(self):
-        self.__format = '[{value:0.1f} dB / {accel:0.3f} {suffix}G]'
+        self.view = None
+        self.__format = '[{value:0.1f} dB / {accel}]'
 
     def format(self, value):
-        accel = 10.0 ** (value / 20) * REF_ACCELERATION_IN_G
-        if accel <= 0.1:
-            accel *= 1000.0
-            suffix = 'm'
-        else:
-            suffix = ''
-        return self.__format.format(value=value, accel=accel, suffix=suffix)
+        return self.__format.format(value=value, accel=format_magnitude(value, self.view))
+
+
+def format_magnitude(db, view):
+    '''
+    :param db: a level in dB.
+    :param view: the active view.
+    :return: the level in the units of the view, i.e. acceleration (G), velocity (mm/s), displacement (micro m) or the
+    gain of the transfer function.
+    '''
+    if view == 'transfer':
+        return f"x{10.0 ** (db / 20):0.3f}"
+    magnitude = 10.0 ** (db / 20) * get_db_reference(view)
+    if view == 'velocity':
+        return f"{magnitude:0.3f} mm/s"
+    if view == 'displacement':
+        return f"{magnitude:0.3f} \u00b5m"
+    if magnitude <= 0.1:
+        return f"{magnitude * 1000.0:0.3f} mG"
+    return f"{magnitude:0.3f} G"
 
 
 class ControlUi:
@@ -759,7 +1160,42 @@ class ControlUi:
         self.rta_view.addItem("")
         self.rta_view.addItem("")
         self.rta_view.addItem("")
+        self.rta_view.addItem("")
+        self.rta_view.addItem("")
+        self.rta_view.addItem("")
+        self.rta_view.addItem("")
+        self.rta_view.addItem("")
         self.rta_controls_layout.addWidget(self.rta_view)
+        self.band_fraction = QtWidgets.QComboBox(self.rta_tab)
+        self.band_fraction.setObjectName("bandFraction")
+        for f in BAND_FRACTIONS:
+            self.band_fraction.addItem(f"1/{f}")
+        self.band_fraction.setCurrentText(f"1/{self.preferences.get(RTA_BAND_FRACTION)}")
+        self.band_fraction.setToolTip('Bands per octave in the bands view')
+        self.rta_controls_layout.addWidget(self.band_fraction)
+        self.zoom_factor = QtWidgets.QComboBox(self.rta_tab)
+        self.zoom_factor.setObjectName("zoomFactor")
+        for f in ZOOM_FACTORS:
+            self.zoom_factor.addItem(f"x{f}")
+        self.zoom_factor.setCurrentText(f"x{self.preferences.get(RTA_ZOOM_FACTOR)}")
+        self.zoom_factor.setToolTip('Resolution multiplier for the zoom view, the band shown is zoomed')
+        self.rta_controls_layout.addWidget(self.zoom_factor)
+        self.transfer_input = QtWidgets.QComboBox(self.rta_tab)
+        self.transfer_input.setObjectName("transferInput")
+        self.transfer_input.addItem('')
+        self.transfer_input.setToolTip('The input (source) measurement in the transfer view')
+        self.rta_controls_layout.addWidget(self.transfer_input)
+        self.transfer_output = QtWidgets.QComboBox(self.rta_tab)
+        self.transfer_output.setObjectName("transferOutput")
+        self.transfer_output.addItem('')
+        self.transfer_output.setToolTip('The output (response) measurement in the transfer view')
+        self.rta_controls_layout.addWidget(self.transfer_output)
+        self.transfer_mode = QtWidgets.QComboBox(self.rta_tab)
+        self.transfer_mode.setObjectName("transferMode")
+        for m in TRANSFER_MODES:
+            self.transfer_mode.addItem(m)
+        self.transfer_mode.setToolTip('H1 magnitude (dB), phase (degrees) or coherence (%) in the transfer view')
+        self.rta_controls_layout.addWidget(self.transfer_mode)
         self.hold_time_label = QtWidgets.QLabel(self.rta_tab)
         self.hold_time_label.setObjectName("holdTimeLabel")
         self.rta_controls_layout.addWidget(self.hold_time_label)
@@ -784,6 +1220,11 @@ class ControlUi:
         self.show_average.setCheckable(True)
         self.show_average.setObjectName("showAverage")
         self.rta_controls_layout.addWidget(self.show_average)
+        self.average_mode = QtWidgets.QComboBox(self.rta_tab)
+        self.average_mode.setObjectName("averageMode")
+        self.average_mode.addItem("")
+        self.average_mode.addItem("")
+        self.rta_controls_layout.addWidget(self.average_mode)
         self.show_target = QtWidgets.QPushButton(self.rta_tab)
         self.show_target.setCheckable(True)
         self.show_target.setObjectName("showTarget")
@@ -799,6 +1240,14 @@ class ControlUi:
         self.smooth_rta.setCheckable(True)
         self.smooth_rta.setObjectName("smoothRta")
         self.rta_controls_layout.addWidget(self.smooth_rta)
+        self.smooth_mode = QtWidgets.QComboBox(self.rta_tab)
+        self.smooth_mode.setObjectName("smoothMode")
+        self.smooth_mode.addItem(SMOOTH_MODE_SAVGOL)
+        for f in BAND_FRACTIONS[1:]:
+            self.smooth_mode.addItem(f"1/{f}")
+        self.smooth_mode.setCurrentText(self.preferences.get(RTA_SMOOTH_MODE))
+        self.smooth_mode.setToolTip('Savitzky-Golay or fractional octave smoothing')
+        self.rta_controls_layout.addWidget(self.smooth_mode)
         self.sg_window_length = QtWidgets.QSpinBox(self.rta_tab)
         self.sg_window_length.setMinimum(1)
         self.sg_window_length.setMaximum(201)
@@ -834,12 +1283,21 @@ class ControlUi:
         self.rta_view.setItemText(0, _translate("MainWindow", "avg"))
         self.rta_view.setItemText(1, _translate("MainWindow", "peak"))
         self.rta_view.setItemText(2, _translate("MainWindow", "psd"))
+        self.rta_view.setItemText(3, _translate("MainWindow", "bands"))
+        self.rta_view.setItemText(4, _translate("MainWindow", "zoom"))
+        self.rta_view.setItemText(5, _translate("MainWindow", "velocity"))
+        self.rta_view.setItemText(6, _translate("MainWindow", "displacement"))
+        self.rta_view.setItemText(7, _translate("MainWindow", "transfer"))
         self.hold_time_label.setText(_translate("MainWindow", "Hold Time:"))
         self.hold_secs.setToolTip(_translate("MainWindow", "Seconds of data to include in peak calculation"))
         self.hold_secs.setSuffix(_translate("MainWindow", " s"))
         self.show_live.setText(_translate("MainWindow", "Live"))
         self.show_peak.setText(_translate("MainWindow", "Peak"))
         self.show_average.setText(_translate("MainWindow", "Average"))
+        self.average_mode.setItemText(0, _translate("MainWindow", "window"))
+        self.average_mode.setItemText(1, _translate("MainWindow", "exp"))
+        self.average_mode.setCurrentText(self.preferences.get(RTA_AVERAGE_MODE))
+        self.average_mode.setToolTip('Average over the hold time (window) or with the hold time as time constant (exp)')
         self.show_target.setText(_translate("MainWindow", "Target"))
         self.target_adjust_db.setSuffix(_translate("MainWindow", " dB"))
         self.target_adjust_db.setToolTip('Adjusts the level of the target curve')
@@ -857,3 +1315,19 @@ class ControlUi:
         self.preferences.set(RTA_HOLD_SECONDS, self.hold_secs.value())
         self.preferences.set(RTA_SMOOTH_WINDOW, self.sg_window_length.value())
         self.preferences.set(RTA_SMOOTH_POLY, self.sg_poly_order.value())
+        self.preferences.set(RTA_AVERAGE_MODE, self.average_mode.currentText())
+        self.preferences.set(RTA_BAND_FRACTION, self.get_band_fraction())
+        self.preferences.set(RTA_SMOOTH_MODE, self.smooth_mode.currentText())
+        self.preferences.set(RTA_ZOOM_FACTOR, self.get_zoom_factor())
+
+    def get_band_fraction(self):
+        '''
+        :return: the selected bands per octave.
+        '''
+        return int(self.band_fraction.currentText()[2:])
+
+    def get_zoom_factor(self):
+        '''
+        :return: the selected zoom factor.
+        '''
+        return int(self.zoom_factor.currentText()[1:])
@@ -1,13 +1,19 @@
 import abc
 import logging
 import time
+from collections import namedtuple
+from functools import lru_cache
 
 import numpy as np
-from scipy import signal
+from scipy import signal, sparse
 from scipy.interpolate import PchipInterpolator
 
+from model.cache import get_analysis_cache, fingerprint
 from model.log import to_millis
-from model.preferences import SUM_X_SCALE, SUM_Y_SCALE, SUM_Z_SCALE, ANALYSIS_DETREND
+from model.fft import get_fft
+from model.preferences import SUM_X_SCALE, SUM_Y_SCALE, SUM_Z_SCALE, ANALYSIS_DETREND, ANALYSIS_AVG_WINDOW, \
+    ANALYSIS_PEAK_WINDOW, ANALYSIS_HPF_RTA, ANALYSIS_FFT_BACKEND, ANALYSIS_FFT_WORKERS, ANALYSIS_PRECISION, \
+    CHART_FREQ_MIN, CHART_FREQ_MAX, ANALYSIS_INTEGRATION_FLOOR, RTA_BAND_FRACTION, RTA_ZOOM_FACTOR
 from common import np_to_str
 
 SAVGOL_WINDOW_LENGTH = 101
@@ -16,36 +22,98 @@ SAVGOL_POLYORDER = 7
 ADJUST_BY_3DB = 1 / (2 ** 0.5)
 # 1 micro m/s2 in G produces 0dB means 1G = ~140dB, 0.1G = ~120dB, 0.01G = ~100dB, 0.001G = ~80dB and 0.0001G = ~60dB
 REF_ACCELERATION_IN_G = (10 ** -6) / 9.80665
+# velocity is in mm/s and displacement in micro m with references of 1 nm/s and 1 pm respectively (as per ISO 1683)
+REF_VELOCITY_IN_MM_S = 10 ** -6
+REF_DISPLACEMENT_IN_UM = 10 ** -6
+G_IN_MM_S2 = 9806.65
+G_IN_UM_S2 = 9806650.0
+# the views which integrate the acceleration spectrum mapped to the number of integrations and the scale from G
+INTEGRATED_VIEWS = {
+    'velocity': (1, G_IN_MM_S2),
+    'displacement': (2, G_IN_UM_S2)
+}
 X_RESOLUTION = 32769
+DEFAULT_AVG_WINDOW = 'hann'
+DEFAULT_PEAK_WINDOW = ('tukey', 0.25)
+BAND_FRACTIONS = [1, 3, 6, 12, 24]
+ZOOM_FACTORS = [2, 4, 8, 16, 32]
 
 logger = logging.getLogger('qvibe.signal')
 
 
+class AnalysisConfig(namedtuple('AnalysisConfig', ['detrend', 'avg_window', 'peak_window', 'sum_scales',
+                                                   'hpf_rta', 'fft_backend', 'fft_workers', 'dtype',
+                                                   'band_fraction', 'zoom_band', 'zoom_factor',
+                                                   'integration_floor'])):
+    '''
+    An immutable snapshot of the preferences which drive the analysis. This is built once, on the main thread, when
+    the preferences change and is then handed to the analysers so that no settings lookups happen in the worker
+    threads.
+    '''
+    __slots__ = ()
+
+    @staticmethod
+    def from_preferences(preferences):
+        '''
+        Snapshots the analysis preferences.
+        :param preferences: the preferences store.
+        :return: the config.
+        '''
+        detrend = preferences.get(ANALYSIS_DETREND)
+        return AnalysisConfig(detrend=False if detrend == 'none' else detrend,
+                              avg_window=get_window(preferences, ANALYSIS_AVG_WINDOW),
+                              peak_window=get_window(preferences, ANALYSIS_PEAK_WINDOW),
+                              sum_scales=(preferences.get(SUM_X_SCALE),
+                                          preferences.get(SUM_Y_SCALE),
+                                          preferences.get(SUM_Z_SCALE)),
+                              hpf_rta=preferences.get(ANALYSIS_HPF_RTA),
+                              fft_backend=preferences.get(ANALYSIS_FFT_BACKEND),
+                              fft_workers=preferences.get(ANALYSIS_FFT_WORKERS),
+                              dtype=np.dtype(preferences.get(ANALYSIS_PRECISION)),
+                              band_fraction=preferences.get(RTA_BAND_FRACTION),
+                              zoom_band=(preferences.get(CHART_FREQ_MIN), preferences.get(CHART_FREQ_MAX)),
+                              zoom_factor=preferences.get(RTA_ZOOM_FACTOR),
+                              integration_floor=preferences.get(ANALYSIS_INTEGRATION_FLOOR))
+
+    @property
+    def fft(self):
+        '''
+        :return: the FFT backend.
+        '''
+        return get_fft(self.fft_backend, self.fft_workers)
+
+
 class TriAxisSignal:
 
-    def __init__(self, preferences, measurement_name, data, fs, resolution_shift, idx=-1, mode='vibration',
-                 pre_calc=False, view_mode='avg'):
+    def __init__(self, config, measurement_name, data, fs, resolution_shift, idx=-1, mode='vibration',
+                 pre_calc=False, view_mode='avg', shared=False):
+        '''
+        :param shared: if true, the filtered data and STFTs are shared, via the analysis cache, with any other shared
+        signal over the same samples.
+        '''
         self.__raw = data
+        self.__config = config
         self.__mode = mode
         self.__view = view_mode
         self.__idx = idx
         self.__measurement_name = measurement_name
         self.__fs = fs
         self.__shape = data[:, 2].shape
-        self.__x = Signal(measurement_name, 'x', preferences, data[:, 2], fs, resolution_shift, idx=idx,
-                          mode=mode, pre_calc=pre_calc, view_mode=view_mode)
-        self.__y = Signal(measurement_name, 'y', preferences, data[:, 3], fs, resolution_shift, idx=idx,
-                          mode=mode, pre_calc=pre_calc, view_mode=view_mode)
-        self.__z = Signal(measurement_name, 'z', preferences, data[:, 4], fs, resolution_shift, idx=idx,
-                          mode=mode, pre_calc=pre_calc, view_mode=view_mode)
-        self.__sum = SummedSignal(measurement_name, 'sum', preferences, fs, self.__x, self.__y, self.__z, idx=idx,
+        source = (measurement_name, float(data[0, 0]), data.shape[0], fingerprint(data[:, 2:5])) if shared else None
+        self.__x = Signal(measurement_name, 'x', config, data[:, 2], fs, resolution_shift, idx=idx,
+                          mode=mode, pre_calc=pre_calc, view_mode=view_mode, source=source)
+        self.__y = Signal(measurement_name, 'y', config, data[:, 3], fs, resolution_shift, idx=idx,
+                          mode=mode, pre_calc=pre_calc, view_mode=view_mode, source=source)
+        self.__z = Signal(measurement_name, 'z', config, data[:, 4], fs, resolution_shift, idx=idx,
+                          mode=mode, pre_calc=pre_calc, view_mode=view_mode, source=source)
+        self.__sum = SummedSignal(measurement_name, 'sum', config, fs, self.__x, self.__y, self.__z, idx=idx,
                                   pre_calc=pre_calc, view_mode=view_mode)
 
     @staticmethod
-    def decode(prefs, shift, str_format, mode, view):
+    def decode(config, shift, str_format, mode, view):
         '''
         Decodes a signal encoded via encode
-        :param prefs: the preferences.
+        :param config: the analysis config.
         :param shift: the resolution shift.
         :param str_format: the raw data in str form.
         :param mode: the active mode
@@ -56,7 +124,7 @@ class TriAxisSignal:
             measurement_name, idx, dtype, fs, dat = str_format.split('#', maxsplit=5)
             import io
             raw = np.loadtxt(io.StringIO(dat), dtype=dtype, ndmin=2)
-            return TriAxisSignal(prefs, measurement_name, raw, int(fs), shift,
+            return TriAxisSignal(config, measurement_name, raw, int(fs), shift,
                                  idx=int(idx), mode=mode, view_mode=view, pre_calc=True)
         except:
             logger.exception(f"Unable to decode to signal")
@@ -69,6 +137,10 @@ class TriAxisSignal:
         '''
         return f"{self.measurement_name}#{self.__idx}#{self.__raw.dtype}#{self.__fs}#{np_to_str(self.__raw)}"
 
+    @property
+    def config(self):
+        return self.__config
+
     @property
     def shape(self):
         return self.__shape
@@ -127,6 +199,12 @@ class TriAxisSignal:
         self.z.recalc()
         self.sum.recalc()
 
+    def analyse_data(self):
+        ''' Filters the data of each axis according to the mode now rather than on first use. '''
+        self.x.data
+        self.y.data
+        self.z.data
+
 
 class SpectroValues:
 
@@ -156,10 +234,10 @@ class Analysis:
 
 
 class AnalysableSignal:
-    def __init__(self, measurement_name, axis, preferences, fs, idx=-1, view_mode='avg'):
+    def __init__(self, measurement_name, axis, config, fs, idx=-1, view_mode='avg'):
         self.__measurement_name = measurement_name
         self.__axis = axis
-        self.__preferences = preferences
+        self.__config = config
         self.__fs = fs
         self.__view_mode = view_mode
         self.__idx = idx
@@ -190,8 +268,8 @@ class AnalysableSignal:
         return self.__view_mode
 
     @property
-    def prefs(self):
-        return self.__preferences
+    def config(self):
+        return self.__config
 
     def has_data(self, view):
         return view in self.__output
@@ -218,26 +296,29 @@ class AnalysableSignal:
         val = self.__output.get(view_name, None)
         return val
 
-    def set_analysis(self, analysis):
+    def set_analysis(self, analysis, view_name=None):
         '''
-        Updates the current view.
+        Updates the analysis for a view.
         :param analysis: the analysis.
+        :param view_name: the named analysis view, defaults to the current view.
+        '''
+        self.__output[self.__view_mode if view_name is None else view_name] = analysis
+
+    def peek_analysis(self, view_name):
+        '''
+        :param view_name: the named analysis view.
+        :return: the analysis if it has already been calculated.
         '''
-        self.__output[self.__view_mode] = analysis
+        return self.__output.get(view_name, None)
 
 
 class SummedSignal(AnalysableSignal):
 
-    def __init__(self, measurement_name, axis, preferences, fs, x, y, z, idx=-1, pre_calc=False, view_mode='avg'):
-        super().__init__(measurement_name, axis, preferences, fs, idx=idx, view_mode=view_mode)
+    def __init__(self, measurement_name, axis, config, fs, x, y, z, idx=-1, pre_calc=False, view_mode='avg'):
+        super().__init__(measurement_name, axis, config, fs, idx=idx, view_mode=view_mode)
         self.__x = x
         self.__y = y
         self.__z = z
-        self.__scales = [
-            self.prefs.get(SUM_X_SCALE),
-            self.prefs.get(SUM_Y_SCALE),
-            self.prefs.get(SUM_Z_SCALE)
-        ]
         if pre_calc is True:
             self.recalc()
 
@@ -246,52 +327,73 @@ class SummedSignal(AnalysableSignal):
             x = self.__x.get_analysis(self.view_mode)
             y = self.__y.get_analysis(self.view_mode)
             z = self.__z.get_analysis(self.view_mode)
-            x_s, y_s, z_s = self.__scales
+            x_s, y_s, z_s = self.config.sum_scales
             if x is not None and y is not None and z is not None:
-                Psum = (scale_sq(x, x_s) + scale_sq(y, y_s) + scale_sq(z, z_s)) ** 0.5
-                if self.view_mode == 'avg':
-                    Psum = np.sqrt(Psum)
-                Psum_db = amplitude_to_db(Psum, ref=ADJUST_BY_3DB * REF_ACCELERATION_IN_G)
+                Psum = scale_sq(x, x_s)
+                # the scratch buffer ends up holding the dB values
+                Psum_db = np.empty_like(Psum)
+                Psum += scale_sq(y, y_s, out=Psum_db)
+                Psum += scale_sq(z, z_s, out=Psum_db)
+                np.sqrt(Psum, out=Psum)
+                if self.view_mode != 'peak':
+                    np.sqrt(Psum, out=Psum)
+                amplitude_to_db_into(Psum, Psum_db, ref=ADJUST_BY_3DB * get_db_reference(self.view_mode))
                 self.set_analysis(Analysis((x.x, Psum, Psum_db)))
 
     def __can_sum(self):
-        return self.view_mode == 'avg' or self.view_mode == 'peak'
+        return self.view_mode in ['avg', 'peak', 'bands', 'zoom'] or self.view_mode in INTEGRATED_VIEWS
 
 
-def scale_sq(data, scale):
-    return (data.y_raw * scale) ** 2
+def scale_sq(data, scale, out=None):
+    out = np.multiply(data.y_raw, scale, out=out)
+    return np.square(out, out=out)
 
 
 class Signal(AnalysableSignal):
 
-    def __init__(self, measurement_name, axis, preferences, data, fs, resolution_shift,
-                 idx=-1, mode='vibration', pre_calc=False, view_mode='avg'):
+    def __init__(self, measurement_name, axis, config, data, fs, resolution_shift,
+                 idx=-1, mode='vibration', pre_calc=False, view_mode='avg', source=None):
         '''
         Creates a new signal.
         :param measurement_name: the measurement_name.
         :param axis: the axis.
-        :param preferences: common prefs.
+        :param config: the analysis config.
         :param data: the sample date.
         :param fs: the sample rate.
         :param resolution_shift: the analysis frequency resolution.
         :param mode: optional analysis mode, can be none (raw data), vibration or tilt.
         :param pre_calc: if True, calculate the required views.
+        :param source: identifies the samples this signal was taken from, if set the filtered data and STFTs are
+        obtained via the analysis cache.
         '''
-        super().__init__(measurement_name, axis, preferences, fs, idx=idx, view_mode=view_mode)
-        self.__raw_data = data
+        super().__init__(measurement_name, axis, config, fs, idx=idx, view_mode=view_mode)
+        self.__raw_data = data.astype(config.dtype, copy=False)
+        self.__source = source
+        self.__mode = mode
         self.__data = None
-        self.__analyse_data(mode)
+        self.__stfts = {}
         self.__resolution_shift = resolution_shift
         if pre_calc is True:
             self.recalc()
 
-    def __analyse_data(self, mode):
-        if mode.lower() == 'vibration':
-            self.__data = butter(self.fs, self.raw, 'high')
-        elif mode.lower() == 'tilt':
-            self.__data = butter(self.fs, self.raw, 'low')
+    def __analyse_data(self):
+        '''
+        Filters the raw data according to the mode, this is deferred until the data is first required so that a signal
+        whose analysis is supplied (e.g. from another process) never does the work.
+        '''
+        if self.__source is None:
+            self.__data = self.__filter()
+        else:
+            key = ('data', self.__source, self.axis, self.__mode, self.fs, self.config.dtype.str)
+            self.__data = get_analysis_cache().get(key, self.__filter)
+
+    def __filter(self):
+        if self.__mode.lower() == 'vibration':
+            return butter(self.fs, self.raw, 'high')
+        elif self.__mode.lower() == 'tilt':
+            return butter(self.fs, self.raw, 'low')
         else:
-            self.__data = self.raw
+            return self.raw
 
     def set_mode(self, mode, recalc=True):
         '''
@@ -299,7 +401,9 @@ class Signal(AnalysableSignal):
         :param mode: the mode.
         :param recalc: if true, trigger a recalc.
         '''
-        self.__analyse_data(mode)
+        self.__mode = mode
+        self.__data = None
+        self.__stfts = {}
         if recalc is True:
             self.recalc()
 
@@ -309,6 +413,8 @@ class Signal(AnalysableSignal):
 
     @property
     def data(self):
+        if self.__data is None:
+            self.__analyse_data()
         return self.__data
 
     def recalc(self):
@@ -319,25 +425,93 @@ class Signal(AnalysableSignal):
 
     def __calculate(self):
         if self.view_mode == 'avg':
-            from model.preferences import ANALYSIS_AVG_WINDOW
-            avg_wnd = get_window(self.prefs, ANALYSIS_AVG_WINDOW)
-            return Analysis(self.__avg_spectrum(resolution_shift=self.__resolution_shift, window=avg_wnd))
+            return Analysis(self.__avg_spectrum(self.__get_stft(self.config.avg_window, DEFAULT_AVG_WINDOW)))
         elif self.view_mode == 'peak':
-            from model.preferences import ANALYSIS_PEAK_WINDOW
-            peak_wnd = get_window(self.prefs, ANALYSIS_PEAK_WINDOW)
-            return Analysis(self.__peak_spectrum(resolution_shift=self.__resolution_shift, window=peak_wnd))
+            return Analysis(self.__peak_spectrum(self.__get_stft(self.config.peak_window, DEFAULT_PEAK_WINDOW)))
         elif self.view_mode == 'psd':
-            from model.preferences import ANALYSIS_AVG_WINDOW
-            avg_wnd = get_window(self.prefs, ANALYSIS_AVG_WINDOW)
-            return Analysis(self.__psd(resolution_shift=self.__resolution_shift, window=avg_wnd))
+            return Analysis(self.__psd(self.__get_stft(self.config.avg_window, DEFAULT_AVG_WINDOW)))
+        elif self.view_mode == 'bands':
+            return Analysis(self.__bands(self.__get_stft(self.config.avg_window, DEFAULT_AVG_WINDOW),
+                                         self.config.band_fraction))
+        elif self.view_mode == 'zoom':
+            return Analysis(self.__zoom(self.data, self.fs, self.config))
+        elif self.view_mode in INTEGRATED_VIEWS:
+            return Analysis(self.__integrated_spectrum(self.view_mode))
         elif self.view_mode == 'spectrogram':
-            return SpectroValues(*self.__spectrogram(resolution_shift=self.__resolution_shift))
+            return SpectroValues(*self.__spectrogram(self.__get_stft(None, DEFAULT_PEAK_WINDOW)))
+        elif self.view_mode == 'transfer':
+            # the transfer function is calculated across signals so just prepare the segment FFTs
+            self.avg_stft
+            return None
+
+    @property
+    def avg_stft(self):
+        '''
+        :return: the STFT used by the avg view, including the segment FFTs for cross spectral analysis.
+        '''
+        return self.__get_stft(self.config.avg_window, DEFAULT_AVG_WINDOW, segment_ffts=True)
+
+    def __get_stft(self, window, default_window, segment_ffts=False):
+        """
+        Provides the STFT for the given window, computing it on first use only so that every view which uses the same
+        window shares a single STFT.
+        :param window: the window.
+        :param default_window: the window to use if no window is specified.
+        :param segment_ffts: whether the STFT must retain the complex segment FFTs, only the transfer view needs them.
+        :return: the STFT.
+        """
+        window = window if window else default_window
+        stft = self.__stfts.get(window, None)
+        if stft is None or (segment_ffts is True and stft.segment_ffts is None):
+            nperseg = get_segment_length(self.fs, resolution_shift=self.__resolution_shift)
+
+            def compute():
+                return STFT(self.data, self.fs, nperseg, window, self.config.detrend, self.config.fft,
+                            keep_segment_ffts=segment_ffts)
+
+            if self.__source is None:
+                stft = compute()
+            else:
+                key = ('stft', self.__source, self.axis, self.__mode, self.fs, self.config.dtype.str, nperseg, window,
+                       self.config.detrend)
+                cache = get_analysis_cache()
+                # an STFT which retains the segment FFTs serves every view
+                if segment_ffts is True or key + (True,) in cache:
+                    stft = cache.get(key + (True,), compute)
+                else:
+                    stft = cache.get(key + (False,), compute)
+            self.__stfts[window] = stft
+        return stft
+
+    def __integrated_spectrum(self, view):
+        '''
+        Integrates the avg spectrum in the frequency domain, reusing the avg spectrum if it has already been calculated.
+        :param view: velocity or displacement.
+        :return:
+            f : ndarray
+            Array of sample frequencies.
+            Pxx : ndarray
+            linear spectrum.
+            Pxx_db : ndarray
+            linear spectrum in dB
+        '''
+        stft = self.__get_stft(self.config.avg_window, DEFAULT_AVG_WINDOW)
+        avg = self.peek_analysis('avg')
+        if avg is None:
+            avg = Analysis(self.__avg_spectrum(stft))
+            self.set_analysis(avg, view_name='avg')
+        weights = get_integration_weights(stft.fs, stft.nperseg, view, self.config.integration_floor,
+                                          avg.y_raw.dtype.str)
+        Pxx = avg.y_raw * weights
+        Pxx_db = power_to_db_into(Pxx, np.empty_like(Pxx), ref=(ADJUST_BY_3DB * get_db_reference(view)) ** 2)
+        return avg.x, Pxx, Pxx_db
 
-    def __psd(self, ref=REF_ACCELERATION_IN_G, resolution_shift=0, window=None, **kwargs):
+    @staticmethod
+    def __psd(stft, ref=REF_ACCELERATION_IN_G):
         """
         analyses the source to generate the PSD.
+        :param stft: the stft.
         :param ref: the reference value for dB purposes.
-        :param resolution_shift: allows resolution to go down (if positive) or up (if negative).
         :return:
             f : ndarray
             Array of sample frequencies.
@@ -346,18 +520,18 @@ class Signal(AnalysableSignal):
             Pxx_den_db : ndarray
             psd in dB
         """
-        nperseg = get_segment_length(self.fs, resolution_shift=resolution_shift)
-        detrend = False if self.prefs.get(ANALYSIS_DETREND) == 'none' else self.prefs.get(ANALYSIS_DETREND)
-        f, Pxx_den = signal.welch(self.__data, self.fs, nperseg=nperseg, detrend=detrend,
-                                  window=window if window else 'hann', **kwargs)
-        Pxx_den_db = power_to_db(np.nan_to_num(np.sqrt(Pxx_den)), ref)
-        return f, Pxx_den, Pxx_den_db
-
-    def __avg_spectrum(self, ref=REF_ACCELERATION_IN_G, resolution_shift=0, window=None, **kwargs):
+        Pxx_den = stft.spectrum.mean(axis=0)
+        Pxx_den *= stft.density_scale
+        Pxx_den_db = np.sqrt(Pxx_den)
+        power_to_db_into(Pxx_den_db, Pxx_den_db, ref)
+        return stft.f, Pxx_den, Pxx_den_db
+
+    @staticmethod
+    def __avg_spectrum(stft, ref=REF_ACCELERATION_IN_G):
         """
         analyses the source to generate the linear spectrum.
+        :param stft: the stft.
         :param ref: the reference value for dB purposes.
-        :param resolution_shift: allows resolution to go down (if positive) or up (if negative).
         :return:
             f : ndarray
             Array of sample frequencies.
@@ -366,19 +540,18 @@ class Signal(AnalysableSignal):
             Pxx_db : ndarray
             linear spectrum in dB
         """
-        nperseg = get_segment_length(self.fs, resolution_shift=resolution_shift)
-        detrend = False if self.prefs.get(ANALYSIS_DETREND) == 'none' else self.prefs.get(ANALYSIS_DETREND)
-        f, Pxx_spec = signal.welch(self.__data, self.fs, nperseg=nperseg, scaling='spectrum', detrend=detrend,
-                                   window=window if window else 'hann', **kwargs)
+        Pxx_spec = stft.spectrum.mean(axis=0)
         # a 3dB adjustment is required to account for the change in nperseg
-        Pxx_spec_db = amplitude_to_db(np.nan_to_num(np.sqrt(Pxx_spec)), ADJUST_BY_3DB * ref)
-        return f, Pxx_spec, Pxx_spec_db
+        # the amplitude is sqrt(Pxx) so the power is Pxx itself
+        Pxx_spec_db = power_to_db_into(Pxx_spec, np.empty_like(Pxx_spec), ref=(ADJUST_BY_3DB * ref) ** 2)
+        return stft.f, Pxx_spec, Pxx_spec_db
 
-    def __peak_spectrum(self, ref=REF_ACCELERATION_IN_G, resolution_shift=0, window=None):
+    @staticmethod
+    def __peak_spectrum(stft, ref=REF_ACCELERATION_IN_G):
         """
         analyses the source to generate the max values per bin per segment
-        :param resolution_shift: allows resolution to go down (if positive) or up (if negative).
-        :param window: window type.
+        :param stft: the stft.
+        :param ref: the reference value for dB purposes.
         :return:
             f : ndarray
             Array of sample frequencies.
@@ -387,24 +560,62 @@ class Signal(AnalysableSignal):
             Pxx_db : ndarray
             linear spectrum max values in dB.
         """
-        nperseg = get_segment_length(self.fs, resolution_shift=resolution_shift)
-        detrend = False if self.prefs.get(ANALYSIS_DETREND) == 'none' else self.prefs.get(ANALYSIS_DETREND)
-        freqs, _, Pxy = signal.spectrogram(self.__data,
-                                           self.fs,
-                                           window=window if window else ('tukey', 0.25),
-                                           nperseg=int(nperseg),
-                                           noverlap=int(nperseg // 2),
-                                           detrend=detrend,
-                                           scaling='spectrum')
-        Pxy_max = np.sqrt(Pxy.max(axis=-1).real)
+        Pxy_max = stft.spectrum.max(axis=0)
+        # a 3dB adjustment is required to account for the change in nperseg
+        # the power is max(Pxx) so convert that before taking the root for the linear values
+        Pxy_max_db = power_to_db_into(Pxy_max, np.empty_like(Pxy_max), ref=(ADJUST_BY_3DB * ref) ** 2)
+        np.sqrt(Pxy_max, out=Pxy_max)
+        return stft.f, Pxy_max, Pxy_max_db
+
+    @staticmethod
+    def __bands(stft, fraction, ref=REF_ACCELERATION_IN_G):
+        """
+        analyses the source to generate the linear spectrum summed into fractional octave bands.
+        :param stft: the stft.
+        :param fraction: the bands per octave.
+        :param ref: the reference value for dB purposes.
+        :return:
+            f : ndarray
+            Array of band centre frequencies.
+            Pxx : ndarray
+            band power.
+            Pxx_db : ndarray
+            band power in dB
+        """
+        centres, mapping = get_octave_bands(stft.fs, stft.nperseg, fraction)
+        Pxx_bands = mapping.dot(stft.spectrum.mean(axis=0)).astype(stft.spectrum.dtype, copy=False)
+        # a 3dB adjustment is required to account for the change in nperseg
+        Pxx_bands_db = power_to_db_into(Pxx_bands, np.empty_like(Pxx_bands), ref=(ADJUST_BY_3DB * ref) ** 2)
+        return centres, Pxx_bands, Pxx_bands_db
+
+    @staticmethod
+    def __zoom(data, fs, config, ref=REF_ACCELERATION_IN_G):
+        """
+        analyses the source to generate a high resolution linear spectrum over the zoom band.
+        :param data: the data.
+        :param fs: the sample rate.
+        :param config: the analysis config.
+        :param ref: the reference value for dB purposes.
+        :return:
+            f : ndarray
+            Array of sample frequencies.
+            Pxx : ndarray
+            linear spectrum.
+            Pxx_db : ndarray
+            linear spectrum in dB
+        """
+        f, Pxx_zoom = zoom_spectrum(data, fs, *config.zoom_band, config.avg_window or DEFAULT_AVG_WINDOW,
+                                    config.detrend, config.fft)
         # a 3dB adjustment is required to account for the change in nperseg
-        Pxy_max_db = amplitude_to_db(Pxy_max, ref=ADJUST_BY_3DB * ref)
-        return freqs, Pxy_max, Pxy_max_db
+        Pxx_zoom_db = power_to_db_into(Pxx_zoom, np.empty_like(Pxx_zoom), ref=(ADJUST_BY_3DB * ref) ** 2)
+        return f, Pxx_zoom, Pxx_zoom_db
 
-    def __spectrogram(self, ref=REF_ACCELERATION_IN_G, resolution_shift=0, window=None):
+    @staticmethod
+    def __spectrogram(stft, ref=REF_ACCELERATION_IN_G):
         """
         analyses the source to generate a spectrogram
-        :param resolution_shift: allows resolution to go down (if positive) or up (if negative).
+        :param stft: the stft.
+        :param ref: the reference value for dB purposes.
         :return:
             f : ndarray
             Array of time slices.
@@ -413,34 +624,284 @@ class Signal(AnalysableSignal):
             Pxx : ndarray
             linear spectrum values.
         """
-        nperseg = get_segment_length(self.fs, resolution_shift=resolution_shift)
-        detrend = False if self.prefs.get(ANALYSIS_DETREND) == 'none' else self.prefs.get(ANALYSIS_DETREND)
-        f, t, Sxx = signal.spectrogram(self.__data,
-                                       self.fs,
-                                       window=window if window else ('tukey', 0.25),
-                                       nperseg=nperseg,
-                                       noverlap=int(nperseg // 2),
-                                       detrend=detrend,
-                                       scaling='spectrum')
-        Sxx = amplitude_to_db(np.sqrt(Sxx), ref=ref * ADJUST_BY_3DB)
-        return f, t, Sxx
+        # amplitude_to_db(sqrt(Pxx)) is power_to_db(Pxx) with the reference squared
+        Sxx = power_to_db_into(stft.spectrum.T, np.empty_like(stft.spectrum.T), ref=(ref * ADJUST_BY_3DB) ** 2)
+        return stft.f, stft.t, Sxx
+
+
+class STFT:
+    """
+    The short time fourier transform of a signal, i.e. the one sided power spectrum of each detrended and windowed
+    segment (using a 50% overlap), scaled as per scipy's 'spectrum' scaling. The avg, psd, peak and spectrogram views
+    are all simple reductions of this data so it is computed once and then shared between those views. The complex
+    segment FFTs can be retained, with the same scaling, for cross spectral analysis.
+    """
+
+    def __init__(self, data, fs, nperseg, window, detrend, fft, keep_segment_ffts=False):
+        """
+        Computes the STFT.
+        :param data: the time domain data.
+        :param fs: the sample rate.
+        :param nperseg: the segment length.
+        :param window: the window, in any format understood by scipy.signal.get_window.
+        :param detrend: the detrend type (constant or linear), False for no detrend.
+        :param fft: the FFT backend.
+        :param keep_segment_ffts: whether to retain the complex segment FFTs, which otherwise are discarded once the
+        spectrum is calculated as they need twice as much memory as the spectrum.
+        """
+        geometry = get_stft_geometry(fs, nperseg, data.shape[-1])
+        nperseg = geometry.nperseg
+        step = geometry.step
+        win = signal.get_window(window, nperseg).astype(data.dtype, copy=False)
+        segment_count = geometry.t.size
+        segments = np.lib.stride_tricks.as_strided(data, shape=(segment_count, nperseg),
+                                                   strides=(step * data.strides[-1], data.strides[-1]),
+                                                   writeable=False)
+        if detrend is False:
+            segments = segments * win
+        elif detrend == 'constant':
+            segments = (segments - segments.mean(axis=-1, keepdims=True)) * win
+        else:
+            segments = signal.detrend(segments, type=detrend, axis=-1) * win
+        segment_ffts = fft.rfft(segments, axis=-1)
+        win_sum = win.sum()
+        segment_ffts *= 1.0 / win_sum
+        # one sided so double the power of every bin other than DC and nyquist
+        if nperseg % 2:
+            segment_ffts[:, 1:] *= np.sqrt(2)
+        else:
+            segment_ffts[:, 1:-1] *= np.sqrt(2)
+        self.__segment_ffts = segment_ffts if keep_segment_ffts is True else None
+        self.__spectrum = np.square(segment_ffts.real) + np.square(segment_ffts.imag)
+        self.__fs = fs
+        self.__nperseg = nperseg
+        self.__density_scale = (win_sum * win_sum) / (fs * np.square(win).sum())
+        self.__f = geometry.f
+        self.__t = geometry.t
+
+    @property
+    def fs(self):
+        return self.__fs
+
+    @property
+    def nperseg(self):
+        return self.__nperseg
+
+    @property
+    def f(self):
+        return self.__f
+
+    @property
+    def t(self):
+        return self.__t
+
+    @property
+    def spectrum(self):
+        '''
+        :return: the power spectrum of each segment with shape (segments, frequencies).
+        '''
+        return self.__spectrum
+
+    @property
+    def segment_ffts(self):
+        '''
+        :return: the complex FFT of each segment with shape (segments, frequencies), scaled so that the squared
+        magnitude is the spectrum, or None if they were not retained.
+        '''
+        return self.__segment_ffts
+
+    @property
+    def nbytes(self):
+        ffts = 0 if self.__segment_ffts is None else self.__segment_ffts.nbytes
+        return self.__spectrum.nbytes + ffts + self.__f.nbytes + self.__t.nbytes
+
+    @property
+    def density_scale(self):
+        '''
+        :return: the factor which converts the spectrum scaling to density scaling.
+        '''
+        return self.__density_scale
+
+
+StftGeometry = namedtuple('StftGeometry', ['nperseg', 'step', 'f', 't'])
+
+
+@lru_cache(maxsize=32)
+def get_stft_geometry(fs, nperseg, samples):
+    '''
+    The shape of the STFT of a signal depends only on its length so it can be calculated without analysing any data.
+    The arrays are shared so they are read only.
+    :param fs: the sample rate.
+    :param nperseg: the segment length, this is capped at the length of the signal.
+    :param samples: the length of the signal.
+    :return: the segment length, the step between segments, the frequency of each bin and the time of each segment.
+    '''
+    nperseg = min(nperseg, samples)
+    noverlap = nperseg // 2
+    step = nperseg - noverlap
+    segment_count = (samples - noverlap) // step
+    f = np.fft.rfftfreq(nperseg, 1 / fs)
+    t = np.arange(nperseg / 2, samples - nperseg / 2 + 1, step)[0:segment_count] / float(fs)
+    f.setflags(write=False)
+    t.setflags(write=False)
+    return StftGeometry(nperseg, step, f, t)
+
+
+def zoom_spectrum(data, fs, f_min, f_max, window, detrend, fft):
+    '''
+    Computes the power spectrum over a band by shifting the centre of the band to 0Hz, low pass filtering and decimating
+    so that the FFT only has to cover the band. The resolution is fs / len(data), i.e. the same as a full length FFT,
+    but the FFT length, and hence the cost beyond the initial mix and filter, scales with the width of the band.
+    :param data: the time domain data.
+    :param fs: the sample rate.
+    :param f_min: the lower edge of the band.
+    :param f_max: the upper edge of the band.
+    :param window: the window, in any format understood by scipy.signal.get_window.
+    :param detrend: the detrend type (constant or linear), False for no detrend.
+    :param fft: the FFT backend.
+    :return: the frequencies, the one sided power spectrum in the band scaled as per scipy's 'spectrum' scaling.
+    '''
+    f_max = min(f_max, fs / 2)
+    f_min = max(0.0, min(f_min, f_max - fs / data.shape[-1]))
+    centre = (f_min + f_max) / 2
+    factor = max(1, int(fs / (1.5 * (f_max - f_min))))
+    if detrend is not False:
+        data = signal.detrend(data, type=detrend)
+    baseband = data * get_mixer(data.shape[-1], fs, centre, dtype=np.result_type(data.dtype, np.complex64))
+    if factor > 1:
+        baseband = signal.resample_poly(baseband, 1, factor)
+    win = signal.get_window(window, baseband.shape[-1]).astype(data.dtype, copy=False)
+    spectrum = np.fft.fftshift(fft.fft(baseband * win))
+    power = np.square(spectrum.real)
+    power += np.square(spectrum.imag)
+    # each side of the real signal holds half the power
+    power *= 2.0 / np.square(win.sum())
+    f = centre + np.fft.fftshift(np.fft.fftfreq(baseband.shape[-1], factor / fs))
+    in_band = (f >= f_min) & (f <= f_max)
+    return f[in_band], power[in_band].astype(data.dtype, copy=False)
+
+
+@lru_cache(maxsize=8)
+def get_mixer(n, fs, frequency, dtype=np.complex128):
+    '''
+    :param n: the number of samples.
+    :param fs: the sample rate.
+    :param frequency: the frequency to shift to 0Hz.
+    :param dtype: the complex dtype of the mixer, the phase is always calculated in double precision.
+    :return: the complex exponential which shifts the frequency to 0Hz.
+    '''
+    return np.exp(-2j * np.pi * frequency * np.arange(n) / fs).astype(dtype, copy=False)
 
 
 def butter(fs, data, btype, f3=2, order=2):
     """
     Applies a digital butterworth filter via filtfilt at the specified f3 and order. Default values are set to
     correspond to apparently sensible filters that distinguish between vibration and tilt from an accelerometer.
+    Single precision data is filtered in second order sections, in the same precision, as the transfer function
+    form is not numerically stable at such low cutoffs in single precision.
     :param data: the data to filter.
     :param btype: high or low.
     :param f3: the f3 of the filter.
     :param order: the filter order.
     :return: the filtered signal.
     """
+    if data.dtype == np.float32:
+        sos = signal.butter(order, f3 / (0.5 * fs), btype=btype, output='sos').astype(np.float32)
+        return signal.sosfiltfilt(sos, data)
     b, a = signal.butter(order, f3 / (0.5 * fs), btype=btype)
     y = signal.filtfilt(b, a, data)
     return y
 
 
+def precision_report(config, fs, data=None, resolution_shift=0, seconds=4):
+    """
+    Compares the analysis in the configured precision against the float64 analysis of the same data.
+    :param config: the analysis config.
+    :param fs: the sample rate.
+    :param data: the tri axis data to analyse, if not supplied then a set of tones in noise is generated.
+    :param resolution_shift: the resolution shift.
+    :param seconds: the length of the generated signal.
+    :return: the max absolute difference, in dB, per view.
+    """
+    if data is None:
+        rng = np.random.default_rng(0)
+        t = np.arange(fs * seconds) / fs
+        data = np.zeros((t.size, 5))
+        data[:, 0] = np.arange(t.size)
+        for i, axis in enumerate([2, 3, 4]):
+            data[:, axis] = 0.01 * np.sin(2 * np.pi * (5 + 10 * i) * t) \
+                + 0.001 * np.sin(2 * np.pi * (40 + 20 * i) * t) \
+                + rng.normal(scale=0.0001, size=t.size)
+    reference_config = config._replace(dtype=np.dtype(np.float64))
+    report = {}
+    for view in ['avg', 'peak', 'psd', 'bands', 'zoom', 'velocity', 'displacement', 'spectrogram']:
+        actual = TriAxisSignal(config, 'actual', data, fs, resolution_shift, view_mode=view, pre_calc=True)
+        expected = TriAxisSignal(reference_config, 'expected', data, fs, resolution_shift, view_mode=view,
+                                 pre_calc=True)
+        errors = []
+        for axis in ['x', 'y', 'z', 'sum']:
+            a = getattr(actual, axis).get_analysis(view)
+            e = getattr(expected, axis).get_analysis(view)
+            if a is not None and e is not None:
+                a_db, e_db = (a.sxx, e.sxx) if view == 'spectrogram' else (a.y, e.y)
+                errors.append(np.max(np.abs(a_db.astype(np.float64) - e_db)))
+        report[view] = max(errors)
+    return report
+
+
+@lru_cache(maxsize=32)
+def get_octave_bands(fs, nperseg, fraction):
+    '''
+    Maps the bins of a one sided spectrum onto base 2 fractional octave bands centred on 1kHz, each bin (excluding DC)
+    is allocated to the band whose edges contain it and bands which contain no bins are dropped. The mapping is cached
+    as it depends only on the parameters so banding a spectrum is then a single sparse matrix multiplication.
+    :param fs: the sample rate.
+    :param nperseg: the segment length.
+    :param fraction: the bands per octave, e.g. 3 for 1/3 octave bands.
+    :return: the band centre frequencies, a sparse (bands x bins) matrix which sums bins into bands.
+    '''
+    f = np.fft.rfftfreq(nperseg, 1 / fs)
+    band_idx = np.round(fraction * np.log2(f[1:] / 1000.0)).astype(int)
+    bands, rows = np.unique(band_idx, return_inverse=True)
+    mapping = sparse.csr_matrix((np.ones(rows.size), (rows, np.arange(1, f.size))), shape=(bands.size, f.size))
+    return 1000.0 * np.power(2.0, bands / fraction), mapping
+
+
+@lru_cache(maxsize=32)
+def get_integration_weights(fs, nperseg, view, floor, dtype):
+    '''
+    Integration in the frequency domain divides each bin by j2πf, once for velocity and twice for displacement, so the
+    power spectrum of an integrated view is the acceleration power spectrum multiplied by a fixed weight per bin. Bins
+    below the floor are zeroed as the gain tends to infinity at DC.
+    :param fs: the sample rate.
+    :param nperseg: the segment length.
+    :param view: velocity or displacement.
+    :param floor: the high pass floor in Hz.
+    :param dtype: the dtype of the spectrum.
+    :return: the weights.
+    '''
+    integrations, scale = INTEGRATED_VIEWS[view]
+    f = np.fft.rfftfreq(nperseg, 1 / fs)
+    weights = np.zeros(f.size)
+    valid = (f > 0) & (f >= floor)
+    weights[valid] = np.square(scale / np.power(2 * np.pi * f[valid], integrations))
+    weights = weights.astype(dtype)
+    weights.setflags(write=False)
+    return weights
+
+
+def get_db_reference(view):
+    '''
+    :param view: the view.
+    :return: the 0dB reference for the units of the view.
+    '''
+    if view == 'velocity':
+        return REF_VELOCITY_IN_MM_S
+    if view == 'displacement':
+        return REF_DISPLACEMENT_IN_UM
+    return REF_ACCELERATION_IN_G
+
+
 def get_window(preferences, key):
     '''
     Gets the preferred window for the given type with a default fallback if no preference is set.
@@ -467,7 +928,8 @@ def amplitude_to_db(s, ref=1.0, amin=1e-10):
     :param amin: min value.
     :return: s_db : np.ndarray ``s`` measured in dB
     '''
-    return power_to_db(np.square(np.abs(np.asarray(s))), ref=ref**2, amin=amin**2)
+    s = np.asarray(s)
+    return amplitude_to_db_into(s, np.empty(s.shape, dtype=_db_dtype(s)), ref=ref, amin=amin)
 
 
 def power_to_db(s, ref=1.0, amin=1e-20):
@@ -479,13 +941,48 @@ def power_to_db(s, ref=1.0, amin=1e-20):
     :param amin: min value.
     :return: s_db : np.ndarray ``s`` measured in dB
     '''
-    magnitude = np.abs(np.asarray(s))
-    ref_value = np.abs(ref)
-    top_db = 80.0
-    log_spec = 10.0 * np.log10(np.maximum(amin, magnitude))
-    log_spec -= 10.0 * np.log10(np.maximum(amin, ref_value))
-    log_spec = np.maximum(log_spec, log_spec.max() - top_db)
-    return np.nan_to_num(log_spec)
+    s = np.asarray(s)
+    return power_to_db_into(s, np.empty(s.shape, dtype=_db_dtype(s)), ref=ref, amin=amin)
+
+
+def amplitude_to_db_into(s, out, ref=1.0, amin=1e-10, top_db=80.0):
+    '''
+    As per amplitude_to_db but writes the result into out without allocating any temporaries.
+    :param s: the amplitude spectrogram.
+    :param out: a real array of the same shape as s, may be s itself.
+    :param ref: the reference value.
+    :param amin: min value.
+    :param top_db: the range below the max value to retain, None to retain everything.
+    :return: out.
+    '''
+    np.abs(s, out=out)
+    np.square(out, out=out)
+    return power_to_db_into(out, out, ref=ref ** 2, amin=amin ** 2, top_db=top_db)
+
+
+def power_to_db_into(s, out, ref=1.0, amin=1e-20, top_db=80.0):
+    '''
+    As per power_to_db but writes the result into out without allocating any temporaries. Values which are not a
+    number are treated as amin.
+    :param s: the power spectrogram.
+    :param out: a real array of the same shape as s, may be s itself.
+    :param ref: the reference value.
+    :param amin: min value.
+    :param top_db: the range below the max value to retain, None to retain everything.
+    :return: out.
+    '''
+    np.abs(s, out=out)
+    np.fmax(out, amin, out=out)
+    np.log10(out, out=out)
+    out *= 10.0
+    out -= 10.0 * np.log10(max(amin, abs(ref)))
+    if top_db is not None and out.size > 0:
+        np.maximum(out, out.max() - top_db, out=out)
+    return np.nan_to_num(out, copy=False)
+
+
+def _db_dtype(s):
+    return s.real.dtype if np.issubdtype(s.dtype, np.inexact) else np.dtype(np.float64)
 
 
 def rescale_x(x, y):
@@ -528,6 +1025,43 @@ def get_segment_length(fs, resolution_shift=0):
     return 1 << ((fs - 1).bit_length() - int(resolution_shift))
 
 
+@lru_cache(maxsize=32)
+def get_octave_smoother(size, start, end, fraction):
+    '''
+    Precomputes fractional octave smoothing for a uniformly spaced frequency grid, i.e. for each bin the range of bins
+    within +/- half a band of it.
+    :param size: the number of bins.
+    :param start: the first frequency.
+    :param end: the last frequency.
+    :param fraction: the bands per octave, e.g. 3 for 1/3 octave smoothing.
+    :return: the first bin, the last bin + 1 and the reciprocal of the number of bins for each window.
+    '''
+    x = np.linspace(start, end, size)
+    half_band = 2.0 ** (1.0 / (2 * fraction))
+    lo = np.searchsorted(x, x / half_band, side='left')
+    hi = np.maximum(np.searchsorted(x, x * half_band, side='right'), lo + 1)
+    return lo, hi, 1.0 / (hi - lo)
+
+
+def smooth_octave(x, y, fraction):
+    '''
+    Performs fractional octave smoothing, i.e. replaces each value with the mean of the values within a band centred on
+    it. The operator depends only on the frequency grid so it is cached and applying it is O(bins) via a cumulative sum.
+    :param x: uniformly spaced frequencies.
+    :param y: magnitude.
+    :param fraction: the bands per octave.
+    :return: the smoothed data.
+    '''
+    lo, hi, scale = get_octave_smoother(x.size, float(x[0]), float(x[-1]), fraction)
+    totals = np.empty(y.size + 1)
+    totals[0] = 0.0
+    np.cumsum(y, out=totals[1:])
+    smoothed_y = totals[hi]
+    smoothed_y -= totals[lo]
+    smoothed_y *= scale
+    return x, smoothed_y
+
+
 def smooth_savgol(x, y, wl=SAVGOL_WINDOW_LENGTH, poly=SAVGOL_POLYORDER):
     '''
     Performs Savitzky-Golay smoothing.
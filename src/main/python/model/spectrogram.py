@@ -3,27 +3,42 @@ import logging
 import numpy as np
 import pyqtgraph as pg
 from PIL import Image
+from qtpy.QtGui import QTransform
 
 from common import format_pg_plotitem, colourmap
-from model.charts import VisibleChart, ChartEvent
-from model.preferences import CHART_SPECTRO_SCALE_FACTOR, CHART_SPECTRO_SCALE_ALGO
-from model.signal import Signal, TriAxisSignal
+from model.charts import VisibleChart, ChunkedChartEvent
+from model.pool import AnalysisJob
+from model.preferences import CHART_SPECTRO_SCALE_FACTOR, CHART_SPECTRO_SCALE_ALGO, ANALYSIS_SPECTRO_OVERLOAD
+from model.signal import TriAxisSignal, get_stft_geometry
 
 logger = logging.getLogger('qvibe.vibration')
 
+# the number of time slices held by each image tile
+TILE_ROWS = 16
+# the value of a time slice which has not been written yet, below any displayable level
+EMPTY_DB = -500.0
+# the number of neighbouring slices resampled along with each tile, covers the support of the PIL filters
+RESAMPLE_PAD = 3
 
-class SpectrogramEvent(ChartEvent):
 
-    def __init__(self, chart, measurement_name, input, idx, preferences, budget_millis, visible):
-        super().__init__(chart, measurement_name, input, idx, preferences, budget_millis)
+class SpectrogramEvent(ChunkedChartEvent):
+
+    def __init__(self, chart, measurement_name, input, idx, config, budget_millis, visible):
+        super().__init__(chart, measurement_name, input, idx, config, budget_millis)
         self.__visible = visible
 
     def process(self):
         self.output = [self.__make_sig(i) for i in self.input]
         self.should_emit = True
 
+    def make_job(self):
+        if self.__visible:
+            return AnalysisJob(self.config, self.measurement_name, self.chart.fs, self.chart.resolution_shift,
+                               self.idx, 'vibration', 'spectrogram', self.input)
+        return None
+
     def __make_sig(self, chunk):
-        return TriAxisSignal(self.preferences,
+        return TriAxisSignal(self.config,
                              self.measurement_name,
                              chunk,
                              self.chart.fs,
@@ -31,21 +46,22 @@ class SpectrogramEvent(ChartEvent):
                              idx=self.idx,
                              mode='vibration',
                              view_mode='spectrogram',
-                             pre_calc=self.__visible)
+                             pre_calc=self.__visible,
+                             shared=True)
 
 
 class Spectrogram(VisibleChart):
 
-    def __init__(self, chart, prefs, fs_widget, fps_widget, actual_fps_widget, resolution_widget, buffer_size_widget,
-                 mag_min_widget, mag_max_widget, freq_min_widget, freq_max_widget, visible_axes_widget,
-                 measurement_store):
+    def __init__(self, chart, prefs, fs_widget, fps_widget, actual_fps_widget, queue_status_widget, resolution_widget,
+                 buffer_size_widget, mag_min_widget, mag_max_widget, freq_min_widget, freq_max_widget,
+                 visible_axes_widget, measurement_store):
         self.__sens = None
         self.__buffer_size = None
-        super().__init__(prefs, fs_widget, resolution_widget, fps_widget, actual_fps_widget, True)
+        super().__init__(prefs, fs_widget, resolution_widget, fps_widget, actual_fps_widget, queue_status_widget,
+                         True, overload_policy_key=ANALYSIS_SPECTRO_OVERLOAD)
         self.__rows = 0
         self.__series = {}
         self.__staging = None
-        self.__buffers = {}
         self.__last_idx = {}
         self.__scale_factor = None
         self.__scale_algo = None
@@ -141,9 +157,7 @@ class Spectrogram(VisibleChart):
             ax[0].setXRange(self.__freq_min(), self.__freq_max(), padding=0)
 
     def __init_img(self, measurement, axis, row, column):
-        # initialise a buffer
         meta = self.__get_meta()
-        self.__buffers[f"{measurement}:{axis}"] = np.zeros(meta.sxx.T.shape)
         from qvibe import Inverse
         kargs = {'row': row, 'col': column}
         if row == 0:
@@ -151,18 +165,16 @@ class Spectrogram(VisibleChart):
         # kargs['axisItems'] = {'left': Inverse(orientation='left')}
         p = self.__qview.addPlot(**kargs)
         p.getViewBox().invertY(True)
-        # create the chart
-        image = pg.ImageItem()
-        p.addItem(image)
         if axis != 'x':
             p.showAxis('left', show=False)
+        # create the chart
         pos, rgba_colors = zip(*colourmap())
-        image.setLookupTable(pg.ColorMap(pos, rgba_colors).getLookupTable())
-        image.setLevels([self.__mag_min(), self.__mag_max()])
-        x_scale = 1.0 / (meta.sxx.shape[0]/meta.f[-1])
-        y_scale = (1.0/self.fs) * (self.min_nperseg / 2)
-        logger.debug(f"Scaling spectrogram from {meta.sxx.shape} to x: {x_scale} y:{y_scale}")
-        image.scale(x_scale / self.__scale_factor, y_scale / self.__scale_factor)
+        x_scale = 1.0 / (meta.f.size/meta.f[-1])
+        y_scale = meta.step / self.fs
+        logger.debug(f"Scaling spectrogram from {(meta.f.size, meta.t.size)} to x: {x_scale} y:{y_scale}")
+        image = ScrollingImage(p, meta.t.size, meta.f.size, x_scale, y_scale, self.__scale_factor,
+                               self.__scale_algo, pg.ColorMap(pos, rgba_colors).getLookupTable(),
+                               [self.__mag_min(), self.__mag_max()])
         return p, image
 
     def __on_buffer_size_change(self, size):
@@ -183,13 +195,13 @@ class Spectrogram(VisibleChart):
         for c in self.__series.values():
             self.__qview.removeItem(c[0])
         self.__series = {}
-        self.__buffers = {}
+        self.__last_idx = {}
 
     def __get_meta(self):
-        rnd = np.random.default_rng().random(size=self.fs * self.__buffer_size)
-        s = Signal('test', 'test',  self.preferences, rnd, self.fs, self.resolution_shift, pre_calc=True,
-                   view_mode='spectrogram')
-        return s.get_analysis()
+        '''
+        :return: the geometry of the spectrogram of a full buffer.
+        '''
+        return get_stft_geometry(self.fs, self.min_nperseg, self.fs * self.__buffer_size)
 
     def accept_data(self, data):
         self.__staging = data
@@ -206,19 +218,13 @@ class Spectrogram(VisibleChart):
                 self.create_or_update(self.__staging, measurement_name, 'z')
 
     def create_or_update(self, chunks, measurement_name, axis):
-        c_idx = len(chunks)
-        buf = self.__buffers[f"{measurement_name}:{axis}"]
-        buf = np.roll(buf, c_idx, 0)
-        for idx, c in enumerate(chunks):
+        slices = []
+        for c in chunks:
             dat = getattr(c, axis)
             if dat.has_data('spectrogram') is False:
                 dat.recalc()
-            sxx = dat.get_analysis().sxx
-            buf[c_idx-idx-1] = sxx.T
-        self.__buffers[f"{measurement_name}:{axis}"] = buf
-        buf = np.array(Image.fromarray(buf).resize(size=[i*self.__scale_factor for i in buf.shape[::-1]],
-                                                   resample=self.__scale_algo))
-        self.__series[f"{measurement_name}:{axis}"][1].setImage(buf.T, autoLevels=False)
+            slices.append(dat.get_analysis().sxx.T)
+        self.__series[f"{measurement_name}:{axis}"][1].append(np.concatenate(slices))
 
     def make_event(self, measurement_name, data, idx):
         '''
@@ -242,7 +248,249 @@ class Spectrogram(VisibleChart):
                 chunks = np.vsplit(fresh_data, fresh_data.shape[0] / self.min_nperseg)
             else:
                 chunks = [fresh_data]
-            return SpectrogramEvent(self, measurement_name, chunks, idx, self.preferences, self.budget_millis,
-                                    self.visible)
+            return SpectrogramEvent(self, measurement_name, chunks, idx, self.preferences.analysis_config,
+                                    self.budget_millis, self.visible)
         return None
 
+
+class ImageTiles:
+    '''
+    A circular buffer of spectrogram time slices split into fixed size tiles so that a new slice only changes the tile
+    it is written into. Each tile is stored newest slice first so, with the newest slice at the top of the chart, a
+    tile is displayed as is and scrolling the chart is just a matter of moving each tile down.
+    '''
+
+    def __init__(self, rows, bins, tile_rows=TILE_ROWS):
+        '''
+        :param rows: the number of time slices to display.
+        :param bins: the number of frequency bins in each slice.
+        :param tile_rows: the number of time slices in each tile.
+        '''
+        self.__tile_rows = tile_rows
+        # an extra tile so that a full history is still available while the newest tile is filling up
+        tile_count = -(-rows // tile_rows) + 1
+        self.__tiles = np.full((tile_count, tile_rows, bins), EMPTY_DB, dtype=np.float32)
+        self.__starts = np.full(tile_count, -1, dtype=np.int64)
+        self.__count = 0
+
+    @property
+    def tile_rows(self):
+        return self.__tile_rows
+
+    @property
+    def count(self):
+        return self.__count
+
+    def __len__(self):
+        return self.__tiles.shape[0]
+
+    def tile(self, i):
+        '''
+        :param i: the tile index.
+        :return: the slices in the tile, newest first.
+        '''
+        return self.__tiles[i]
+
+    def is_written(self, i):
+        '''
+        :param i: the tile index.
+        :return: true if any slice has been written to the tile.
+        '''
+        return self.__starts[i] >= 0
+
+    def append(self, slices):
+        '''
+        Writes the new slices into the tiles.
+        :param slices: the new slices, oldest first, with shape (slices, bins).
+        :return: the indexes of the tiles which changed.
+        '''
+        changed = []
+        for row in slices:
+            start = self.__count - self.__count % self.__tile_rows
+            i = (start // self.__tile_rows) % len(self)
+            if self.__starts[i] != start:
+                self.__starts[i] = start
+                self.__tiles[i].fill(EMPTY_DB)
+            self.__tiles[i, self.__tile_rows - 1 - (self.__count - start)] = row
+            if not changed or changed[-1] != i:
+                changed.append(i)
+            self.__count += 1
+        return changed
+
+    def padded(self, i, pad):
+        '''
+        :param i: the tile index.
+        :param pad: the number of slices to add above and below the tile.
+        :return: the slices in the tile, newest first, between the adjacent slices of the neighbouring tiles (or copies
+        of the edge slices if there is no neighbouring tile). Slices which have not been written yet are replaced by a
+        copy of the newest written slice so that resampling never interpolates towards EMPTY_DB.
+        '''
+        tile = self.__tiles[i]
+        start = self.__starts[i]
+        newer = (i + 1) % len(self)
+        older = (i - 1) % len(self)
+        if pad > 0:
+            above = self.__tiles[newer][-pad:] if self.__starts[newer] == start + self.__tile_rows \
+                else np.repeat(tile[:1], pad, axis=0)
+            below = self.__tiles[older][:pad] if self.__starts[older] == start - self.__tile_rows \
+                else np.repeat(tile[-1:], pad, axis=0)
+            block = np.concatenate([above, tile, below])
+        else:
+            block = tile.copy()
+        # only the newest slices can be unwritten so they are always at the top
+        unwritten = pad + self.__tile_rows - min(self.__tile_rows, self.__count - start)
+        if self.__starts[newer] == start + self.__tile_rows:
+            unwritten = pad - min(pad, self.__count - self.__starts[newer])
+        if 0 < unwritten < block.shape[0]:
+            block[:unwritten] = block[unwritten]
+        return block
+
+    def offset(self, i):
+        '''
+        :param i: the tile index.
+        :return: the position of the top of the tile, in slices from the top of the chart, may be negative when the
+        tile is not full yet.
+        '''
+        return self.__count - (self.__starts[i] + self.__tile_rows)
+
+
+class ScrollingImage:
+    '''
+    Displays a spectrogram, newest slice first, as a column of ImageItems backed by ImageTiles. Only the tiles which
+    receive new slices are rendered and pushed to pyqtgraph on each update, the remaining tiles are moved down so the
+    cost of an update depends on the number of new slices rather than the length of the history. Each tile is rendered
+    for the visible part of the chart only, at no more than one value per screen pixel, and the tiles are rendered
+    again only when the visible range or the size of the chart changes.
+    '''
+
+    def __init__(self, plot, rows, bins, x_scale, y_scale, scale_factor, scale_algo, lut, levels):
+        '''
+        :param plot: the plot item.
+        :param rows: the number of time slices to display.
+        :param bins: the number of frequency bins in each slice.
+        :param x_scale: the width of a bin.
+        :param y_scale: the height of a slice.
+        :param scale_factor: the max upsampling factor.
+        :param scale_algo: the PIL resampling filter.
+        :param lut: the lookup table.
+        :param levels: the initial levels.
+        '''
+        self.__tiles = ImageTiles(rows, bins)
+        self.__rows = rows
+        self.__bins = bins
+        self.__x_scale = x_scale
+        self.__y_scale = y_scale
+        self.__scale_factor = scale_factor
+        self.__scale_algo = scale_algo
+        self.__view_box = plot.getViewBox()
+        self.__viewport = None
+        self.__items = []
+        for i in range(len(self.__tiles)):
+            item = pg.ImageItem()
+            item.setLookupTable(lut)
+            item.setLevels(levels)
+            plot.addItem(item)
+            self.__items.append(item)
+        self.__update_viewport()
+        self.__view_box.sigXRangeChanged.connect(self.__on_view_change)
+        self.__view_box.sigResized.connect(self.__on_view_change)
+
+    def setLevels(self, levels):
+        for item in self.__items:
+            item.setLevels(levels)
+
+    def __on_view_change(self, *args):
+        if self.__update_viewport() is True:
+            for i in range(len(self.__tiles)):
+                if self.__tiles.is_written(i):
+                    self.__render(i)
+
+    def __update_viewport(self):
+        '''
+        Calculates the visible bins and the size of the rendered tiles.
+        :return: true if the viewport has changed.
+        '''
+        x_min, x_max = self.__view_box.viewRange()[0]
+        lo = min(max(0, int(np.floor(x_min / self.__x_scale))), self.__bins - 1)
+        hi = max(min(self.__bins, int(np.ceil(x_max / self.__x_scale)) + 1), lo + 1)
+        width = int(self.__view_box.width())
+        height = int(self.__view_box.height())
+        # not on screen yet so just upsample
+        columns = fit_to_pixels(hi - lo, width, self.__scale_factor) if width > 0 else (hi - lo) * self.__scale_factor
+        tile_rows = self.__tiles.tile_rows
+        tile_height = int(round(tile_rows * height / self.__rows))
+        rows = fit_to_pixels(tile_rows, tile_height, self.__scale_factor) if height > 0 \
+            else tile_rows * self.__scale_factor
+        viewport = (lo, hi, columns, rows)
+        if viewport != self.__viewport:
+            self.__viewport = viewport
+            transform = QTransform.fromScale((hi - lo) * self.__x_scale / columns, tile_rows * self.__y_scale / rows)
+            for item in self.__items:
+                item.setTransform(transform)
+            return True
+        return False
+
+    def append(self, slices):
+        '''
+        Adds the new slices to the top of the image.
+        :param slices: the slices, oldest first, with shape (slices, bins).
+        '''
+        before = self.__tiles.count
+        changed = self.__tiles.append(slices)
+        if changed and before % self.__tiles.tile_rows < RESAMPLE_PAD:
+            # the older tile is resampled along with the first slices of the newer tile
+            older = (changed[0] - 1) % len(self.__tiles)
+            if older not in changed and self.__tiles.is_written(older):
+                changed.append(older)
+        for i in changed:
+            self.__render(i)
+        for i, item in enumerate(self.__items):
+            item.setPos(self.__viewport[0] * self.__x_scale, self.__tiles.offset(i) * self.__y_scale)
+
+    def __render(self, i):
+        lo, hi, columns, rows = self.__viewport
+        tile_rows = self.__tiles.tile_rows
+        if rows > tile_rows:
+            # upsampled by a whole factor so resample the neighbouring slices too, then crop, so the tile edges match
+            factor = rows // tile_rows
+            pad = RESAMPLE_PAD
+            tile = downsample_max(self.__tiles.padded(i, pad)[:, lo:hi], columns, 1)
+            tile = self.__resample(tile, columns, (tile_rows + 2 * pad) * factor)[pad * factor:pad * factor + rows]
+        else:
+            tile = downsample_max(downsample_max(self.__tiles.padded(i, 0)[:, lo:hi], columns, 1), rows, 0)
+            if tile.shape != (rows, columns):
+                tile = self.__resample(tile, columns, rows)
+        self.__items[i].setImage(tile.T, autoLevels=False)
+        self.__items[i].setPos(lo * self.__x_scale, self.__tiles.offset(i) * self.__y_scale)
+
+    def __resample(self, tile, columns, rows):
+        return np.array(Image.fromarray(np.ascontiguousarray(tile)).resize(size=(columns, rows),
+                                                                         resample=self.__scale_algo))
+
+
+def fit_to_pixels(size, pixels, scale_factor):
+    '''
+    :param size: the number of values.
+    :param pixels: the number of pixels available to display them.
+    :param scale_factor: the max upsampling factor.
+    :return: the number of values to render, i.e. one per pixel if there are more values than pixels otherwise the
+    values upsampled by the largest whole factor which fits.
+    '''
+    if size >= pixels:
+        return max(1, pixels)
+    return size * max(1, min(scale_factor, pixels // size))
+
+
+def downsample_max(a, size, axis):
+    '''
+    Reduces an axis of the array to the given size by taking the max of each group of values, the values are in dB
+    so the max is the loudest value within the pixel.
+    :param a: the array.
+    :param size: the target size.
+    :param axis: the axis to reduce.
+    :return: the reduced array or the array itself if it is no larger than the target size.
+    '''
+    if a.shape[axis] <= size:
+        return a
+    edges = np.linspace(0, a.shape[axis], size + 1).astype(np.int64)[:-1]
+    return np.maximum.reduceat(a, edges, axis=axis)
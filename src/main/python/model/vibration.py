@@ -1,23 +1,50 @@
 import logging
+import math
+from collections import namedtuple
 
 import numpy as np
 import pyqtgraph as pg
+from scipy import signal
 from scipy.signal import find_peaks
 
 from common import format_pg_plotitem, block_signals
-from model.charts import VisibleChart
+from model.charts import VisibleChart, ChartEvent
+from model.preferences import ANALYSIS_VIBRATION_OVERLOAD
 
 logger = logging.getLogger('qvibe.vibration')
 
+# the analysis modes which are filtered along with the type of filter applied
+FILTERED_MODES = {'Vibration': 'high', 'Tilt': 'low'}
+# the zero phase filter output is recalculated until the filter response to a newer sample has decayed to this level
+SETTLING_TOLERANCE = 1e-6
+# the sliding window holds this fraction of its capacity as spare rows so that it is shifted only occasionally
+WINDOW_SLACK = 0.25
+# the columns of the sliding window, idx then x/y/z for the raw data followed by x/y/z for each filtered mode
+WINDOW_COLUMNS = {'Raw': 1, 'Vibration': 4, 'Tilt': 7}
+AXES = ['x', 'y', 'z']
+
+FilteredSamples = namedtuple('FilteredSamples', ['measurement_name', 'idx', 'raw', 'filtered'])
+
+# the number of samples summarised by each min/max block
+ENVELOPE_BLOCK_SIZE = 64
+# raw samples are shown once zoomed in so far that there are no more than this many samples per pixel
+RAW_SAMPLES_PER_PIXEL = 2
+
 
 class Vibration(VisibleChart):
 
-    def __init__(self, chart, prefs, fs_widget, fps_widget, actual_fps_widget, resolution_widget, accel_sens_widget,
-                 buffer_size_widget, analysis_type_widget, left_marker_pos, right_marker_pos, time_range,
-                 zoom_in_button, zoom_out_button, find_peaks_button, colour_provider):
-        super().__init__(prefs, fs_widget, resolution_widget, fps_widget, actual_fps_widget,
-                         True, analysis_mode=analysis_type_widget.currentText())
+    def __init__(self, chart, prefs, fs_widget, fps_widget, actual_fps_widget, queue_status_widget, resolution_widget,
+                 accel_sens_widget, buffer_size_widget, analysis_type_widget, left_marker_pos, right_marker_pos,
+                 time_range, zoom_in_button, zoom_out_button, find_peaks_button, colour_provider):
+        # each event holds the samples received since the previous event so queued events should be merged, the filters
+        # restart after any samples are dropped
+        super().__init__(prefs, fs_widget, resolution_widget, fps_widget, actual_fps_widget, queue_status_widget,
+                         True, overload_policy_key=ANALYSIS_VIBRATION_OVERLOAD,
+                         analysis_mode=analysis_type_widget.currentText())
         self.__plots = {}
+        self.__envelopes = {}
+        self.__filters = {}
+        self.__copied = {}
         self.__legend = None
         self.__colour_provider = colour_provider
         self.__chart = chart
@@ -42,32 +69,53 @@ class Vibration(VisibleChart):
         self.__find_peaks_button = find_peaks_button
         self.__find_peaks_button.clicked.connect(self.__find_peaks)
         self.__find_peaks_button.setEnabled(False)
+        view_box = self.__chart.getPlotItem().getViewBox()
+        view_box.sigXRangeChanged.connect(self.__render_all)
+        view_box.sigResized.connect(self.__render_all)
 
     def __find_peaks(self):
         '''
         Looks for peaks in the signal using a continuous wavelet transform.
         '''
-        name, plot = next(iter(self.__plots.items()))
+        name = next(iter(self.__plots.keys()))
+        envelope = self.__envelopes.get(name, None)
+        if envelope is None or envelope.size == 0:
+            return
         x_min, x_max = self.__chart.getPlotItem().viewRange()[0]
-        x_min_idx = np.argmax(plot.xData >= x_min-0.00001)
-        x_max_idx = np.argmax(plot.xData >= x_max-0.00001) if x_max < plot.xData[-1] else -1
-        y_data = np.require(plot.yData[x_min_idx:x_max_idx], requirements=['O', 'W'])
+        # the plot only holds the envelope of the visible range so search the raw samples instead
+        x_min_idx, y_data = self.__visible_samples(envelope, x_min, x_max)
+        if y_data.size == 0:
+            return
+        y_data = np.require(y_data, requirements=['O', 'W'])
         peak_y = np.amax(y_data)
         peaks = find_peaks(y_data, height=peak_y * 0.99)
         if len(peaks[0]) > 0:
             peaks = peaks[0] + x_min_idx
             if len(peaks) > 1:
-                left = plot.xData[peaks[0]]
-                right = plot.xData[peaks[1]]
+                left = peaks[0] / envelope.fs
+                right = peaks[1] / envelope.fs
                 logger.info(f"Found {len(peaks)} peaks in {name} - {left} -> {right}")
                 self.__left_marker_pos.setValue(left)
             else:
-                right = plot.xData[peaks[0]]
+                right = peaks[0] / envelope.fs
                 logger.info(f"Found 1 peak in {name} - {right}")
             self.__right_marker_pos.setValue(right)
         else:
             logger.info(f"No values found within 1% of {peak_y}")
 
+    @staticmethod
+    def __visible_samples(envelope, x_min, x_max):
+        '''
+        :param envelope: the envelope.
+        :param x_min: the start of the visible range in seconds from the first sample.
+        :param x_max: the end of the visible range in seconds from the first sample.
+        :return: the index of the first visible sample and the raw samples in the visible range.
+        '''
+        n = envelope.size
+        s0 = min(max(0, int(np.ceil((x_min - 0.00001) * envelope.fs))), n)
+        s1 = min(max(s0, int(np.floor((x_max + 0.00001) * envelope.fs)) + 1), n)
+        return s0, envelope.values[s0:s1]
+
     def __propagate_marker(self, widget, value):
         with block_signals(widget):
             widget.setValue(value)
@@ -88,12 +136,15 @@ class Vibration(VisibleChart):
         y_min, y_max = lims[1]
         y_maxes = []
         y_mins = []
-        for name, plot in self.__plots.items():
-            x_min_idx = np.argmax(plot.xData >= x_min)
-            x_max_idx = np.argmax(plot.xData >= x_max) if x_max < plot.xData[-1] else -1
-            y_data = plot.yData[x_min_idx:x_max_idx]
-            y_mins.append(np.amin(y_data))
-            y_maxes.append(np.amax(y_data))
+        for name in self.__plots.keys():
+            envelope = self.__envelopes.get(name, None)
+            if envelope is not None and envelope.size > 0:
+                _, y_data = self.__visible_samples(envelope, x_min, x_max)
+                if y_data.size > 0:
+                    y_mins.append(np.amin(y_data))
+                    y_maxes.append(np.amax(y_data))
+        if not y_maxes:
+            return
         new_y_max = max(y_maxes)
         new_y_min = min(y_mins)
         self.__chart.getPlotItem().setYRange(max(new_y_min, y_min), min(new_y_max, y_max))
@@ -101,8 +152,8 @@ class Vibration(VisibleChart):
     def __on_analysis_mode_change(self, analysis_mode):
         logger.info(f"Changing analysis mode from {self.analysis_mode} to {analysis_mode}")
         self.analysis_mode = analysis_mode
+        self.__envelopes = {}
         for name in self.cached_measurement_names():
-            self.cached_data(name).set_mode(self.analysis_mode, recalc=False)
             self.update_chart(name)
 
     def __on_buffer_size_change(self, size):
@@ -122,35 +173,83 @@ class Vibration(VisibleChart):
             self.__chart.removeItem(c)
             self.__legend.removeItem(n)
         self.__plots = {}
+        self.__envelopes = {}
+        self.__filters = {}
+        self.__copied = {}
+
+    def make_event(self, measurement_name, data, idx):
+        filters = self.__filters.get(measurement_name, None)
+        if filters is None or filters.fs != self.fs:
+            filters = self.__filters[measurement_name] = VibrationFilters(self.fs)
+            self.__copied.pop(measurement_name, None)
+        # the buffer is only read on the main thread, as that is where it is written
+        rows, self.__copied[measurement_name] = take_new_rows(data, self.__copied.get(measurement_name, None))
+        if rows is None:
+            return None
+        return VibrationEvent(self, measurement_name, rows, idx, self.preferences.analysis_config, self.budget_millis,
+                              filters)
+
+    def accept_data(self, data):
+        '''
+        Applies the fresh samples to the sliding window for the measurement.
+        :param data: the FilteredSamples.
+        '''
+        window = self.cached_data(data.measurement_name)
+        capacity = int(self.fs * self.__buffer_size)
+        if window is None or window.capacity != capacity:
+            window = FilteredWindow(data.measurement_name, capacity)
+        window.extend(data)
+        return super().accept_data(window)
 
     def update_chart(self, measurement_name):
         '''
         updates the chart with the latest signal.
         '''
-        d = self.cached_data(measurement_name)
-        if d is not None:
-            t = (d.time - np.min(d.time)) / self.fs
-            self.create_or_update(d.x, t)
-            self.create_or_update(d.y, t)
-            self.create_or_update(d.z, t)
+        window = self.cached_data(measurement_name)
+        if window is not None and window.size > 0:
+            for axis in AXES:
+                self.create_or_update(window, axis)
 
-    def create_or_update(self, series, t):
-        name = self.__get_plot_name(series)
-        if self.is_visible(measurement=series.measurement_name, axis=series.axis) is True:
+    def create_or_update(self, window, axis):
+        name = f"{window.measurement_name}:{axis}"
+        if self.is_visible(measurement=window.measurement_name, axis=axis) is True:
+            envelope = self.__envelopes.get(name, None)
+            if envelope is None:
+                envelope = self.__envelopes[name] = MinMaxEnvelope(self.fs)
+            envelope.update(window.idx, window.values(self.analysis_mode, axis),
+                            changed_from=window.changed_since(envelope.last, self.analysis_mode))
+            t, y = self.__render(envelope)
             if name in self.__plots:
-                self.__plots[name].setData(t, series.data)
+                self.__plots[name].setData(t, y)
             else:
                 colour = self.__colour_provider.get_colour(name)
                 if self.__legend is None:
                     self.__legend = self.__chart.addLegend(offset=(-15, -15))
                     self.__init_markers()
-                self.__plots[name] = self.__chart.plot(t, series.data, pen=pg.mkPen(colour, width=1), name=name)
+                self.__plots[name] = self.__chart.plot(t, y, pen=pg.mkPen(colour, width=1), name=name)
         elif name in self.__plots:
             self.__chart.removeItem(self.__plots[name])
             del self.__plots[name]
+            self.__envelopes.pop(name, None)
             self.__legend.removeItem(name)
         self.__find_peaks_button.setEnabled(len(self.__plots.keys()) == 1)
 
+    def __render(self, envelope):
+        '''
+        :param envelope: the envelope.
+        :return: the envelope of the visible part of the chart.
+        '''
+        x_min, x_max = self.__chart.getPlotItem().viewRange()[0]
+        pixels = int(self.__chart.getPlotItem().getViewBox().width())
+        return envelope.render(x_min, x_max, pixels if pixels > 0 else 1000)
+
+    def __render_all(self, *args):
+        ''' Renders the envelopes again when the visible part of the chart changes. '''
+        for name, plot in self.__plots.items():
+            envelope = self.__envelopes.get(name, None)
+            if envelope is not None and envelope.size > 0:
+                plot.setData(*self.__render(envelope))
+
     def __init_markers(self):
         self.__left_marker = pg.InfiniteLine(movable=True, bounds=[0.000, self.__buffer_size-0.001])
         self.__left_marker.sigPositionChangeFinished.connect(lambda: self.__propagate_marker(self.__left_marker_pos,
@@ -174,6 +273,310 @@ class Vibration(VisibleChart):
         self.__right_marker.setBounds([self.__left_marker.value() + 0.001, self.__buffer_size])
         self.__right_marker_pos.setMinimum(self.__left_marker.value() + 0.001)
 
-    @staticmethod
-    def __get_plot_name(sig):
-        return f"{sig.measurement_name}:{sig.axis}"
+
+class MinMaxEnvelope:
+    '''
+    The min and max of a sliding window of samples in blocks of ENVELOPE_BLOCK_SIZE samples. Only the blocks which
+    contain new (or changed) samples are summarised on each update. The envelope is rendered as the min and max of
+    each pixel so peaks remain visible however far the chart is zoomed out, unlike stride based downsampling, and raw
+    samples are rendered when zoomed in.
+    '''
+
+    def __init__(self, fs, block_size=ENVELOPE_BLOCK_SIZE):
+        '''
+        :param fs: the sample rate.
+        :param block_size: the number of samples in each block.
+        '''
+        self.__fs = fs
+        self.__block_size = block_size
+        self.__first = None
+        self.__last = None
+        self.__values = None
+        self.__first_block = None
+        self.__mins = None
+        self.__maxs = None
+
+    @property
+    def size(self):
+        return 0 if self.__values is None else self.__values.shape[0]
+
+    @property
+    def last(self):
+        return self.__last
+
+    @property
+    def fs(self):
+        return self.__fs
+
+    @property
+    def values(self):
+        ''' the raw samples in the window, the first of which is at time 0. '''
+        return self.__values
+
+    def update(self, idx, values, changed_from=None):
+        '''
+        Replaces the samples with the latest window.
+        :param idx: the (contiguous) sample index of each value.
+        :param values: the values.
+        :param changed_from: the index of the first sample whose value may have changed since the last update, defaults
+        to the first new sample.
+        '''
+        first = int(idx[0])
+        last = int(idx[-1])
+        b = self.__block_size
+        first_block = first // b
+        if changed_from is None:
+            changed_from = first if self.__last is None else self.__last + 1
+        if self.__last is None or first < self.__first or first > self.__last + 1 or last < self.__last:
+            changed_from = first
+        start_block = min(max(first_block, changed_from // b), last // b)
+        offsets = np.arange(start_block, last // b + 1) * b - first
+        offsets[0] = max(offsets[0], 0)
+        mins = np.minimum.reduceat(values, offsets)
+        maxs = np.maximum.reduceat(values, offsets)
+        if start_block > first_block:
+            keep = slice(first_block - self.__first_block, start_block - self.__first_block)
+            mins = np.concatenate((self.__mins[keep], mins))
+            maxs = np.concatenate((self.__maxs[keep], maxs))
+            # the first block loses samples as the window slides
+            head = values[:(first_block + 1) * b - first]
+            mins[0] = head.min()
+            maxs[0] = head.max()
+        self.__first = first
+        self.__last = last
+        self.__values = values
+        self.__first_block = first_block
+        self.__mins = mins
+        self.__maxs = maxs
+
+    def render(self, x_min, x_max, pixels):
+        '''
+        :param x_min: the start of the visible range in seconds from the first sample.
+        :param x_max: the end of the visible range in seconds from the first sample.
+        :param pixels: the width of the visible range in pixels.
+        :return: the time (in seconds from the first sample) and value of each point to plot.
+        '''
+        n = self.size
+        s0 = min(max(0, int(np.floor(x_min * self.__fs))), n - 1)
+        s1 = min(n, max(s0 + 1, int(np.ceil(x_max * self.__fs)) + 1))
+        pixels = max(1, pixels)
+        if (s1 - s0) <= pixels * RAW_SAMPLES_PER_PIXEL:
+            return np.arange(s0, s1) / self.__fs, self.__values[s0:s1]
+        if (s1 - s0) < pixels * self.__block_size:
+            edges = np.unique(np.linspace(s0, s1, pixels + 1).astype(np.int64)[:-1])
+            mins = np.minimum.reduceat(self.__values[s0:s1], edges - s0)
+            maxs = np.maximum.reduceat(self.__values[s0:s1], edges - s0)
+            starts = edges
+        else:
+            b0 = (self.__first + s0) // self.__block_size - self.__first_block
+            b1 = (self.__first + s1 - 1) // self.__block_size - self.__first_block + 1
+            edges = np.unique(np.linspace(b0, b1, pixels + 1).astype(np.int64)[:-1])
+            mins = np.minimum.reduceat(self.__mins[b0:b1], edges - b0)
+            maxs = np.maximum.reduceat(self.__maxs[b0:b1], edges - b0)
+            starts = np.maximum((edges + self.__first_block) * self.__block_size - self.__first, 0)
+        t = np.repeat(starts / self.__fs, 2)
+        y = np.empty(t.shape, dtype=mins.dtype)
+        y[0::2] = mins
+        y[1::2] = maxs
+        return t, y
+
+
+def get_settling_samples(sos, tolerance=SETTLING_TOLERANCE):
+    '''
+    :param sos: a stable IIR filter in second order sections.
+    :param tolerance: the level to which the impulse response must decay.
+    :return: the number of samples it takes for the impulse response of the filter to decay to the tolerance.
+    '''
+    radius = max(np.abs(np.roots(s[3:])).max() for s in sos)
+    return int(math.ceil(math.log(tolerance) / math.log(radius)))
+
+
+class ZeroPhaseStream:
+    '''
+    Applies a butterworth filter forwards and then backwards, as per filtfilt, to a stream of samples. The forward pass
+    sees each sample once as its state is carried from one chunk to the next. The backward pass has to start from the
+    newest sample so it is repeated for each chunk but only over the trailing samples which the newer samples can still
+    affect, i.e. until the filter has settled, so the work per chunk is bounded by the settling time rather than growing
+    with the length of the stream. The backward pass starts from the steady state for the newest sample, rather than
+    the padded signal used by filtfilt, so the newest samples are provisional and are refined as more samples arrive.
+    '''
+
+    def __init__(self, fs, btype, f3=2, order=2):
+        '''
+        :param fs: the sample rate.
+        :param btype: high or low.
+        :param f3: the f3 of the filter.
+        :param order: the filter order.
+        '''
+        self.__sos = signal.butter(order, f3 / (0.5 * fs), btype=btype, output='sos')
+        self.__zi = signal.sosfilt_zi(self.__sos)[:, :, np.newaxis]
+        self.__settling = get_settling_samples(self.__sos)
+        self.__state = None
+        self.__forward = None
+
+    @property
+    def settling(self):
+        return self.__settling
+
+    def process(self, data):
+        '''
+        :param data: the new samples, one column per axis.
+        :return: the filtered trailing samples, the last len(data) rows are the new samples and the rows before that
+        replace the values previously returned for the samples which precede them.
+        '''
+        if self.__state is None:
+            self.__state = self.__zi * data[0]
+            self.__forward = data[:0]
+        forward, self.__state = signal.sosfilt(self.__sos, data, axis=0, zi=self.__state)
+        forward = np.concatenate((self.__forward, forward))
+        self.__forward = forward[-self.__settling:]
+        backward, _ = signal.sosfilt(self.__sos, forward[::-1], axis=0, zi=self.__zi * forward[-1])
+        return backward[::-1]
+
+
+class VibrationFilters:
+    '''
+    Filters the samples of a measurement, in each of the filtered modes, as they arrive.
+    '''
+
+    def __init__(self, fs):
+        '''
+        :param fs: the sample rate.
+        '''
+        self.__fs = fs
+        self.__last = None
+        self.__streams = {}
+
+    @property
+    def fs(self):
+        return self.__fs
+
+    def process(self, measurement_name, rows):
+        '''
+        :param measurement_name: the measurement name.
+        :param rows: the analysis data (idx, ..., x, y, z) received since the last call.
+        :return: the FilteredSamples for the rows.
+        '''
+        rows = np.asarray(rows, dtype=np.float64)
+        if self.__last is None or int(rows[0, 0]) != self.__last + 1:
+            # the first samples or samples have been lost so start again
+            self.__streams = {mode: ZeroPhaseStream(self.__fs, btype) for mode, btype in FILTERED_MODES.items()}
+        self.__last = int(rows[-1, 0])
+        raw = rows[:, 2:5]
+        return FilteredSamples(measurement_name, rows[:, 0], raw,
+                               {mode: stream.process(raw) for mode, stream in self.__streams.items()})
+
+
+def take_new_rows(data, last):
+    '''
+    Copies the rows which have arrived since the last call.
+    :param data: the analysis data (idx, ..., x, y, z) as an array or RingBuffer.
+    :param last: the idx of the last row taken.
+    :return: a copy of the new rows (None if there are none) and the idx of the last row taken.
+    '''
+    n = len(data)
+    if n == 0:
+        return None, last
+    # integer indexing reads just the required rows from a RingBuffer
+    latest = int(data[[n - 1]][0, 0])
+    if last is not None and latest < last:
+        last = None
+    count = n if last is None else min(n, latest - last)
+    if count <= 0:
+        return None, last
+    return np.array(data[np.arange(n - count, n)], dtype=np.float64), latest
+
+
+class VibrationEvent(ChartEvent):
+    ''' Filters the samples which have arrived since the previous event. '''
+
+    def __init__(self, chart, measurement_name, input, idx, config, budget_millis, filters):
+        super().__init__(chart, measurement_name, input, idx, config, budget_millis)
+        self.__filters = filters
+
+    def process(self):
+        self.output = self.__filters.process(self.measurement_name, self.input)
+        self.should_emit = True
+
+    def merge(self, older, max_chunks):
+        self.input = np.concatenate([e.input for e in older] + [self.input])
+        return 0
+
+
+class FilteredWindow:
+    '''
+    The latest samples of a measurement, raw and in each filtered mode, held in a sliding window which is updated in
+    place from each FilteredSamples. The buffer has some spare rows so the window is only shifted back to the start of
+    the buffer once those are used up.
+    '''
+
+    def __init__(self, measurement_name, capacity):
+        '''
+        :param measurement_name: the measurement name.
+        :param capacity: the number of samples to hold.
+        '''
+        self.__measurement_name = measurement_name
+        self.__capacity = capacity
+        self.__buffer = np.zeros((capacity + max(1, int(capacity * WINDOW_SLACK)), 10))
+        self.__start = 0
+        self.__end = 0
+        self.__settling = 0
+
+    @property
+    def measurement_name(self):
+        return self.__measurement_name
+
+    @property
+    def capacity(self):
+        return self.__capacity
+
+    @property
+    def size(self):
+        return self.__end - self.__start
+
+    @property
+    def idx(self):
+        return self.__buffer[self.__start:self.__end, 0]
+
+    def values(self, mode, axis):
+        '''
+        :param mode: the analysis mode.
+        :param axis: the axis.
+        :return: the values of the axis in the given mode.
+        '''
+        return self.__buffer[self.__start:self.__end, WINDOW_COLUMNS.get(mode, 1) + AXES.index(axis)]
+
+    def changed_since(self, last, mode):
+        '''
+        :param last: the idx of the latest sample when the values were last read.
+        :param mode: the analysis mode.
+        :return: the idx of the first sample whose value may have changed since then, None if that is the sample after
+        last.
+        '''
+        if last is None or mode not in FILTERED_MODES:
+            return None
+        return last + 1 - self.__settling
+
+    def extend(self, samples):
+        '''
+        Adds the new samples and overwrites the trailing filtered values.
+        :param samples: the FilteredSamples.
+        '''
+        count = min(samples.idx.shape[0], self.__capacity)
+        if self.size > 0 and samples.idx[0] != self.__buffer[self.__end - 1, 0] + 1:
+            # not contiguous so start again
+            self.__start = self.__end = 0
+        if self.__end + count > self.__buffer.shape[0]:
+            keep = min(self.size, self.__capacity - count)
+            self.__buffer[:keep] = self.__buffer[self.__end - keep:self.__end]
+            self.__start, self.__end = 0, keep
+        self.__end += count
+        self.__start = max(self.__start, self.__end - self.__capacity)
+        new_rows = slice(self.__end - count, self.__end)
+        self.__buffer[new_rows, 0] = samples.idx[-count:]
+        self.__buffer[new_rows, 1:4] = samples.raw[-count:]
+        for mode, values in samples.filtered.items():
+            n = min(values.shape[0], self.size)
+            col = WINDOW_COLUMNS[mode]
+            self.__buffer[self.__end - n:self.__end, col:col + 3] = values[-n:]
+            self.__settling = max(self.__settling, values.shape[0] - samples.idx.shape[0])
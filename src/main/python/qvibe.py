@@ -5,8 +5,11 @@ import os
 import sys
 import time
 
-from model.charts import ColourProvider
+from model.charts import ColourProvider, configure_chart_scheduler, get_chart_scheduler
+from model.fft import benchmark_fft
+from model.cache import configure_analysis_cache
 from model.measurements import MeasurementStore
+from model.pool import configure_analysis_pool
 from model.rta import RTA
 from model.save import SaveChartDialog, SaveWavDialog
 from model.spectrogram import Spectrogram
@@ -30,7 +33,8 @@ from qtpy.QtWidgets import QMainWindow, QApplication, QErrorMessage, QMessageBox
 from common import block_signals, ReactorRunner, np_to_str, parse_file, bump_tick_levels
 from model.preferences import SYSTEM_CHECK_FOR_BETA_UPDATES, SYSTEM_CHECK_FOR_UPDATES, SCREEN_GEOMETRY, \
     SCREEN_WINDOW_STATE, PreferencesDialog, Preferences, BUFFER_SIZE, ANALYSIS_RESOLUTION, CHART_MAG_MIN, \
-    CHART_MAG_MAX, keep_range, CHART_FREQ_MIN, CHART_FREQ_MAX, SNAPSHOT_GROUP
+    CHART_MAG_MAX, keep_range, CHART_FREQ_MIN, CHART_FREQ_MAX, SNAPSHOT_GROUP, ANALYSIS_FFT_BACKEND, \
+    ANALYSIS_FFT_WORKERS, ANALYSIS_PROCESSES, ANALYSIS_CACHE_MB, ANALYSIS_THREADS, ANALYSIS_FFT_BENCHMARKED
 from model.checker import VersionChecker, ReleaseNotesDialog
 from model.log import RollingLogger, to_millis
 from model.preferences import RECORDER_TARGET_FS, RECORDER_TARGET_SAMPLES_PER_BATCH, RECORDER_TARGET_ACCEL_ENABLED, \
@@ -44,6 +48,7 @@ logger = logging.getLogger('qvibe')
 
 class QVibe(QMainWindow, Ui_MainWindow):
     snapshot_saved = QtCore.Signal(int, str, object)
+    fft_benchmarked = QtCore.Signal(str, int)
 
     def __init__(self, app, prefs, parent=None):
         super(QVibe, self).__init__(parent)
@@ -127,16 +132,20 @@ class QVibe(QMainWindow, Ui_MainWindow):
         colour_provider = ColourProvider()
         self.__analysers = {
             0: Vibration(self.liveVibrationChart, self.preferences, self.targetSampleRate, self.fps, self.actualFPS,
-                         self.resolutionHz, self.targetAccelSens, self.bufferSize, self.vibrationAnalysis,
-                         self.leftMarker, self.rightMarker, self.timeRange, self.zoomInButton, self.zoomOutButton,
-                         self.findPeaksButton, colour_provider),
+                         self.chartQueueStatus, self.resolutionHz, self.targetAccelSens, self.bufferSize,
+                         self.vibrationAnalysis, self.leftMarker, self.rightMarker, self.timeRange, self.zoomInButton,
+                         self.zoomOutButton, self.findPeaksButton, colour_provider),
             1: RTA(self.rtaLayout, self.rtaTab, self.rtaChart, self.preferences, self.targetSampleRate,
-                   self.resolutionHz, self.fps, self.actualFPS, self.magMin, self.magMax, self.freqMin, self.freqMax,
-                   self.refCurve, self.showValueFor, self.__measurement_store.signals, colour_provider),
+                   self.resolutionHz, self.fps, self.actualFPS, self.chartQueueStatus, self.magMin, self.magMax,
+                   self.freqMin, self.freqMax, self.refCurve, self.showValueFor, self.__measurement_store.signals,
+                   colour_provider),
             2: Spectrogram(self.spectrogramView, self.preferences, self.targetSampleRate, self.fps, self.actualFPS,
-                           self.resolutionHz, self.bufferSize, self.magMin, self.magMax, self.freqMin, self.freqMax,
-                           self.visibleCurves, self.__measurement_store),
+                           self.chartQueueStatus, self.resolutionHz, self.bufferSize, self.magMin, self.magMax,
+                           self.freqMin, self.freqMax, self.visibleCurves, self.__measurement_store),
         }
+        configure_analysis_cache(self.preferences.get(ANALYSIS_CACHE_MB) * 1024 * 1024)
+        configure_analysis_pool(self.preferences.get(ANALYSIS_PROCESSES))
+        self.app.aboutToQuit.connect(lambda: configure_analysis_pool(0))
         self.__start_analysers()
         self.set_visible_chart(self.chartTabs.currentIndex())
 
@@ -171,6 +180,16 @@ class QVibe(QMainWindow, Ui_MainWindow):
         self.disconnectAllButton.clicked.connect(self.__recorder_store.disconnect)
         self.snapshot_saved.connect(self.__add_snapshot)
         self.__measurement_store.load_snapshots()
+        # the default backend is used until the benchmark completes, it runs once the window has been shown
+        self.fft_benchmarked.connect(self.__store_fft_backend)
+        if self.preferences.get(ANALYSIS_FFT_BENCHMARKED) is False:
+            QTimer.singleShot(0, lambda: QThreadPool.globalInstance().start(FFTBenchmarker(self.fft_benchmarked)))
+
+    def __store_fft_backend(self, backend, workers):
+        ''' Stores the fastest FFT backend in preferences. '''
+        self.preferences.set(ANALYSIS_FFT_BACKEND, backend)
+        self.preferences.set(ANALYSIS_FFT_WORKERS, workers)
+        self.preferences.set(ANALYSIS_FFT_BENCHMARKED, True)
 
     def __set_visible_measurements(self, measurement):
         '''
@@ -189,7 +208,7 @@ class QVibe(QMainWindow, Ui_MainWindow):
             if measurement.latest_data is not None:
                 for c in self.__analysers.values():
                     # TODO must unwrap
-                    c.accept(measurement.key, measurement.data, measurement.idx)
+                    c.accept(measurement.key, measurement.analysis_data, measurement.idx)
         else:
             logger.info(f"Hiding {measurement}")
 
@@ -262,19 +281,21 @@ class QVibe(QMainWindow, Ui_MainWindow):
             c.reset()
 
     def __start_analysers(self):
-        for a in self.__analysers.values():
-            logger.info(f"Starting processor for {a.__class__.__name__}")
-            QThreadPool.globalInstance().reserveThread()
-            a.processor.start()
-
-            def stop_processor():
-                logger.info(f"Stopping processor for {a.__class__.__name__}")
-                a.processor.stop()
-                QThreadPool.globalInstance().releaseThread()
-                logger.info(f"Stopped processor for {a.__class__.__name__}")
-
-            self.app.aboutToQuit.connect(stop_processor)
-            logger.info(f"Started processor for {a.__class__.__name__}")
+        configure_chart_scheduler(self.preferences.get(ANALYSIS_THREADS))
+        self.app.aboutToQuit.connect(lambda: configure_chart_scheduler(0))
+        # taking the metrics resets them so they are only taken here, once a second
+        self.__metrics_timer = QTimer()
+        self.__metrics_timer.timeout.connect(self.__show_scheduler_metrics)
+        self.__metrics_timer.start(1000)
+
+    def __show_scheduler_metrics(self):
+        ''' Shows the load on the chart scheduler since the metrics were last taken. '''
+        scheduler = get_chart_scheduler()
+        if scheduler is not None:
+            metrics = scheduler.take_metrics()
+            self.schedulerStatus.setText(f"Depth: {metrics.depth} Processed: {metrics.processed}\n"
+                                         f"Wait: {metrics.mean_wait_millis} ms (max {metrics.max_wait_millis} ms)")
+            logger.debug(f"Chart scheduler {metrics}")
 
     def __handle_recorder_connect_event(self, ip, connected):
         ''' reacts to connection status changes.'''
@@ -471,6 +492,13 @@ class QVibe(QMainWindow, Ui_MainWindow):
         Shows the preferences dialog.
         '''
         PreferencesDialog(self.preferences, self.__style_path_root, self.__recorder_store, self.__analysers[2], parent=self).exec()
+        self.__measurement_store.reload_analysis_target_fs()
+        configure_analysis_pool(self.preferences.get(ANALYSIS_PROCESSES))
+        configure_chart_scheduler(self.preferences.get(ANALYSIS_THREADS))
+        configure_analysis_cache(self.preferences.get(ANALYSIS_CACHE_MB) * 1024 * 1024)
+        for c in self.__analysers.values():
+            c.reload_analysis_fs()
+            c.reload_overload_policy()
         self.__analysers[1].reload_target()
 
     def show_about(self):
@@ -509,6 +537,20 @@ class SnapshotSaver(QRunnable):
         logger.info(f"Saved snapshot in {to_millis(start, time.time())}ms")
 
 
+class FFTBenchmarker(QRunnable):
+
+    def __init__(self, signal):
+        super().__init__()
+        self.__signal = signal
+
+    def run(self):
+        '''
+        Finds the fastest FFT backend.
+        '''
+        backend, workers = benchmark_fft()
+        self.__signal.emit(backend, workers)
+
+
 class SetPreference(QRunnable):
     def __init__(self, prefs, key, val):
         super().__init__()
@@ -534,6 +576,9 @@ def make_app():
 
 
 if __name__ == '__main__':
+    # allows the analysis pool to spawn worker processes from a frozen app
+    import multiprocessing
+    multiprocessing.freeze_support()
     app, prefs = make_app()
     form = QVibe(app, prefs)
     # setup the error handler
@@ -157,8 +157,16 @@ class Ui_MainWindow(object):
         self.resolutionHzLabel = QtWidgets.QLabel(self.dataCaptureBox)
         self.resolutionHzLabel.setObjectName("resolutionHzLabel")
         self.dataCaptureLayout.addWidget(self.resolutionHzLabel, 0, 0, 1, 1)
+        self.chartQueueStatus = QtWidgets.QLabel(self.dataCaptureBox)
+        self.chartQueueStatus.setWordWrap(True)
+        self.chartQueueStatus.setObjectName("chartQueueStatus")
+        self.dataCaptureLayout.addWidget(self.chartQueueStatus, 5, 0, 1, 2)
+        self.schedulerStatus = QtWidgets.QLabel(self.dataCaptureBox)
+        self.schedulerStatus.setWordWrap(True)
+        self.schedulerStatus.setObjectName("schedulerStatus")
+        self.dataCaptureLayout.addWidget(self.schedulerStatus, 6, 0, 1, 2)
         spacerItem2 = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
-        self.dataCaptureLayout.addItem(spacerItem2, 5, 1, 1, 1)
+        self.dataCaptureLayout.addItem(spacerItem2, 7, 1, 1, 1)
         self.controlsBox.addItem(self.dataCaptureBox, "")
         self.sensorConfigBox = QtWidgets.QWidget()
         self.sensorConfigBox.setGeometry(QtCore.QRect(0, 0, 158, 473))
@@ -464,6 +472,7 @@ class Ui_MainWindow(object):
         self.elapsedTime.setDisplayFormat(_translate("MainWindow", "mm:ss.zzz"))
         self.bufferSizeLabel.setText(_translate("MainWindow", "Buffer"))
         self.actualFPSLabel.setText(_translate("MainWindow", "Actual FPS"))
+        self.schedulerStatus.setToolTip(_translate("MainWindow", "The load on the chart scheduler over the last second"))
         self.fpsLabel.setText(_translate("MainWindow", "Target FPS"))
         self.resolutionHz.setItemText(0, _translate("MainWindow", "0.25 Hz"))
         self.resolutionHz.setItemText(1, _translate("MainWindow", "0.5 Hz"))
@@ -178,6 +178,109 @@ class Ui_preferencesDialog(object):
         self.highpassRTA = QtWidgets.QCheckBox(preferencesDialog)
         self.highpassRTA.setObjectName("highpassRTA")
         self.analysisPane.addWidget(self.highpassRTA, 3, 4, 1, 2)
+        self.fftBackendLabel = QtWidgets.QLabel(preferencesDialog)
+        self.fftBackendLabel.setObjectName("fftBackendLabel")
+        self.analysisPane.addWidget(self.fftBackendLabel, 4, 0, 1, 1)
+        self.fftBackend = QtWidgets.QComboBox(preferencesDialog)
+        self.fftBackend.setObjectName("fftBackend")
+        self.fftBackend.addItem("")
+        self.fftBackend.addItem("")
+        self.analysisPane.addWidget(self.fftBackend, 4, 1, 1, 1)
+        self.fftWorkersLabel = QtWidgets.QLabel(preferencesDialog)
+        self.fftWorkersLabel.setObjectName("fftWorkersLabel")
+        self.analysisPane.addWidget(self.fftWorkersLabel, 4, 2, 1, 1)
+        self.fftWorkers = QtWidgets.QSpinBox(preferencesDialog)
+        self.fftWorkers.setMinimum(1)
+        self.fftWorkers.setMaximum(64)
+        self.fftWorkers.setObjectName("fftWorkers")
+        self.analysisPane.addWidget(self.fftWorkers, 4, 3, 1, 1)
+        self.benchmarkFFT = QtWidgets.QPushButton(preferencesDialog)
+        self.benchmarkFFT.setObjectName("benchmarkFFT")
+        self.analysisPane.addWidget(self.benchmarkFFT, 4, 4, 1, 2)
+        self.precisionLabel = QtWidgets.QLabel(preferencesDialog)
+        self.precisionLabel.setObjectName("precisionLabel")
+        self.analysisPane.addWidget(self.precisionLabel, 5, 0, 1, 1)
+        self.precision = QtWidgets.QComboBox(preferencesDialog)
+        self.precision.setObjectName("precision")
+        self.precision.addItem("")
+        self.precision.addItem("")
+        self.analysisPane.addWidget(self.precision, 5, 1, 1, 1)
+        self.analysisTargetFsLabel = QtWidgets.QLabel(preferencesDialog)
+        self.analysisTargetFsLabel.setObjectName("analysisTargetFsLabel")
+        self.analysisPane.addWidget(self.analysisTargetFsLabel, 5, 2, 1, 1)
+        self.analysisTargetFs = QtWidgets.QSpinBox(preferencesDialog)
+        self.analysisTargetFs.setMinimum(50)
+        self.analysisTargetFs.setMaximum(10000)
+        self.analysisTargetFs.setProperty("value", 1000)
+        self.analysisTargetFs.setObjectName("analysisTargetFs")
+        self.analysisPane.addWidget(self.analysisTargetFs, 5, 3, 1, 1)
+        self.analysisProcessesLabel = QtWidgets.QLabel(preferencesDialog)
+        self.analysisProcessesLabel.setObjectName("analysisProcessesLabel")
+        self.analysisPane.addWidget(self.analysisProcessesLabel, 5, 4, 1, 1)
+        self.analysisProcesses = QtWidgets.QSpinBox(preferencesDialog)
+        self.analysisProcesses.setMaximum(32)
+        self.analysisProcesses.setObjectName("analysisProcesses")
+        self.analysisPane.addWidget(self.analysisProcesses, 5, 5, 1, 1)
+        self.queueLimitLabel = QtWidgets.QLabel(preferencesDialog)
+        self.queueLimitLabel.setObjectName("queueLimitLabel")
+        self.analysisPane.addWidget(self.queueLimitLabel, 6, 0, 1, 1)
+        self.queueLimit = QtWidgets.QSpinBox(preferencesDialog)
+        self.queueLimit.setMinimum(1)
+        self.queueLimit.setMaximum(100)
+        self.queueLimit.setProperty("value", 4)
+        self.queueLimit.setObjectName("queueLimit")
+        self.analysisPane.addWidget(self.queueLimit, 6, 1, 1, 1)
+        self.rtaOverloadLabel = QtWidgets.QLabel(preferencesDialog)
+        self.rtaOverloadLabel.setObjectName("rtaOverloadLabel")
+        self.analysisPane.addWidget(self.rtaOverloadLabel, 6, 2, 1, 1)
+        self.rtaOverload = QtWidgets.QComboBox(preferencesDialog)
+        self.rtaOverload.setObjectName("rtaOverload")
+        self.analysisPane.addWidget(self.rtaOverload, 6, 3, 1, 1)
+        self.spectroOverloadLabel = QtWidgets.QLabel(preferencesDialog)
+        self.spectroOverloadLabel.setObjectName("spectroOverloadLabel")
+        self.analysisPane.addWidget(self.spectroOverloadLabel, 6, 4, 1, 1)
+        self.spectroOverload = QtWidgets.QComboBox(preferencesDialog)
+        self.spectroOverload.setObjectName("spectroOverload")
+        self.analysisPane.addWidget(self.spectroOverload, 6, 5, 1, 1)
+        self.vibrationOverloadLabel = QtWidgets.QLabel(preferencesDialog)
+        self.vibrationOverloadLabel.setObjectName("vibrationOverloadLabel")
+        self.analysisPane.addWidget(self.vibrationOverloadLabel, 7, 0, 1, 1)
+        self.vibrationOverload = QtWidgets.QComboBox(preferencesDialog)
+        self.vibrationOverload.setObjectName("vibrationOverload")
+        self.analysisPane.addWidget(self.vibrationOverload, 7, 1, 1, 1)
+        self.analysisThreadsLabel = QtWidgets.QLabel(preferencesDialog)
+        self.analysisThreadsLabel.setObjectName("analysisThreadsLabel")
+        self.analysisPane.addWidget(self.analysisThreadsLabel, 7, 2, 1, 1)
+        self.analysisThreads = QtWidgets.QSpinBox(preferencesDialog)
+        self.analysisThreads.setMinimum(1)
+        self.analysisThreads.setMaximum(16)
+        self.analysisThreads.setProperty("value", 2)
+        self.analysisThreads.setObjectName("analysisThreads")
+        self.analysisPane.addWidget(self.analysisThreads, 7, 3, 1, 1)
+        self.precisionReport = QtWidgets.QLabel(preferencesDialog)
+        self.precisionReport.setWordWrap(True)
+        self.precisionReport.setObjectName("precisionReport")
+        self.analysisPane.addWidget(self.precisionReport, 8, 2, 1, 4)
+        self.integrationFloorLabel = QtWidgets.QLabel(preferencesDialog)
+        self.integrationFloorLabel.setObjectName("integrationFloorLabel")
+        self.analysisPane.addWidget(self.integrationFloorLabel, 8, 0, 1, 1)
+        self.integrationFloor = QtWidgets.QDoubleSpinBox(preferencesDialog)
+        self.integrationFloor.setDecimals(1)
+        self.integrationFloor.setMinimum(0.1)
+        self.integrationFloor.setMaximum(50.0)
+        self.integrationFloor.setSingleStep(0.5)
+        self.integrationFloor.setProperty("value", 2.0)
+        self.integrationFloor.setObjectName("integrationFloor")
+        self.analysisPane.addWidget(self.integrationFloor, 8, 1, 1, 1)
+        self.analysisCacheLabel = QtWidgets.QLabel(preferencesDialog)
+        self.analysisCacheLabel.setObjectName("analysisCacheLabel")
+        self.analysisPane.addWidget(self.analysisCacheLabel, 7, 4, 1, 1)
+        self.analysisCache = QtWidgets.QSpinBox(preferencesDialog)
+        self.analysisCache.setMinimum(1)
+        self.analysisCache.setMaximum(4096)
+        self.analysisCache.setProperty("value", 64)
+        self.analysisCache.setObjectName("analysisCache")
+        self.analysisPane.addWidget(self.analysisCache, 7, 5, 1, 1)
         self.panes.addLayout(self.analysisPane)
         self.recordersPane = QtWidgets.QGridLayout()
         self.recordersPane.setObjectName("recordersPane")
@@ -243,6 +346,7 @@ class Ui_preferencesDialog(object):
         self.deleteRecorderButton.clicked.connect(preferencesDialog.delete_recorder)
         self.clearTarget.clicked.connect(preferencesDialog.clear_target)
         self.loadTarget.clicked.connect(preferencesDialog.load_target)
+        self.benchmarkFFT.clicked.connect(preferencesDialog.benchmark_fft)
         QtCore.QMetaObject.connectSlotsByName(preferencesDialog)
         preferencesDialog.setTabOrder(self.wavSaveDir, self.wavSaveDirPicker)
         preferencesDialog.setTabOrder(self.wavSaveDirPicker, self.xScale)
@@ -252,7 +356,20 @@ class Ui_preferencesDialog(object):
         preferencesDialog.setTabOrder(self.magMin, self.magMax)
         preferencesDialog.setTabOrder(self.magMax, self.freqMin)
         preferencesDialog.setTabOrder(self.freqMin, self.freqMax)
-        preferencesDialog.setTabOrder(self.freqMax, self.recorderIP)
+        preferencesDialog.setTabOrder(self.freqMax, self.fftBackend)
+        preferencesDialog.setTabOrder(self.fftBackend, self.fftWorkers)
+        preferencesDialog.setTabOrder(self.fftWorkers, self.benchmarkFFT)
+        preferencesDialog.setTabOrder(self.benchmarkFFT, self.precision)
+        preferencesDialog.setTabOrder(self.precision, self.analysisTargetFs)
+        preferencesDialog.setTabOrder(self.analysisTargetFs, self.analysisProcesses)
+        preferencesDialog.setTabOrder(self.analysisProcesses, self.queueLimit)
+        preferencesDialog.setTabOrder(self.queueLimit, self.rtaOverload)
+        preferencesDialog.setTabOrder(self.rtaOverload, self.spectroOverload)
+        preferencesDialog.setTabOrder(self.spectroOverload, self.vibrationOverload)
+        preferencesDialog.setTabOrder(self.vibrationOverload, self.analysisThreads)
+        preferencesDialog.setTabOrder(self.analysisThreads, self.analysisCache)
+        preferencesDialog.setTabOrder(self.analysisCache, self.integrationFloor)
+        preferencesDialog.setTabOrder(self.integrationFloor, self.recorderIP)
         preferencesDialog.setTabOrder(self.recorderIP, self.addRecorderButton)
         preferencesDialog.setTabOrder(self.addRecorderButton, self.recorders)
         preferencesDialog.setTabOrder(self.recorders, self.deleteRecorderButton)
@@ -306,6 +423,31 @@ class Ui_preferencesDialog(object):
         self.detrend.setItemText(1, _translate("preferencesDialog", "Constant"))
         self.detrend.setItemText(2, _translate("preferencesDialog", "Linear"))
         self.highpassRTA.setText(_translate("preferencesDialog", "High pass RTA?"))
+        self.fftBackendLabel.setText(_translate("preferencesDialog", "FFT"))
+        self.fftBackend.setItemText(0, _translate("preferencesDialog", "scipy"))
+        self.fftBackend.setItemText(1, _translate("preferencesDialog", "pyfftw"))
+        self.fftWorkersLabel.setText(_translate("preferencesDialog", "Threads"))
+        self.benchmarkFFT.setText(_translate("preferencesDialog", "Find Fastest"))
+        self.precisionLabel.setText(_translate("preferencesDialog", "Precision"))
+        self.precision.setItemText(0, _translate("preferencesDialog", "float64"))
+        self.precision.setItemText(1, _translate("preferencesDialog", "float32"))
+        self.analysisTargetFsLabel.setText(_translate("preferencesDialog", "Analysis Fs"))
+        self.analysisTargetFs.setSuffix(_translate("preferencesDialog", " Hz"))
+        self.analysisProcessesLabel.setText(_translate("preferencesDialog", "Processes"))
+        self.analysisProcesses.setToolTip(_translate("preferencesDialog", "The number of worker processes used to analyse the data, 0 analyses in the application process"))
+        self.queueLimitLabel.setText(_translate("preferencesDialog", "Queue Limit"))
+        self.queueLimit.setToolTip(_translate("preferencesDialog", "The number of events which can be queued for each chart and measurement before the overload policy is applied"))
+        self.rtaOverloadLabel.setText(_translate("preferencesDialog", "RTA Overload"))
+        self.spectroOverloadLabel.setText(_translate("preferencesDialog", "Spectrogram Overload"))
+        self.vibrationOverloadLabel.setText(_translate("preferencesDialog", "Vibration Overload"))
+        self.analysisThreadsLabel.setText(_translate("preferencesDialog", "Chart Threads"))
+        self.analysisThreads.setToolTip(_translate("preferencesDialog", "The number of threads which process the chart events"))
+        self.integrationFloorLabel.setText(_translate("preferencesDialog", "Integration Floor"))
+        self.integrationFloor.setToolTip(_translate("preferencesDialog", "Bins below this frequency are zeroed in the velocity and displacement views"))
+        self.integrationFloor.setSuffix(_translate("preferencesDialog", " Hz"))
+        self.analysisCacheLabel.setText(_translate("preferencesDialog", "Cache Size"))
+        self.analysisCache.setToolTip(_translate("preferencesDialog", "The memory used to cache the filtered data and spectra shared between the charts"))
+        self.analysisCache.setSuffix(_translate("preferencesDialog", " MB"))
         self.recorderIP.setInputMask(_translate("preferencesDialog", "000.000.000.000:00000"))
         self.deleteRecorderButton.setText(_translate("preferencesDialog", "..."))
         self.ipAddressLabel.setText(_translate("preferencesDialog", "Address"))
@@ -0,0 +1,198 @@
+from collections import deque
+
+import numpy as np
+
+from model.accumulators import RunningAverage, ExponentialAverage, MaxQueue, HoldAccumulator, \
+    SpectraRing, CrossSpectrum, AVERAGE_MODE_EXPONENTIAL
+from model.signal import AnalysisConfig, TriAxisSignal
+
+
+def test_sliding_window_matches_full_reduction():
+    rng = np.random.default_rng(0)
+    avg = RunningAverage()
+    peak = MaxQueue()
+    window = deque()
+    for i in range(200):
+        y = rng.normal(size=16) * 20 - 60
+        avg.add(y)
+        peak.add(y)
+        window.append(y)
+        # evict a variable number to exercise both stacks
+        while len(window) > 1 and (len(window) > 25 or rng.random() < 0.1):
+            window.popleft()
+            avg.evict()
+            peak.evict()
+        assert len(avg) == len(peak) == len(window)
+        np.testing.assert_allclose(avg.value, np.average(window, axis=0))
+        np.testing.assert_array_equal(peak.value, np.maximum.reduce(window))
+
+
+def test_empty_accumulators_have_no_value():
+    avg = RunningAverage()
+    peak = MaxQueue()
+    for a in [avg, peak]:
+        assert a.value is None
+        a.add(np.ones(4))
+        a.evict()
+        assert a.value is None
+
+
+def test_exponential_average():
+    avg = ExponentialAverage(0.25)
+    avg.add(np.zeros(3))
+    avg.add(np.full(3, 4.0))
+    np.testing.assert_allclose(avg.value, np.ones(3))
+    avg.add(np.full(3, 5.0))
+    np.testing.assert_allclose(avg.value, np.full(3, 2.0))
+    assert ExponentialAverage.alpha_for(0, 0.1) == 1.0
+    assert 0 < ExponentialAverage.alpha_for(10.0, 0.1) < 0.01
+
+
+def make_signals(count, nperseg=512, fs=500):
+    config = AnalysisConfig('constant', None, None, (1.0, 1.0, 1.0), False, 'scipy', 1, np.dtype(np.float64), 3,
+                            (1, 125), 8, 2.0)
+    rng = np.random.default_rng(1)
+    signals = []
+    for i in range(count):
+        data = np.zeros((nperseg, 5))
+        data[:, 0] = np.arange(nperseg) + i
+        data[:, 2:] = rng.normal(size=(nperseg, 3))
+        signals.append(TriAxisSignal(config, 'm', data, fs, 0, idx=i, mode='', pre_calc=True, view_mode='avg'))
+    return signals
+
+
+def test_hold_accumulator_tracks_cache():
+    signals = make_signals(6)
+    acc = HoldAccumulator('avg', 512, capacity=2)
+    for s in signals[0:5]:
+        acc.add(s)
+    acc.evict()
+    acc.evict()
+    assert len(acc) == 3
+    # 4 axes of 8 float32 rows after growing twice
+    assert acc.nbytes == 4 * 8 * 257 * 4
+    for axis in ['x', 'sum']:
+        ys = [getattr(s, axis).get_analysis('avg').y for s in signals[2:5]]
+        np.testing.assert_allclose(acc.average(axis), np.average(ys, axis=0), rtol=1e-6)
+        np.testing.assert_allclose(acc.peak(axis), np.maximum.reduce(ys), rtol=1e-6)
+
+
+def test_hold_accumulator_defers_unanalysed_signals():
+    signals = make_signals(3)
+    acc = HoldAccumulator('peak', 512)
+    for s in signals:
+        acc.add(s)
+    assert len(acc) == 0
+    assert acc.pending == signals
+    # 1 per sample
+    acc.purge(1.5)
+    assert acc.pending == signals[1:]
+    acc.accumulate(lambda s: s.set_view('peak'))
+    assert len(acc) == 2
+    assert acc.pending == []
+    ys = [s.z.get_analysis('peak').y for s in signals[1:]]
+    np.testing.assert_allclose(acc.peak('z'), np.maximum.reduce(ys), rtol=1e-6)
+
+
+def test_hold_accumulator_excludes_short_signals():
+    short = make_signals(1, nperseg=256)[0]
+    signals = make_signals(2)
+    acc = HoldAccumulator('avg', 512)
+    acc.add(short)
+    acc.add(signals[0])
+    assert acc.average('x') is None
+    assert acc.peak('x') is None
+    acc.evict()
+    acc.add(signals[1])
+    acc.set_average_mode(AVERAGE_MODE_EXPONENTIAL, 0.5)
+    expected = 0.5 * (signals[0].x.get_analysis('avg').y + signals[1].x.get_analysis('avg').y)
+    np.testing.assert_allclose(acc.average('x'), expected, rtol=1e-6)
+
+
+def test_spectra_ring_grows():
+    ring = SpectraRing(3, capacity=2)
+    for i in range(3):
+        ring.append(np.full(3, i))
+    ring.evict()
+    ring.append(np.full(3, 3))
+    ring.append(np.full(3, 4))
+    assert len(ring) == 4
+    assert ring.nbytes == 4 * 3 * 4
+    assert [r[0] for r in ring] == [1, 2, 3, 4]
+
+
+def test_hold_accumulator_results_are_reused_until_changed():
+    signals = make_signals(2)
+    acc = HoldAccumulator('avg', 512)
+    acc.add(signals[0])
+    avg = acc.average('x')
+    assert acc.average('x') is avg
+    assert acc.peak('x') is acc.peak('x')
+    acc.add(signals[1])
+    assert acc.average('x') is not avg
+
+
+def test_cross_spectrum_matches_scipy():
+    from scipy import signal
+    config = AnalysisConfig('constant', None, None, (1.0, 1.0, 1.0), False, 'scipy', 1, np.dtype(np.float64), 3,
+                            (1, 125), 8, 2.0)
+    rng = np.random.default_rng(2)
+    n = 1024
+    cross = CrossSpectrum('in', 'out', n)
+    inputs = []
+    outputs = []
+    for i in range(3):
+        source = np.zeros((n, 5))
+        source[:, 0] = np.arange(n) + i * n
+        source[:, 2:] = rng.normal(size=(n, 3))
+        response = source.copy()
+        # x is amplified, y is inverted with some noise and z is unrelated
+        response[:, 2] = 2.0 * source[:, 2]
+        response[:, 3] = -source[:, 3] + rng.normal(scale=0.5, size=n)
+        response[:, 4] = rng.normal(size=n)
+        inputs.append(source)
+        outputs.append(response)
+        # a signal from the input alone does not complete a pair
+        assert cross.add(TriAxisSignal(config, 'in', source, 500, 0, mode='', view_mode='transfer')) is False
+        assert cross.add(TriAxisSignal(config, 'other', response, 500, 0, mode='', view_mode='transfer')) is False
+        assert cross.add(TriAxisSignal(config, 'out', response, 500, 0, mode='', view_mode='transfer')) is True
+    cross.purge(1500)
+    assert len(cross) == 2
+    np.testing.assert_allclose(np.abs(cross.transfer_function('x')[1:]), 2.0)
+    assert np.all(cross.coherence('x')[1:] > 0.999)
+    h1 = cross.transfer_function('y')
+    assert np.median(np.abs(np.angle(h1[1:], deg=True))) > 170
+    assert np.median(cross.coherence('z')) < 0.5
+    # the average of the retained pairs matches scipy over the same data
+    x = np.concatenate([np.atleast_2d(i[:, 3]) for i in inputs[1:]], axis=0)
+    y = np.concatenate([np.atleast_2d(o[:, 3]) for o in outputs[1:]], axis=0)
+    _, Pxy = signal.csd(x, y, fs=500, nperseg=512, scaling='spectrum', axis=-1)
+    _, Pxx = signal.welch(x, fs=500, nperseg=512, scaling='spectrum', axis=-1)
+    np.testing.assert_allclose(h1, Pxy.mean(axis=0) / Pxx.mean(axis=0), rtol=1e-6)
+
+
+def test_cross_spectrum_only_pairs_overlapping_signals():
+    config = AnalysisConfig('constant', None, None, (1.0, 1.0, 1.0), False, 'scipy', 1, np.dtype(np.float64), 3,
+                            (1, 125), 8, 2.0)
+    rng = np.random.default_rng(3)
+    n = 1024
+    cross = CrossSpectrum('in', 'out', n)
+
+    def make_signal(name, start):
+        data = np.zeros((n, 5))
+        data[:, 0] = np.arange(n) + start
+        data[:, 2:] = rng.normal(size=(n, 3))
+        return TriAxisSignal(config, name, data, 500, 0, mode='', view_mode='transfer')
+
+    # the stale output is discarded as it ends before the input starts
+    assert cross.add(make_signal('out', 0)) is False
+    assert cross.add(make_signal('in', 2 * n)) is False
+    assert len(cross) == 0
+    # the input is held until an output which overlaps it arrives
+    assert cross.add(make_signal('out', 2 * n + 100)) is True
+    assert len(cross) == 1
+    # an input which starts after the held output ends discards it
+    assert cross.add(make_signal('out', 4 * n)) is False
+    assert cross.add(make_signal('in', 6 * n)) is False
+    assert cross.add(make_signal('in', 4 * n + 10)) is False
+    assert len(cross) == 1
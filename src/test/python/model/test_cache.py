@@ -0,0 +1,78 @@
+import threading
+import time
+
+import numpy as np
+from qtpy.QtCore import QSettings
+
+from model.cache import AnalysisCache, get_analysis_cache
+from model.preferences import Preferences
+from model.signal import TriAxisSignal
+
+
+def test_evicts_least_recently_used_within_budget():
+    cache = AnalysisCache(max_bytes=3 * 800)
+    for i in range(3):
+        cache.get(i, lambda: np.zeros(100))
+    # touch the oldest so the 2nd is evicted next
+    cache.get(0, lambda: None)
+    cache.get(3, lambda: np.zeros(100))
+    assert 0 in cache and 1 not in cache and 2 in cache and 3 in cache
+    assert cache.nbytes == 3 * 800
+    assert cache.hits == 1 and cache.misses == 4
+    # too big to hold
+    cache.get(4, lambda: np.zeros(1000))
+    assert 4 not in cache and len(cache) == 3
+
+
+def test_concurrent_requests_compute_once():
+    cache = AnalysisCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return np.ones(10)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('k', compute))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+
+
+def test_failed_computation_is_not_cached():
+    cache = AnalysisCache()
+
+    def fail():
+        raise ValueError()
+
+    try:
+        cache.get('k', fail)
+    except ValueError:
+        pass
+    assert cache.get('k', lambda: np.ones(1))[0] == 1.0
+
+
+def test_shared_signals_reuse_stft(tmp_path):
+    config = Preferences(QSettings(str(tmp_path / 'qvibe.ini'), QSettings.IniFormat)).analysis_config
+    rng = np.random.default_rng(0)
+    data = np.zeros((1024, 5))
+    data[:, 0] = np.arange(1024)
+    data[:, 2:] = rng.normal(size=(1024, 3))
+    get_analysis_cache().clear()
+    rta = TriAxisSignal(config, 'm', data, 500, 0, mode='vibration', view_mode='peak', pre_calc=True, shared=True)
+    misses = get_analysis_cache().misses
+    spectro = TriAxisSignal(config, 'm', data.copy(), 500, 0, mode='vibration', view_mode='spectrogram',
+                            pre_calc=True, shared=True)
+    # the peak and spectrogram views use the same window so the filtered data and STFT are both reused
+    assert get_analysis_cache().misses == misses
+    assert spectro.x.data is rta.x.data
+    local = TriAxisSignal(config, 'm', data, 500, 0, mode='vibration', view_mode='spectrogram', pre_calc=True)
+    np.testing.assert_array_equal(local.x.get_analysis().sxx, spectro.x.get_analysis().sxx)
+    # different data over the same sample range is not confused with the cached data
+    data[:, 2] += 1.0
+    other = TriAxisSignal(config, 'm', data, 500, 0, mode='vibration', view_mode='peak', pre_calc=True, shared=True)
+    assert other.x.data is not rta.x.data
@@ -0,0 +1,166 @@
+import threading
+import time
+
+from model.charts import ChartScheduler, ChunkedChartEvent, PRIORITY_VISIBLE, PRIORITY_HIDDEN_CHART, \
+    OVERLOAD_DROP_OLDEST, OVERLOAD_COALESCE, OVERLOAD_MERGE, get_chart_scheduler, configure_chart_scheduler
+
+
+class FakeChart:
+
+    def __init__(self, priority, overload_policy=OVERLOAD_DROP_OLDEST, queue_limit=10, max_merged_chunks=5):
+        self.overload_policy = overload_policy
+        self.queue_limit = queue_limit
+        self.max_merged_chunks = max_merged_chunks
+        self.__priority = priority
+
+    def priority(self, measurement_name):
+        return self.__priority
+
+
+class FakeEvent(ChunkedChartEvent):
+
+    def __init__(self, chart, measurement_name, idx, executed, gate=None):
+        super().__init__(chart, measurement_name, [idx], idx, None, 1000)
+        self.__executed = executed
+        self.__gate = gate
+
+    def execute(self):
+        if self.__gate is not None:
+            self.__gate.wait(10)
+        self.__executed.append((self.chart, self.measurement_name, self.idx, self.input))
+
+
+def wait_for(predicate):
+    end = time.time() + 10
+    while not predicate() and time.time() < end:
+        time.sleep(0.01)
+    assert predicate()
+
+
+def test_visible_chart_first_and_lanes_in_order():
+    scheduler = ChartScheduler(1)
+    executed = []
+    gate = threading.Event()
+    visible = FakeChart(PRIORITY_VISIBLE)
+    hidden = FakeChart(PRIORITY_HIDDEN_CHART)
+    try:
+        # block the only worker so the queue builds up
+        scheduler.submit(FakeEvent(hidden, 'block', 0, executed, gate=gate))
+        wait_for(lambda: scheduler.depth == 0)
+        for i in range(3):
+            scheduler.submit(FakeEvent(hidden, 'm', i, executed))
+            scheduler.submit(FakeEvent(visible, 'm', i, executed))
+        assert scheduler.depth == 6
+        gate.set()
+        wait_for(lambda: len(executed) == 7)
+    finally:
+        scheduler.stop()
+    assert [(c is visible, i) for c, _, i, _ in executed[1:]] == [(True, 0), (True, 1), (True, 2),
+                                                              (False, 0), (False, 1), (False, 2)]
+    metrics = scheduler.take_metrics()
+    assert metrics.processed == 7 and metrics.depth == 0 and metrics.max_wait_millis > 0
+
+
+def overload(chart, events):
+    scheduler = ChartScheduler(1)
+    executed = []
+    gate = threading.Event()
+    try:
+        scheduler.submit(FakeEvent(FakeChart(PRIORITY_VISIBLE), 'block', 0, executed, gate=gate))
+        wait_for(lambda: scheduler.depth == 0)
+        for i in range(events):
+            scheduler.submit(FakeEvent(chart, 'a', i, executed))
+            scheduler.submit(FakeEvent(chart, 'b', i, executed))
+        counters = scheduler.counters(chart)
+        gate.set()
+        wait_for(lambda: scheduler.depth == 0 and scheduler.counters(chart)['queued'] == 0)
+        time.sleep(0.1)
+    finally:
+        scheduler.stop()
+    return sorted((m, i, chunks) for _, m, i, chunks in executed[1:]), counters
+
+
+def test_coalescing_chart_processes_the_latest_event():
+    executed, counters = overload(FakeChart(PRIORITY_VISIBLE, overload_policy=OVERLOAD_COALESCE), 5)
+    assert executed == [('a', 4, [4]), ('b', 4, [4])]
+    assert counters['coalesced'] == 8 and counters['queued'] == 2
+
+
+def test_queue_is_bounded_by_dropping_the_oldest_events():
+    executed, counters = overload(FakeChart(PRIORITY_VISIBLE, queue_limit=3), 10)
+    assert executed == [(m, i, [i]) for m in ['a', 'b'] for i in [7, 8, 9]]
+    assert counters['dropped'] == 14 and counters['queued'] == 6
+
+
+def test_merged_events_keep_the_latest_chunks():
+    executed, counters = overload(FakeChart(PRIORITY_VISIBLE, overload_policy=OVERLOAD_MERGE, queue_limit=3), 10)
+    # the queue is merged each time it overflows (the 4th, 7th and 10th events), keeping only the latest chunks
+    assert executed == [('a', 9, [5, 6, 7, 8, 9]), ('b', 9, [5, 6, 7, 8, 9])]
+    assert counters['merged'] == 18 and counters['discarded chunks'] == 10 and counters['queued'] == 2
+
+
+def test_stopped_scheduler_is_not_recreated():
+    assert configure_chart_scheduler(1).threads == 1
+    assert get_chart_scheduler() is not None
+    assert configure_chart_scheduler(0) is None
+    assert get_chart_scheduler() is None
+    assert configure_chart_scheduler(2).threads == 2
+    assert get_chart_scheduler().threads == 2
+    configure_chart_scheduler(0)
+
+
+class DeferredEvent(ChunkedChartEvent):
+    ''' Hands itself off, like an event analysed in the analysis pool, and completes when the test says so. '''
+
+    def __init__(self, chart, measurement_name, idx, executed, deferred):
+        super().__init__(chart, measurement_name, [idx], idx, None, 1000)
+        self.__executed = executed
+        self.__deferred = deferred
+
+    def execute(self):
+        self.__executed.append((self.measurement_name, self.idx))
+        self.__deferred.append(self)
+        return True
+
+
+def test_lane_is_held_until_a_deferred_event_completes():
+    scheduler = ChartScheduler(2)
+    executed = []
+    deferred = []
+    chart = FakeChart(PRIORITY_VISIBLE)
+    try:
+        for i in range(2):
+            scheduler.submit(DeferredEvent(chart, 'a', i, executed, deferred))
+        scheduler.submit(DeferredEvent(chart, 'b', 0, executed, deferred))
+        wait_for(lambda: len(executed) == 2)
+        time.sleep(0.1)
+        # the 2nd event for a waits for the 1st to complete, b is not held up by a
+        assert sorted(executed) == [('a', 0), ('b', 0)]
+        assert scheduler.counters(chart)['queued'] == 1
+        next(e for e in deferred if e.measurement_name == 'a').complete(None)
+        wait_for(lambda: len(executed) == 3)
+        assert executed[-1] == ('a', 1)
+    finally:
+        scheduler.stop()
+
+
+def test_queue_limit_applies_while_a_deferred_event_is_in_flight():
+    scheduler = ChartScheduler(1)
+    executed = []
+    deferred = []
+    chart = FakeChart(PRIORITY_VISIBLE, queue_limit=2)
+    try:
+        scheduler.submit(DeferredEvent(chart, 'a', 0, executed, deferred))
+        wait_for(lambda: len(executed) == 1)
+        for i in range(1, 10):
+            scheduler.submit(DeferredEvent(chart, 'a', i, executed, deferred))
+        counters = scheduler.counters(chart)
+        # the pool backlog is bounded by the lane rather than growing with every event
+        assert counters['in flight'] == 1 and counters['queued'] == 2 and counters['dropped'] == 7
+        for i in range(3):
+            deferred[i].complete(None)
+            wait_for(lambda: len(executed) == min(i + 2, 3))
+        assert executed == [('a', 0), ('a', 8), ('a', 9)]
+        wait_for(lambda: scheduler.counters(chart)['in flight'] == 0)
+    finally:
+        scheduler.stop()
@@ -0,0 +1,60 @@
+import numpy as np
+
+from model.decimation import Decimator, get_decimation_factors, get_analysis_fs, get_anti_alias_filter
+
+
+def make_rows(fs, seconds):
+    n = fs * seconds
+    t = np.arange(n)
+    data = np.zeros((n, 5))
+    data[:, 0] = t + 100
+    data[:, 1] = t * 2
+    data[:, 2] = np.sin(2 * np.pi * 20 * t / fs) + 1.0
+    data[:, 3] = np.sin(2 * np.pi * 450 * t / fs)
+    data[:, 4] = np.random.default_rng(0).normal(size=n)
+    return data
+
+
+def test_decimation_factors():
+    assert get_decimation_factors(1000, 200) == (5,)
+    assert get_decimation_factors(1000, 100) == (5, 2)
+    assert get_decimation_factors(1000, 250) == (2, 2)
+    assert get_decimation_factors(500, 1000) == ()
+    assert get_analysis_fs(1000, 100) == 100
+    assert get_analysis_fs(500, 1000) == 500
+    assert get_anti_alias_filter(5) is get_anti_alias_filter(5)
+
+
+def test_no_decimation_passes_through():
+    data = make_rows(500, 1)
+    decimator = Decimator(500, 1000)
+    assert decimator.factor == 1
+    assert decimator.process(data) is data
+
+
+def test_streaming_matches_one_shot():
+    data = make_rows(1000, 5)
+    one_shot = Decimator(1000, 100).process(data.copy())
+    decimator = Decimator(1000, 100)
+    chunks = [decimator.process(c) for c in np.array_split(data, [7, 8, 300, 1234, 1235, 2000, 4990])]
+    streamed = np.concatenate(chunks)
+    np.testing.assert_array_equal(streamed, one_shot)
+    # the idx counts samples at the output rate and the unfiltered columns are taken from the matching input row
+    np.testing.assert_array_equal(np.diff(streamed[:, 0]), 1)
+    assert streamed[0, 0] == 10
+    np.testing.assert_array_equal(streamed[:, 1], (streamed[:, 0] * 10 - 100) * 2)
+
+
+def test_filters_alias_and_keeps_passband():
+    data = make_rows(1000, 5)
+    decimated = Decimator(1000, 100).process(data)
+    t = decimated[:, 1] / 2
+    # the start of the signal is extended back in time as a constant so skip the start up transient
+    steady = slice(20, None)
+    # 450Hz would alias to 50Hz
+    assert np.abs(decimated[steady, 3]).max() < 1e-6
+    np.testing.assert_allclose(decimated[steady, 2], np.sin(2 * np.pi * 20 * t[steady] / 1000) + 1.0, atol=1e-3)
+    # a DC offset causes no transient
+    dc = np.full((1000, 5), 3.0)
+    dc[:, 0] = np.arange(1000)
+    np.testing.assert_allclose(Decimator(1000, 100).process(dc)[:, 2:], 3.0)
@@ -0,0 +1,41 @@
+import numpy as np
+
+from model.fft import get_fft, benchmark_fft, available_fft_backends, FFT_BACKEND_SCIPY, FFT_BACKEND_PYFFTW
+
+
+def test_backends_match_numpy():
+    data = np.random.default_rng(0).random(size=(4, 256))
+    for name in available_fft_backends():
+        for workers in [1, 2]:
+            np.testing.assert_allclose(get_fft(name, workers).rfft(data), np.fft.rfft(data, axis=-1), atol=1e-10)
+            cdata = data + 1j * data[::-1]
+            np.testing.assert_allclose(get_fft(name, workers).fft(cdata), np.fft.fft(cdata, axis=-1), atol=1e-10)
+
+
+def test_backends_are_shared():
+    assert get_fft(FFT_BACKEND_SCIPY, 2) is get_fft(FFT_BACKEND_SCIPY, 2)
+    assert get_fft(FFT_BACKEND_SCIPY, 1) is not get_fft(FFT_BACKEND_SCIPY, 2)
+
+
+def test_unknown_or_missing_backend_falls_back_to_scipy():
+    assert get_fft(None).name == FFT_BACKEND_SCIPY
+    if FFT_BACKEND_PYFFTW not in available_fft_backends():
+        assert get_fft(FFT_BACKEND_PYFFTW).name == FFT_BACKEND_SCIPY
+
+
+def test_benchmark_picks_an_available_backend():
+    name, workers = benchmark_fft(nperseg=64, segments=2, repeats=2)
+    assert name in available_fft_backends()
+    assert workers >= 1
+
+
+def test_backends_can_be_used_concurrently():
+    from concurrent.futures import ThreadPoolExecutor
+    rng = np.random.default_rng(1)
+    batches = [rng.random(size=(4, 256)) for _ in range(16)]
+    for name in available_fft_backends():
+        fft = get_fft(name)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(fft.rfft, batches))
+        for data, result in zip(batches, results):
+            np.testing.assert_allclose(result, np.fft.rfft(data, axis=-1), atol=1e-10)
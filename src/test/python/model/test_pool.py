@@ -0,0 +1,74 @@
+import threading
+
+import numpy as np
+from qtpy.QtCore import QSettings
+
+from model.pool import AnalysisJob, AnalysisPool, pack, unpack, SLOT_BYTES
+from model.preferences import Preferences
+from model.signal import TriAxisSignal
+
+
+def make_config(tmp_path):
+    return Preferences(QSettings(str(tmp_path / 'qvibe.ini'), QSettings.IniFormat)).analysis_config
+
+
+def make_chunks(count, n=1024, fs=500):
+    rng = np.random.default_rng(0)
+    chunks = []
+    for i in range(count):
+        t = np.arange(n) + i * n
+        chunk = np.zeros((n, 5))
+        chunk[:, 0] = t
+        chunk[:, 2] = np.sin(2 * np.pi * 20 * t / fs)
+        chunk[:, 3] = np.sin(2 * np.pi * 40 * t / fs)
+        chunk[:, 4] = rng.normal(scale=0.1, size=n)
+        chunks.append(chunk)
+    return chunks
+
+
+def test_pack_round_trip():
+    buffer = np.zeros(1024, dtype=np.uint8)
+    arrays = [np.arange(10, dtype=np.float64), np.ones((3, 5), dtype=np.float32), np.arange(3, dtype=np.int16)]
+    descriptors = pack(buffer, arrays)
+    assert all(d[0] % 8 == 0 for d in descriptors)
+    for a, b in zip(arrays, unpack(buffer, descriptors)):
+        assert a.dtype == b.dtype
+        np.testing.assert_array_equal(a, b)
+    assert pack(buffer, [np.zeros(200)]) is None
+
+
+def test_pool_matches_local_analysis_in_order(tmp_path):
+    config = make_config(tmp_path)
+    pool = AnalysisPool(2)
+    received = {}
+    done = threading.Event()
+    jobs = [('a', i, 'avg') for i in range(4)] + [('b', i, 'spectrogram') for i in range(4)]
+
+    def on_complete(name, signals):
+        received.setdefault(name, []).append(signals)
+        if sum(len(v) for v in received.values()) == len(jobs):
+            done.set()
+
+    try:
+        for name, idx, view in jobs:
+            job = AnalysisJob(config, name, 500, 0, idx, 'vibration', view, make_chunks(2))
+            pool.submit(job, lambda signals, name=name: on_complete(name, signals))
+        # a chunk which does not fit in a slot is pickled instead
+        big = make_chunks(1, n=SLOT_BYTES // 32)
+        big_done = threading.Event()
+        big_result = []
+        pool.submit(AnalysisJob(config, 'c', 500, 0, 0, '', 'avg', big),
+                    lambda signals: (big_result.extend(signals), big_done.set()))
+        assert done.wait(60) and big_done.wait(60)
+    finally:
+        pool.shutdown()
+    assert [s[0].idx for s in received['a']] == [0, 1, 2, 3]
+    assert [s[0].idx for s in received['b']] == [0, 1, 2, 3]
+    chunk = make_chunks(2)[1]
+    local = TriAxisSignal(config, 'a', chunk, 500, 0, mode='vibration', view_mode='avg', pre_calc=True)
+    remote = received['a'][0][1]
+    for axis in ['x', 'y', 'z', 'sum']:
+        np.testing.assert_allclose(getattr(remote, axis).get_analysis().y, getattr(local, axis).get_analysis().y)
+    local = TriAxisSignal(config, 'b', chunk, 500, 0, mode='vibration', view_mode='spectrogram', pre_calc=True)
+    np.testing.assert_allclose(received['b'][0][1].x.get_analysis().sxx, local.x.get_analysis().sxx)
+    assert big_result[0].x.get_analysis().x.size == 257
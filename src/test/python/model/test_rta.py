@@ -1,6 +1,7 @@
 import numpy as np
 
-from model.rta import ChunkCalculator
+from model.rta import ChunkCalculator, Normalisation, CurveAwareLabel, ALL_CURVES, downsample_peaks, \
+    get_display_grid
 
 min_nperseg = 512
 stride = 25
@@ -105,3 +106,70 @@ def test_next_data_is_many_chunks():
     assert chunks[2][:, 0][-1] == stride * 3 - 1 + min_nperseg
     assert 'test' in cc.last_idx
     assert cc.last_idx['test'] == stride * 3 - 1 + min_nperseg
+
+
+def test_downsample_peaks_keeps_the_max_in_each_pixel():
+    x = np.linspace(0, 250, 8193)
+    y = np.random.default_rng(0).normal(size=x.size)
+    y[5000] = 10.0
+    y[6000] = np.nan
+    edges = get_display_grid(np.log10(10.0), np.log10(200.0), 300, True)
+    assert edges is get_display_grid(np.log10(10.0), np.log10(200.0), 300, True)
+    np.testing.assert_allclose(edges[[0, -1]], [10.0, 200.0])
+    dx, dy = downsample_peaks(x, y, edges)
+    assert dx.size <= 302
+    assert np.all(np.diff(dx) > 0)
+    # the curve extends beyond the visible range
+    assert dx[0] < 10.0 and dx[-1] > 200.0
+    assert dy[np.argmin(np.abs(dx - x[5000]))] == 10.0
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        in_pixel = (x >= lo) & (x < hi)
+        if np.any(in_pixel) and not np.any(np.isnan(y[in_pixel])):
+            assert np.nanmax(dy[(dx >= lo) & (dx < hi)]) == np.max(y[in_pixel])
+    # a curve with fewer points than pixels is untouched
+    few_x, few_y = x[:100], y[:100]
+    sx, sy = downsample_peaks(few_x, few_y, get_display_grid(0.0, 3.0, 300, False))
+    assert sx is few_x and sy is few_y
+
+
+def test_normalisation_interpolates_onto_the_finer_grid():
+    rng = np.random.default_rng(0)
+    ref_x = np.linspace(0, 250, 513)
+    ref_y = rng.normal(size=ref_x.size)
+    data_x = np.linspace(0, 200, 1639)
+    data_y = rng.normal(size=data_x.size)
+    x, y = Normalisation(ref_x, data_x).apply(ref_y, data_y)
+    np.testing.assert_array_equal(x, data_x)
+    np.testing.assert_allclose(y, data_y - np.interp(data_x, ref_x, ref_y))
+    # the data is coarser so it is interpolated onto the ref grid within the range of the data
+    x, y = Normalisation(data_x, ref_x).apply(data_y, ref_y)
+    np.testing.assert_array_equal(x, data_x)
+    np.testing.assert_allclose(y, np.interp(data_x, ref_x, ref_y) - data_y)
+    x, y = Normalisation(ref_x, ref_x).apply(ref_y, data_y[:ref_x.size])
+    np.testing.assert_allclose(y, data_y[:ref_x.size] - ref_y)
+
+
+def test_normalisation_grid_key_identifies_the_grid_by_its_contents():
+    linear = np.linspace(1, 250, 64)
+    curved = linear.copy()
+    curved[2:-1] = np.geomspace(curved[2], 250, curved.size - 2)[:-1]
+    # same size and end points
+    assert Normalisation.grid_key(linear) != Normalisation.grid_key(curved)
+    assert Normalisation.grid_key(linear) == Normalisation.grid_key(np.linspace(1, 250, 64))
+    assert Normalisation.grid_key(linear) != Normalisation.grid_key(linear.astype(np.float32))
+
+
+def test_readout_shows_the_value_at_or_above_the_frequency():
+    curves = {'a:x': (np.arange(0.0, 100.0, 0.5), np.arange(200.0)), 'b:x': (np.arange(0.0, 10.0), np.arange(10.0))}
+    label = CurveAwareLabel(lambda: curves)
+    assert label.format(20.2) == '[20.2 Hz]'
+    label.curve = 'a:x'
+    assert label.shows('a:x') and not label.shows('b:x')
+    assert label.format(20.2).startswith('[20.2 Hz / 41.0 dB / ')
+    label.curve = ALL_CURVES
+    assert label.shows('b:x')
+    lines = label.format(5.0).split('\n')
+    assert lines[0] == '[5.0 Hz]'
+    assert lines[1].startswith('a:x: 10.0 dB') and lines[2].startswith('b:x: 5.0 dB')
+    # beyond the end of a curve
+    assert len(label.format(50.0).split('\n')) == 2
@@ -0,0 +1,281 @@
+import numpy as np
+from qtpy.QtCore import QSettings
+
+from model.preferences import Preferences, ANALYSIS_DETREND, ANALYSIS_PEAK_WINDOW, SUM_Y_SCALE, BUFFER_SIZE, \
+    RTA_BAND_FRACTION, RTA_ZOOM_FACTOR
+from model.signal import AnalysisConfig, TriAxisSignal
+
+
+def make_prefs(tmp_path):
+    return Preferences(QSettings(str(tmp_path / 'qvibe.ini'), QSettings.IniFormat))
+
+
+def make_data(fs=500, seconds=2):
+    rng = np.random.default_rng(0)
+    n = fs * seconds
+    t = np.arange(n)
+    data = np.zeros((n, 5))
+    data[:, 0] = t
+    data[:, 2] = np.sin(2 * np.pi * 20 * t / fs) + rng.normal(scale=0.01, size=n)
+    data[:, 3] = np.sin(2 * np.pi * 40 * t / fs) + rng.normal(scale=0.01, size=n)
+    data[:, 4] = rng.normal(scale=0.1, size=n)
+    return data
+
+
+def test_config_from_preferences(tmp_path):
+    prefs = make_prefs(tmp_path)
+    prefs.set(ANALYSIS_DETREND, 'none')
+    prefs.set(ANALYSIS_PEAK_WINDOW, 'tukey')
+    config = AnalysisConfig.from_preferences(prefs)
+    assert config.detrend is False
+    assert config.avg_window is None
+    assert config.peak_window == ('tukey', 0.25)
+    assert config.sum_scales == (2.2, 2.4, 1.0)
+    assert config.hpf_rta is False
+    assert config.band_fraction == 3
+    assert config.zoom_factor == 8
+    prefs.set(RTA_BAND_FRACTION, 12)
+    prefs.set(RTA_ZOOM_FACTOR, 16)
+    config = prefs.analysis_config
+    assert config.band_fraction == 12
+    assert config.zoom_factor == 16
+
+
+def test_config_is_cached_until_analysis_preference_changes(tmp_path):
+    prefs = make_prefs(tmp_path)
+    config = prefs.analysis_config
+    assert prefs.analysis_config is config
+    prefs.set(BUFFER_SIZE, 60)
+    assert prefs.analysis_config is config
+    prefs.set(SUM_Y_SCALE, 1.5)
+    updated = prefs.analysis_config
+    assert updated is not config
+    assert updated.sum_scales == (2.2, 1.5, 1.0)
+
+
+def test_signal_uses_config(tmp_path):
+    config = make_prefs(tmp_path).analysis_config
+    tas = TriAxisSignal(config, 'test', make_data(), 500, 0, mode='vibration', pre_calc=True, view_mode='avg')
+    avg = tas.x.get_analysis('avg')
+    assert avg.x.shape == avg.y.shape
+    assert abs(avg.x[np.argmax(avg.y)] - 20.0) < 1.0
+    assert tas.sum.get_analysis('avg') is not None
+
+
+def test_views_match_scipy(tmp_path):
+    from scipy import signal
+    from model.signal import ADJUST_BY_3DB, REF_ACCELERATION_IN_G, amplitude_to_db, power_to_db
+    config = make_prefs(tmp_path).analysis_config
+    data = make_data(seconds=4)
+    tas = TriAxisSignal(config, 'test', data, 500, 0, mode='', view_mode='avg')
+    x = data[:, 2]
+    ref = ADJUST_BY_3DB * REF_ACCELERATION_IN_G
+
+    f, Pxx = signal.welch(x, 500, nperseg=512, scaling='spectrum', detrend='constant', window='hann')
+    avg = tas.x.get_analysis('avg')
+    np.testing.assert_allclose(avg.x, f)
+    np.testing.assert_allclose(avg.y_raw, Pxx)
+    np.testing.assert_allclose(avg.y, amplitude_to_db(np.sqrt(Pxx), ref), atol=1e-8)
+
+    f, Pxx_den = signal.welch(x, 500, nperseg=512, detrend='constant', window='hann')
+    tas.x.set_view('psd')
+    psd = tas.x.get_analysis()
+    np.testing.assert_allclose(psd.y_raw, Pxx_den)
+    np.testing.assert_allclose(psd.y, power_to_db(np.sqrt(Pxx_den), REF_ACCELERATION_IN_G), atol=1e-8)
+
+    f, t, Sxx = signal.spectrogram(x, 500, window=('tukey', 0.25), nperseg=512, noverlap=256, detrend='constant',
+                                   scaling='spectrum')
+    tas.x.set_view('peak')
+    peak = tas.x.get_analysis()
+    np.testing.assert_allclose(peak.y_raw, np.sqrt(Sxx.max(axis=-1)))
+    tas.x.set_view('spectrogram')
+    spectro = tas.x.get_analysis()
+    np.testing.assert_allclose(spectro.t, t)
+    np.testing.assert_allclose(spectro.sxx, amplitude_to_db(np.sqrt(Sxx), ref), atol=1e-8)
+
+
+def test_views_share_a_single_stft(tmp_path, monkeypatch):
+    import model.signal
+    config = make_prefs(tmp_path).analysis_config
+    tas = TriAxisSignal(config, 'test', make_data(), 500, 0, mode='', view_mode='avg')
+    calls = []
+    original = model.signal.STFT
+
+    def counting_stft(*args, **kwargs):
+        calls.append(args[3])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(model.signal, 'STFT', counting_stft)
+    for view in ['avg', 'psd', 'peak', 'spectrogram', 'avg']:
+        tas.x.set_view(view)
+    assert calls == ['hann', ('tukey', 0.25)]
+
+
+def test_segment_ffts_are_only_kept_for_the_transfer_view(tmp_path, monkeypatch):
+    import model.signal
+    config = make_prefs(tmp_path).analysis_config
+    tas = TriAxisSignal(config, 'test', make_data(), 500, 0, mode='', view_mode='avg')
+    stfts = []
+    original = model.signal.STFT
+
+    def recording_stft(*args, **kwargs):
+        stfts.append(original(*args, **kwargs))
+        return stfts[-1]
+
+    monkeypatch.setattr(model.signal, 'STFT', recording_stft)
+    for view in ['avg', 'psd', 'peak', 'spectrogram']:
+        tas.x.set_view(view)
+    assert len(stfts) == 2 and all(s.segment_ffts is None for s in stfts)
+    stft = tas.x.avg_stft
+    assert len(stfts) == 3 and stft is stfts[-1]
+    np.testing.assert_allclose(np.square(np.abs(stft.segment_ffts)), stft.spectrum)
+    assert tas.x.avg_stft is stft
+
+
+def test_float32_analysis_is_close_to_float64(tmp_path):
+    from model.signal import precision_report
+    config = make_prefs(tmp_path).analysis_config._replace(dtype=np.dtype(np.float32))
+    tas = TriAxisSignal(config, 'test', make_data(), 500, 0, mode='vibration', pre_calc=True, view_mode='avg')
+    assert tas.x.data.dtype == np.float32
+    assert tas.x.get_analysis().y.dtype == np.float32
+    report = precision_report(config, 500)
+    assert set(report.keys()) == {'avg', 'peak', 'psd', 'bands', 'zoom', 'spectrogram', 'velocity',
+                                   'displacement'}
+    assert all(v < 0.1 for k, v in report.items() if k != 'zoom')
+    # the zoom spectrum resolves bins far below the peak, where single precision filtering costs a little more
+    assert report['zoom'] < 0.25
+
+
+def test_float32_zoom_stays_in_single_precision():
+    from model.signal import zoom_spectrum, get_mixer
+    from model.fft import get_fft
+    assert get_mixer(1000, 500, 20.0, dtype=np.complex64).dtype == np.complex64
+    backend = get_fft('scipy')
+    dtypes = []
+
+    class RecordingFFT:
+        def fft(self, x):
+            dtypes.append(x.dtype)
+            return backend.fft(x)
+
+    x = make_data()[:, 2].astype(np.float32)
+    f, Pxx = zoom_spectrum(x, 500, 10.0, 30.0, 'hann', 'constant', RecordingFFT())
+    assert dtypes == [np.complex64]
+    assert Pxx.dtype == np.float32
+    assert abs(f[np.argmax(Pxx)] - 20.0) < 0.5
+
+
+def test_db_conversion_in_place():
+    from model.signal import amplitude_to_db_into, power_to_db_into
+    rng = np.random.default_rng(1)
+    s = rng.random((64, 32)) * 1e-3
+    s[0, 0] = 0.0
+
+    def librosa_power_to_db(p, ref):
+        log_spec = 10.0 * np.log10(np.maximum(1e-20, np.abs(p))) - 10.0 * np.log10(ref)
+        return np.maximum(log_spec, log_spec.max() - 80.0)
+
+    out = np.empty_like(s)
+    assert power_to_db_into(s, out, ref=0.5) is out
+    np.testing.assert_allclose(out, librosa_power_to_db(s, 0.5))
+    np.testing.assert_allclose(amplitude_to_db_into(s, out, ref=0.5), librosa_power_to_db(s ** 2, 0.25))
+    expected = librosa_power_to_db(s, 1.0)
+    aliased = s.copy()
+    assert power_to_db_into(aliased, aliased) is aliased
+    np.testing.assert_allclose(aliased, expected)
+    s32 = s.astype(np.float32)
+    assert power_to_db_into(s32, s32).dtype == np.float32
+
+
+def test_octave_bands(tmp_path):
+    from model.signal import get_octave_bands
+    centres, mapping = get_octave_bands(500, 512, 3)
+    assert get_octave_bands(500, 512, 3)[1] is mapping
+    assert mapping.shape == (centres.size, 257)
+    # every bin except DC is in exactly 1 band and no band is empty
+    np.testing.assert_array_equal(np.asarray(mapping.sum(axis=0)).ravel()[1:], 1)
+    assert np.asarray(mapping.sum(axis=1)).min() >= 1
+    assert np.all(np.diff(centres) > 0)
+    np.testing.assert_allclose(centres[np.argmin(np.abs(centres - 31.5))], 1000 * 2 ** -5)
+
+    config = make_prefs(tmp_path).analysis_config._replace(band_fraction=1)
+    tas = TriAxisSignal(config, 'test', make_data(), 500, 0, mode='', pre_calc=True, view_mode='bands')
+    avg_tas = TriAxisSignal(config, 'test', make_data(), 500, 0, mode='', pre_calc=True, view_mode='avg')
+    bands = tas.x.get_analysis()
+    assert bands.x.size == get_octave_bands(500, 512, 1)[0].size
+    # the 20Hz tone lands in the 16Hz octave and the band power is the sum of the bin power
+    assert bands.x[np.argmax(bands.y)] == 1000 * 2 ** -6
+    np.testing.assert_allclose(bands.y_raw.sum(), avg_tas.x.get_analysis().y_raw[1:].sum())
+    assert tas.sum.get_analysis() is not None
+
+
+def test_smooth_octave():
+    from model.signal import smooth_octave, get_octave_smoother
+    x = np.fft.rfftfreq(1024, 1 / 500)
+    y = np.random.default_rng(2).normal(size=x.size)
+    sx, sy = smooth_octave(x, y, 3)
+    assert sx is x
+    assert get_octave_smoother(x.size, 0.0, 250.0, 3) is get_octave_smoother(x.size, 0.0, 250.0, 3)
+    expected = [np.mean(y[(x >= f / 2 ** (1 / 6)) & (x <= f * 2 ** (1 / 6))]) if f > 0 else y[0] for f in x]
+    np.testing.assert_allclose(sy, expected)
+    # a flat line is unchanged
+    np.testing.assert_allclose(smooth_octave(x, np.full(x.size, 3.0), 24)[1], 3.0)
+
+
+def test_zoom_spectrum_resolves_close_tones():
+    from model.fft import get_fft
+    from model.signal import zoom_spectrum
+    fs = 500
+    t = np.arange(fs * 10) / fs
+    x = np.sin(2 * np.pi * 10.0 * t) + 0.5 * np.sin(2 * np.pi * 10.3 * t)
+    f, Pxx = zoom_spectrum(x, fs, 5, 15, 'hann', 'constant', get_fft('scipy'))
+    assert f[0] >= 5 and f[-1] <= 15
+    assert abs((f[1] - f[0]) - 0.1) < 0.001
+    from scipy.signal import find_peaks
+    peaks, _ = find_peaks(Pxx, height=Pxx.max() / 100)
+    np.testing.assert_allclose(f[peaks], [10.0, 10.3], atol=0.01)
+    # matches the power of a full length periodogram
+    np.testing.assert_allclose(Pxx[peaks], [0.5, 0.125], rtol=0.01)
+
+
+def test_zoom_view(tmp_path):
+    config = make_prefs(tmp_path).analysis_config._replace(zoom_band=(15, 25))
+    tas = TriAxisSignal(config, 'test', make_data(seconds=8), 500, 0, mode='', pre_calc=True, view_mode='zoom')
+    zoom = tas.x.get_analysis()
+    assert zoom.x[0] >= 15 and zoom.x[-1] <= 25
+    assert abs(zoom.x[np.argmax(zoom.y)] - 20.0) < 0.2
+    assert tas.sum.get_analysis() is not None
+
+
+def test_integrated_views(tmp_path):
+    from model.signal import get_integration_weights, G_IN_MM_S2
+    config = make_prefs(tmp_path).analysis_config
+    tas = TriAxisSignal(config, 'test', make_data(seconds=8), 500, 0, mode='', pre_calc=True, view_mode='velocity')
+    velocity = tas.x.get_analysis()
+    avg = tas.x.peek_analysis('avg')
+    # the avg spectrum is calculated along the way and reused
+    assert avg is not None
+    peak = np.argmax(avg.y_raw)
+    assert abs(velocity.x[peak] - 20.0) < 0.5
+    np.testing.assert_allclose(velocity.y_raw[peak] / avg.y_raw[peak],
+                               (G_IN_MM_S2 / (2 * np.pi * velocity.x[peak])) ** 2, rtol=1e-6)
+    assert np.all(velocity.y_raw[velocity.x < config.integration_floor] == 0)
+    weights = get_integration_weights(500, velocity.x.size * 2 - 2, 'displacement', config.integration_floor, '<f8')
+    assert weights is get_integration_weights(500, velocity.x.size * 2 - 2, 'displacement',
+                                              config.integration_floor, '<f8')
+    tas.x.set_view('displacement')
+    assert np.argmax(tas.x.get_analysis().y_raw) == peak
+
+
+def test_stft_geometry_matches_analysis(tmp_path):
+    from model.signal import get_stft_geometry
+    config = make_prefs(tmp_path).analysis_config
+    for seconds in [1, 2, 3]:
+        tas = TriAxisSignal(config, 'test', make_data(seconds=seconds), 500, 0, mode='', pre_calc=True,
+                            view_mode='spectrogram')
+        sxx = tas.x.get_analysis()
+        geometry = get_stft_geometry(500, 512, 500 * seconds)
+        np.testing.assert_array_equal(geometry.f, sxx.f)
+        np.testing.assert_array_equal(geometry.t, sxx.t)
+        assert sxx.sxx.shape == (geometry.f.size, geometry.t.size)
+    assert get_stft_geometry(500, 512, 500 * 600) is get_stft_geometry(500, 512, 500 * 600)
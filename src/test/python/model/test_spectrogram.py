@@ -0,0 +1,66 @@
+import numpy as np
+from PIL import Image
+
+from model.spectrogram import ImageTiles, EMPTY_DB, downsample_max, fit_to_pixels
+
+
+def test_tiles_hold_newest_slice_first():
+    tiles = ImageTiles(10, 3, tile_rows=4)
+    assert len(tiles) == 4
+    changed = tiles.append(np.arange(6 * 3, dtype=np.float32).reshape(6, 3))
+    assert changed == [0, 1]
+    assert tiles.count == 6
+    # the 2nd tile is half full so its top is 2 slices above the top of the chart
+    assert tiles.offset(1) == -2
+    np.testing.assert_array_equal(tiles.tile(1)[2:, 0], [15, 12])
+    assert np.all(tiles.tile(1)[:2] == EMPTY_DB)
+    assert tiles.offset(0) == 2
+    np.testing.assert_array_equal(tiles.tile(0)[:, 0], [9, 6, 3, 0])
+
+
+def test_only_the_written_tile_changes():
+    tiles = ImageTiles(10, 3, tile_rows=4)
+    for i in range(40):
+        changed = tiles.append(np.full((1, 3), i, dtype=np.float32))
+        assert changed == [(i // 4) % 4]
+    # the oldest tile is recycled so the newest 16 slices are held
+    held = sorted(int(v) for t in range(len(tiles)) for v in tiles.tile(t)[:, 0])
+    assert held == list(range(24, 40))
+    # each tile sits below the newer tiles
+    offsets = sorted((tiles.offset(t), tiles.tile(t)[0, 0]) for t in range(len(tiles)))
+    assert [o for o, _ in offsets] == [0, 4, 8, 12]
+    assert [v for _, v in offsets] == [39, 35, 31, 27]
+
+
+def test_padded_tiles_include_the_neighbouring_slices():
+    tiles = ImageTiles(10, 3, tile_rows=4)
+    tiles.append(np.repeat(np.arange(5, dtype=np.float32)[:, None], 3, axis=1))
+    # the newer tile only holds 1 slice so the unwritten slice above it is a copy of that slice
+    np.testing.assert_array_equal(tiles.padded(0, 2)[:, 0], [4, 4, 3, 2, 1, 0, 0, 0])
+    tiles.append(np.full((1, 3), 5, dtype=np.float32))
+    np.testing.assert_array_equal(tiles.padded(0, 2)[:, 0], [5, 4, 3, 2, 1, 0, 0, 0])
+    # the newest tile is part filled so the empty slices are copies of the newest slice
+    np.testing.assert_array_equal(tiles.padded(1, 2)[:, 0], [5, 5, 5, 5, 5, 4, 3, 2])
+    np.testing.assert_array_equal(tiles.padded(1, 0)[:, 0], [5, 5, 5, 4])
+    assert np.all(tiles.tile(1)[:2] == EMPTY_DB)
+
+
+def test_resampled_partial_tile_does_not_overshoot():
+    tiles = ImageTiles(32, 8, tile_rows=16)
+    tiles.append(np.full((3, 8), 60.0, dtype=np.float32))
+    padded = tiles.padded(0, 3)
+    upsampled = np.array(Image.fromarray(padded).resize(size=(64, padded.shape[0] * 8), resample=Image.LANCZOS))
+    np.testing.assert_allclose(upsampled, 60.0, atol=0.01)
+
+
+def test_downsample_to_pixels():
+    a = np.arange(20, dtype=np.float32).reshape(2, 10)
+    assert downsample_max(a, 20, 1) is a
+    reduced = downsample_max(a, 4, 1)
+    assert reduced.shape == (2, 4)
+    # the loudest value in each pixel
+    np.testing.assert_array_equal(reduced[0], [1, 4, 6, 9])
+    assert fit_to_pixels(1000, 300, 8) == 300
+    assert fit_to_pixels(100, 300, 8) == 300
+    assert fit_to_pixels(100, 1000, 8) == 800
+    assert fit_to_pixels(100, 150, 8) == 100
@@ -0,0 +1,91 @@
+import numpy as np
+
+from common import RingBuffer
+from model.signal import butter
+from model.vibration import MinMaxEnvelope, VibrationFilters, FilteredWindow, ZeroPhaseStream, take_new_rows
+
+
+def test_envelope_keeps_peaks_when_zoomed_out():
+    fs = 500
+    n = fs * 600
+    values = np.random.default_rng(0).normal(scale=0.01, size=n)
+    values[123457] = 5.0
+    values[234567] = -4.0
+    envelope = MinMaxEnvelope(fs)
+    envelope.update(np.arange(n), values)
+    for pixels in [200, 1000, 5000, 100000]:
+        t, y = envelope.render(0, 600, pixels)
+        assert y.max() == 5.0 and y.min() == -4.0
+        assert t.size <= 2 * pixels
+        assert abs(t[np.argmax(y)] - 123457 / fs) <= 600 / pixels + 1 / fs
+    # zoomed in so far that the raw samples are shown
+    t, y = envelope.render(246.9, 247, 1000)
+    np.testing.assert_array_equal(y, values[123450:123501])
+    np.testing.assert_allclose(t, np.arange(123450, 123501) / fs)
+
+
+def test_sliding_update_matches_full_summary():
+    fs = 500
+    rng = np.random.default_rng(1)
+    stream = rng.normal(size=20000)
+    incremental = MinMaxEnvelope(fs, block_size=16)
+    window = 3000
+    for end in range(window, stream.size, 337):
+        idx = np.arange(end - window, end) + 10
+        # the trailing samples from the last update are corrected
+        stream[end - 387:end - 337] += 0.5
+        values = stream[end - window:end].copy()
+        incremental.update(idx, values, changed_from=idx[-387])
+        full = MinMaxEnvelope(fs, block_size=16)
+        full.update(idx, values)
+        for pixels in [10, 100, 1000]:
+            for a, b in zip(incremental.render(0, window / fs, pixels), full.render(0, window / fs, pixels)):
+                np.testing.assert_array_equal(a, b)
+
+
+def test_streamed_filters_match_filtfilt():
+    fs = 500
+    n = fs * 20
+    t = np.arange(n)
+    data = np.zeros((n, 5))
+    data[:, 0] = t + 100
+    data[:, 2] = np.sin(2 * np.pi * 0.5 * t / fs) + 0.2 * np.sin(2 * np.pi * 20 * t / fs)
+    data[:, 3] = np.random.default_rng(0).normal(size=n)
+    data[:, 4] = 1.0
+    capacity = fs * 10
+    buffer = RingBuffer(capacity, dtype=(np.float64, 5))
+    filters = VibrationFilters(fs)
+    window = FilteredWindow('m', capacity)
+    settling = ZeroPhaseStream(fs, 'high').settling
+    last = None
+    for chunk in np.array_split(data, np.cumsum(np.random.default_rng(1).integers(1, 40, size=n // 20))):
+        buffer.extend(chunk)
+        rows, last = take_new_rows(buffer, last)
+        if chunk.shape[0] > 0:
+            np.testing.assert_array_equal(rows, chunk)
+            samples = filters.process('m', rows)
+            # the work per chunk is bounded by the settling time
+            assert all(v.shape[0] <= settling + chunk.shape[0] for v in samples.filtered.values())
+            window.extend(samples)
+        else:
+            assert rows is None
+    assert window.size == capacity
+    np.testing.assert_array_equal(window.idx, data[-capacity:, 0])
+    np.testing.assert_array_equal(window.values('Raw', 'y'), data[-capacity:, 3])
+    # away from the start up transient and the provisional trailing samples, the output is as per filtfilt
+    settled = slice(-capacity, -settling)
+    for i, axis in enumerate(['x', 'y', 'z']):
+        for mode, btype in [('Vibration', 'high'), ('Tilt', 'low')]:
+            expected = butter(fs, data[:, 2 + i], btype)
+            np.testing.assert_allclose(window.values(mode, axis)[:-settling], expected[settled], atol=1e-5)
+
+
+def test_envelope_exposes_the_raw_window():
+    fs = 500
+    stream = np.random.default_rng(2).normal(size=3000)
+    envelope = MinMaxEnvelope(fs, block_size=16)
+    envelope.update(np.arange(1000), stream[:1000])
+    envelope.update(np.arange(500, 1500), stream[500:1500])
+    assert envelope.fs == fs
+    assert envelope.size == 1000
+    np.testing.assert_array_equal(envelope.values, stream[500:1500])